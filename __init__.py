@@ -5,6 +5,22 @@ ScreenExplorer - A Python app for capturing screen areas and extracting text usi
 __version__ = "0.1.0"
 __author__ = "Your Name"
 
-from .screen_capture import ScreenSelector
-from .text_extractor import extract_text_and_describe
-from .main import ScreenExplorerApp
\ No newline at end of file
+import importlib
+
+# Imported on first use: Kivy, Tk and PIL are slow to load and not every caller needs them
+_LAZY = {
+    "ScreenSelector": "screen_capture",
+    "extract_text_from_image": "text_extractor",
+    "query_ollama_vision_twopass": "ollama_vision_twopass",
+    "ScreenExplorerApp": "main",
+}
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_LAZY[name]}", __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,522 @@
+"""
+asyncio versions of the Ollama session and the capture pipelines.
+
+Many requests (batch images, tiles, both passes) can be multiplexed on one
+event loop instead of a thread per request. The HTTP client is a small
+stdlib-only HTTP/1.1 implementation (keep-alive pool, chunked streaming), so
+no extra dependency is needed:
+
+    result = asyncio.run(query_ollama_vision_twopass_async("shot.png"))
+
+    session = AsyncOllamaSession()
+    async for token in session.ask_stream("Describe this", images=[b64]):
+        ...
+
+Timeouts are (connect, read) seconds like the sync path; cancelling the task
+closes the HTTP stream so the server stops generating. The blocking API in
+ollama_vision_twopass / text_extractor is unchanged.
+"""
+
+import ssl
+import json
+import time
+import asyncio
+import weakref
+from urllib.parse import urlsplit
+
+from metrics import CaptureMetrics, response_stats
+from hosts import get_host_pool
+from ollama_vision_twopass import (SessionBase, GenerationCancelled, get_ollama_settings, plan_twopass,
+                                   finish_twopass, finish_cached_twopass, encode_step, field_callback,
+                                   HTTP_POOL_SIZE, TEXT_PROMPT, VISUAL_PROMPT_STANDALONE)
+
+DEFAULT_TIMEOUT = (30, 300)   # (connect, read) seconds, as in the sync session
+
+
+class OllamaHTTPError(RuntimeError):
+    def __init__(self, status, body):
+        super().__init__(f"HTTP {status}: {body[:200]}")
+        self.status = status
+
+
+class AsyncResponse:
+    """Status, headers and a streamed body; release() hands the connection back to the pool."""
+
+    def __init__(self, client, reader, writer, status, headers, read_timeout):
+        self.client = client
+        self.status = status
+        self.headers = headers
+        self._reader = reader
+        self._writer = writer
+        self._read_timeout = read_timeout
+        self._consumed = False
+
+    async def _readline(self):
+        return await asyncio.wait_for(self._reader.readline(), self._read_timeout)
+
+    async def _readexactly(self, n):
+        return await asyncio.wait_for(self._reader.readexactly(n), self._read_timeout)
+
+    async def iter_chunks(self):
+        """Raw body pieces as they arrive (chunked, sized or read-to-close bodies)."""
+        if self.headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await self._readline()).split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    while (await self._readline()) not in (b"\r\n", b"\n", b""):
+                        pass  # trailers
+                    break
+                data = await self._readexactly(size)
+                await self._readexactly(2)
+                yield data
+        elif "content-length" in self.headers:
+            remaining = int(self.headers["content-length"])
+            while remaining:
+                data = await asyncio.wait_for(self._reader.read(min(remaining, 65536)),
+                                              self._read_timeout)
+                if not data:
+                    raise ConnectionError("connection closed mid-body")
+                remaining -= len(data)
+                yield data
+        else:
+            while True:
+                data = await asyncio.wait_for(self._reader.read(65536), self._read_timeout)
+                if not data:
+                    break
+                yield data
+            self.headers["connection"] = "close"
+        self._consumed = True
+
+    async def iter_lines(self):
+        buffer = b""
+        async for data in self.iter_chunks():
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield line
+        if buffer.strip():
+            yield buffer
+
+    async def read(self):
+        return b"".join([data async for data in self.iter_chunks()])
+
+    async def json(self):
+        return json.loads(await self.read())
+
+    def release(self):
+        """Return the connection for reuse if the body was fully read, else close it."""
+        if self._writer is None:
+            return
+        reusable = self._consumed and self.headers.get("connection", "").lower() != "close"
+        self.client._put_back(self._reader, self._writer, reusable)
+        self._writer = None
+
+    def close(self):
+        """Drop the connection (e.g. a half-read stream after cancellation)."""
+        if self._writer is not None:
+            self.client._put_back(self._reader, self._writer, False)
+            self._writer = None
+
+
+class AsyncHTTPClient:
+    """Minimal HTTP/1.1 client with a keep-alive connection pool for one host."""
+
+    def __init__(self, base_url, max_connections=HTTP_POOL_SIZE):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.https = parts.scheme == "https"
+        self.port = parts.port or (443 if self.https else 80)
+        self.base_path = parts.path.rstrip("/")
+        self._idle = []
+        self._slots = asyncio.Semaphore(max_connections)
+
+    async def _connect(self, connect_timeout):
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port,
+                                    ssl=ssl.create_default_context() if self.https else None),
+            connect_timeout)
+        return reader, writer, False
+
+    def _put_back(self, reader, writer, reusable):
+        if reusable and not writer.is_closing():
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+        self._slots.release()
+
+    async def request(self, method, path, payload=None, timeout=DEFAULT_TIMEOUT):
+        """Send a request and return an AsyncResponse once the headers have arrived."""
+        connect_timeout, read_timeout = timeout
+        body = json.dumps(payload).encode() if payload is not None else b""
+        head = (f"{method} {self.base_path}{path} HTTP/1.1\r\n"
+                f"Host: {self.host}:{self.port}\r\n"
+                "Content-Type: application/json\r\n"
+                "Accept: application/json, application/x-ndjson\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: keep-alive\r\n\r\n").encode()
+
+        await self._slots.acquire()
+        try:
+            for attempt in range(2):
+                reader, writer, reused = await self._connect(connect_timeout)
+                try:
+                    writer.write(head + body)
+                    await writer.drain()
+                    status_line = await asyncio.wait_for(reader.readline(), read_timeout)
+                    if not status_line:
+                        raise ConnectionResetError("connection closed before the response")
+                    status = int(status_line.split()[1])
+                    headers = {}
+                    while True:
+                        line = await asyncio.wait_for(reader.readline(), read_timeout)
+                        if line in (b"\r\n", b"\n", b""):
+                            break
+                        name, _, value = line.decode("latin-1").partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                    return AsyncResponse(self, reader, writer, status, headers, read_timeout)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    if not reused or attempt:
+                        raise
+                    # A pooled connection the server had already closed: retry on a fresh one
+                except BaseException:
+                    writer.close()
+                    raise
+        except BaseException:
+            self._slots.release()
+            raise
+
+
+# One client per (event loop, base URL); connections cannot move between loops
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client(url):
+    loop = asyncio.get_running_loop()
+    per_loop = _clients.setdefault(loop, {})
+    if url not in per_loop:
+        per_loop[url] = AsyncHTTPClient(url)
+    return per_loop[url]
+
+
+async def post_json(url, path, payload, timeout=DEFAULT_TIMEOUT):
+    """POST and return the decoded JSON reply (raises OllamaHTTPError on HTTP errors)."""
+    resp = await get_async_client(url).request("POST", path, payload, timeout)
+    try:
+        if resp.status >= 400:
+            raise OllamaHTTPError(resp.status, (await resp.read()).decode("utf-8", "replace"))
+        data = await resp.json()
+        resp.release()
+        return data
+    finally:
+        resp.close()
+
+
+async def post_stream(url, path, payload, timeout=DEFAULT_TIMEOUT):
+    """POST a streaming request and yield each decoded NDJSON chunk."""
+    resp = await get_async_client(url).request("POST", path, payload, timeout)
+    try:
+        if resp.status >= 400:
+            raise OllamaHTTPError(resp.status, (await resp.read()).decode("utf-8", "replace"))
+        async for line in resp.iter_lines():
+            chunk = json.loads(line)
+            if "error" in chunk:
+                raise RuntimeError(chunk["error"])
+            yield chunk
+        resp.release()
+    finally:
+        resp.close()   # no-op after release(); otherwise drops a half-read stream
+
+
+class AsyncOllamaSession(SessionBase):
+    """asyncio counterpart of OllamaSession (same modes, host selection and conversation state)."""
+
+    def __init__(self, model=None, mode=None, timeout=DEFAULT_TIMEOUT, affinity=None):
+        super().__init__(model, mode, affinity)
+        self.timeout = timeout
+
+    async def ask(self, content, images=None, callback=None):
+        """Send one user turn and return the whole reply; callback(token) streams it."""
+        if callback is not None or self.guard_cfg["enabled"]:
+            async for token in self.ask_stream(content, images=images):
+                if callback is not None:
+                    callback(token)
+            return self.messages[-1]["content"]
+
+        self._add_user_message(content, images)
+        endpoint, payload = self._request(stream=False)
+        tried = set()
+        while True:
+            host, error = self.endpoint, None
+            self.pool.begin(host)
+            try:
+                response = await post_json(self.url, endpoint, payload, self.timeout)
+                break
+            except Exception as e:
+                error = e
+                if not self._failover(e, tried):
+                    raise
+            finally:
+                self.pool.end(host, error)
+        reply = self._reply_text(response)
+        self._record_reply(response)
+        self.messages.append({"role": "assistant", "content": reply})
+        return reply
+
+    async def ask_stream(self, content, images=None):
+        """Send one user turn and yield reply tokens; a looping reply is cut short (see OllamaSession)."""
+        self._add_user_message(content, images)
+        self.last_stats = {}
+        parts = []
+        guard = self._new_guard()
+        endpoint, payload = self._request(stream=True)
+        tried = set()
+        try:
+            while True:
+                host, error = self.endpoint, None
+                chunks = post_stream(self.url, endpoint, payload, self.timeout)
+                self.pool.begin(host)
+                try:
+                    async for chunk in chunks:
+                        if chunk.get("done"):
+                            self._record_reply(chunk)
+                        token = self._reply_text(chunk)
+                        if token:
+                            parts.append(token)
+                            yield token
+                            if guard is not None and guard.feed(token):
+                                break  # closing the stream stops the generation
+                    break
+                except Exception as e:
+                    error = e
+                    # Only a turn that produced nothing yet can be replayed elsewhere
+                    if parts or not self._failover(e, tried):
+                        raise
+                finally:
+                    await chunks.aclose()
+                    self.pool.end(host, error)
+        finally:
+            # Keep the conversation consistent even if the consumer stops early
+            self.messages.append({"role": "assistant", "content": self._finish_reply(parts, guard)})
+
+
+async def gather_or_cancel(*coros):
+    """Run coroutines concurrently; if one fails, cancel the rest and raise its error."""
+    tasks = [asyncio.ensure_future(c) for c in coros]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if task.exception() is not None:
+                raise task.exception()
+        return [task.result() for task in tasks]
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _ask_once(model, prompt, image_b64, callback=None, metrics=None, name=None, affinity=None):
+    session = AsyncOllamaSession(model=model, affinity=affinity)
+    start = time.time()
+    try:
+        reply = await session.ask(prompt, images=[image_b64], callback=callback)
+    finally:
+        session.close()
+    if metrics is not None:
+        metrics.add_pass(name, session.last_stats, time.time() - start)
+    return reply
+
+
+async def run_tiled_passes_async(prepared, model, stream_callback=None, progress_callback=None,
+                                 cfg=None, metrics=None, visual=True):
+    """Async tiling.run_tiled_passes: tiles and the visual pass share the event loop."""
+    from tiling import get_tiling_settings, prepare_tiles, merge_tile_texts
+
+    cfg = cfg or get_tiling_settings()
+    if progress_callback:
+        progress_callback("Reading tiles...")
+    tiles = await asyncio.to_thread(prepare_tiles, prepared, model, cfg)
+    limit = asyncio.Semaphore(max(1, cfg["max_workers"]))
+    done_count = [0]
+
+    async def read_tile(r, c, tile):
+        image_b64 = await asyncio.to_thread(lambda: tile.b64)
+        async with limit:
+            text = await _ask_once(model, TEXT_PROMPT, image_b64, metrics=metrics, name=f"tile_{r}_{c}")
+        done_count[0] += 1
+        if progress_callback:
+            progress_callback(f"Read tile {done_count[0]}/{len(tiles)}")
+        return (r, c), text
+
+    async def describe():
+        if not visual:
+            return ""
+        visual_b64 = await asyncio.to_thread(lambda: prepared.b64)
+        return await _ask_once(model, VISUAL_PROMPT_STANDALONE, visual_b64,
+                               field_callback(stream_callback, "visual"), metrics, "visual")
+
+    visual_text, *tile_results = await gather_or_cancel(
+        describe(), *(read_tile(r, c, tile) for r, c, _, tile in tiles))
+
+    text = merge_tile_texts(dict(tile_results), cfg["overlap"])
+    if stream_callback is not None:
+        stream_callback("text", text)
+    return text, visual_text
+
+
+async def run_planned_passes_async(plan, stream_callback=None, progress_callback=None, metrics=None):
+    """Async run_planned_passes: the conversations of plan["passes"] share the event loop."""
+    metrics = metrics if metrics is not None else CaptureMetrics()
+    affinity = object()   # all conversations on the same host
+    replies = {}
+
+    async def run(steps):
+        session = AsyncOllamaSession(model=plan["model"], mode=plan["session_mode"], affinity=affinity)
+        try:
+            for step in steps:
+                if progress_callback and step.status:
+                    progress_callback(step.status)
+                image_input = await asyncio.to_thread(encode_step, step, metrics)
+                start = time.time()
+                replies[step.field] = await session.ask(step.prompt,
+                                                        images=[image_input] if image_input else None,
+                                                        callback=field_callback(stream_callback, step.field))
+                metrics.add_pass(step.field, session.last_stats, time.time() - start)
+        finally:
+            session.close()
+
+    if plan["passes"]:
+        await gather_or_cancel(*(run(steps) for steps in plan["passes"]))
+    return replies.get("text", ""), replies.get("visual", "")
+
+
+async def run_cancellable(coro, cancel_event=None):
+    """Await `coro`; setting `cancel_event` (a CancelToken, from any thread) cancels it.
+
+    The task is cancelled as if the caller had cancelled it, which closes its
+    HTTP streams, and GenerationCancelled is raised as in the blocking API.
+    """
+    if cancel_event is None:
+        return await coro
+    loop = asyncio.get_running_loop()
+    task = asyncio.ensure_future(coro)
+
+    def cancel():
+        loop.call_soon_threadsafe(task.cancel)
+
+    cancel_event.add_callback(cancel)
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if cancel_event.is_set():
+            raise GenerationCancelled() from None
+        raise
+    finally:
+        cancel_event.remove_callback(cancel)
+        if not task.done():
+            task.cancel()
+
+
+async def query_ollama_vision_twopass_async(image, progress_callback=None, use_cache=True, model=None,
+                                            stream_callback=None, concurrent=None, tiled=None,
+                                            metrics=None, cancel_event=None, route=None, record=True):
+    """Async query_ollama_vision_twopass: same modes, result shape, cache and metrics.
+
+    Preprocessing, encoding and cache I/O run in worker threads so the event
+    loop stays free for other requests. Cancel the task, or `cancel_event` (a
+    CancelToken) as with the blocking version, to abort generation.
+    """
+    start_time = time.time()
+    metrics = metrics if metrics is not None else CaptureMetrics()
+    plan = await asyncio.to_thread(plan_twopass, image, model, use_cache, concurrent, tiled, metrics,
+                                   route, record)
+    if plan["cached"] is not None:
+        if progress_callback:
+            progress_callback("Loaded cached result")
+        return finish_cached_twopass(plan, metrics, start_time)
+
+    if plan["mode"] == "tiled":
+        passes = run_tiled_passes_async(plan["prepared"], plan["model"], stream_callback, progress_callback,
+                                        plan["tiling_cfg"], metrics, plan["visual"])
+    else:
+        passes = run_planned_passes_async(plan, stream_callback, progress_callback, metrics)
+    text_content, visual_description = await run_cancellable(passes, cancel_event)
+
+    return await asyncio.to_thread(finish_twopass, plan, text_content, visual_description, metrics,
+                                   start_time)
+
+
+async def extract_text_from_image_async(image, use_cache=True, metrics=None, stream_callback=None,
+                                        record=True):
+    """Async text_extractor.extract_text_from_image (single schema-constrained pass).
+
+    Falls back to the blocking two-step path, in a worker thread, if the
+    server rejects the constrained request or its reply is unusable.
+    Returns (text, visual).
+    """
+    from text_extractor import (prepare_extraction, finish_extraction, single_pass_request,
+                                single_pass_result, single_pass_rejected, extract_text_two_step)
+
+    start_time = time.time()
+    metrics = metrics if metrics is not None else CaptureMetrics()
+    _, model, _ = get_ollama_settings()
+    prepared, cache, cache_key, cached = await asyncio.to_thread(
+        prepare_extraction, image, model, use_cache, True, metrics)
+    if cached is not None:
+        return await asyncio.to_thread(finish_extraction, cached["text"], cached["visual"], None, None,
+                                       metrics, start_time, record)
+
+    def encode():
+        with metrics.stage("encode"):
+            return prepared.b64
+
+    payload, parser, guard = single_pass_request(model, await asyncio.to_thread(encode), stream_callback)
+    start = time.time()
+    pool = get_host_pool()
+    host, tried, received = pool.select(model), set(), False
+    while True:
+        error = None
+        chunks = post_stream(host.url, "/api/chat", payload)
+        pool.begin(host)
+        try:
+            async for chunk in chunks:
+                content = (chunk.get("message") or {}).get("content") or ""
+                received = received or bool(content)
+                parser.feed(content)
+                if guard is not None and guard.feed(content):
+                    print(f"[DEBUG] Generation stuck in a loop, stopped early: {guard.event}")
+                    metrics.add_pass("extract", {"repetition": guard.event, "host": host.url},
+                                     time.time() - start)
+                    break  # closing the stream stops the generation
+                if chunk.get("done"):
+                    metrics.add_pass("extract", dict(response_stats(chunk), host=host.url),
+                                     time.time() - start)
+            break
+        except Exception as e:
+            error = e
+        finally:
+            await chunks.aclose()
+            pool.end(host, error)
+        # Only a reply that produced nothing yet can be replayed elsewhere
+        host = None if received else pool.failover(host, error, tried, model)
+        if host is None:
+            if not single_pass_rejected(error):
+                raise error
+            print(f"[DEBUG] single-pass request rejected: {error}")
+            break
+    result = single_pass_result(parser, guard) if error is None else None
+    if result is not None:
+        text, visual = result["text"], result["visual"]
+    else:
+        print("[DEBUG] Falling back to two-step extraction")
+        metrics.set("fallback", True)
+        text, visual = await asyncio.to_thread(extract_text_two_step, prepared, metrics, stream_callback)
+    return await asyncio.to_thread(finish_extraction, text, visual, cache, cache_key, metrics, start_time,
+                                   record)
@@ -0,0 +1,221 @@
+"""
+Headless batch mode: push a directory or glob of images through the two-pass
+pipeline with a bounded pool of concurrent workers, streaming JSONL results.
+
+    python batch.py screenshots/ -o results.jsonl -j 4
+    python batch.py "captures/**/*.png" -o results.jsonl --resume
+    python batch.py screenshots/ -j 16 --async   # one event loop instead of a thread per request
+"""
+
+import os
+import logging
+import sys
+import glob
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from settings import default_workers
+from ollama_vision_twopass import query_ollama_vision_twopass
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".webp", ".tif", ".tiff")
+
+
+def collect_images(inputs, recursive=False):
+    """Expand directories and glob patterns into a sorted, de-duplicated list of image paths."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, "**", "*") if recursive else os.path.join(item, "*")
+            candidates = glob.glob(pattern, recursive=recursive)
+        else:
+            candidates = glob.glob(item, recursive=True) or [item]
+        paths.extend(p for p in candidates
+                     if os.path.isfile(p) and p.lower().endswith(IMAGE_EXTENSIONS))
+    seen = set()
+    unique = []
+    for p in sorted(os.path.abspath(p) for p in paths):
+        if p not in seen:
+            seen.add(p)
+            unique.append(p)
+    return unique
+
+
+def load_completed(output_path):
+    """Images already processed successfully in a previous (possibly crashed) run."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # truncated last line after a crash
+            if isinstance(record, dict) and "image" in record and "error" not in record:
+                done.add(record["image"])
+    return done
+
+
+def _make_record(path, start, result=None, error=None):
+    record = {"image": path, "duration": round(time.time() - start, 3)}
+    if error is not None:
+        record["error"] = str(error)
+        return record
+    record.update(result)
+    record.pop("combined", None)
+    return record
+
+
+def process_one(path, model=None, use_cache=True):
+    start = time.time()
+    try:
+        result = query_ollama_vision_twopass(path, use_cache=use_cache, model=model)
+    except Exception as e:
+        return _make_record(path, start, error=e)
+    return _make_record(path, start, result)
+
+
+async def process_one_async(path, model=None, use_cache=True):
+    from async_ollama import query_ollama_vision_twopass_async
+
+    start = time.time()
+    try:
+        result = await query_ollama_vision_twopass_async(path, use_cache=use_cache, model=model)
+    except Exception as e:
+        return _make_record(path, start, error=e)
+    return _make_record(path, start, result)
+
+
+def _repair_output(output_path):
+    """A crash can leave a half-written last line; start on a fresh one."""
+    if os.path.exists(output_path) and os.path.getsize(output_path):
+        with open(output_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+        if needs_newline:
+            with open(output_path, "a", encoding="utf-8") as f:
+                f.write("\n")
+
+
+def run_batch(images, output_path, workers=2, model=None, use_cache=True, on_record=None):
+    """Process `images` with at most `workers` in flight, appending each record as it finishes.
+
+    Returns (succeeded, failed) counts.
+    """
+    succeeded = failed = 0
+    pending = iter(images)
+    in_flight = set()
+    _repair_output(output_path)
+
+    with open(output_path, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=workers) as pool:
+
+        def submit_next():
+            path = next(pending, None)
+            if path is not None:
+                in_flight.add(pool.submit(process_one, path, model, use_cache))
+            return path is not None
+
+        # Keep the queue bounded: only `workers` images are ever submitted at once
+        for _ in range(workers):
+            if not submit_next():
+                break
+
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                in_flight.discard(fut)
+                record = fut.result()
+                # Records are written from this thread only, as each image completes
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                if "error" in record:
+                    failed += 1
+                else:
+                    succeeded += 1
+                if on_record:
+                    on_record(record)
+                submit_next()
+
+    return succeeded, failed
+
+
+def run_batch_async(images, output_path, workers=2, model=None, use_cache=True, on_record=None):
+    """run_batch on a single event loop: `workers` coroutines instead of threads.
+
+    Returns (succeeded, failed) counts.
+    """
+    _repair_output(output_path)
+    counts = {"succeeded": 0, "failed": 0}
+    pending = iter(images)
+
+    async def worker(out):
+        # Workers pull the next image only when they are free, so at most `workers` are in flight
+        for path in pending:
+            record = await process_one_async(path, model, use_cache)
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            counts["failed" if "error" in record else "succeeded"] += 1
+            if on_record:
+                on_record(record)
+
+    async def run():
+        with open(output_path, "a", encoding="utf-8") as out:
+            await asyncio.gather(*(worker(out) for _ in range(workers)))
+
+    asyncio.run(run())
+    return counts["succeeded"], counts["failed"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process a directory or glob of images with Ollama.")
+    parser.add_argument("inputs", nargs="+", help="image files, directories or glob patterns")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="JSONL output file")
+    parser.add_argument("-j", "--workers", type=int, default=default_workers(),
+                        help="concurrent requests (defaults to $OLLAMA_NUM_PARALLEL or 2)")
+    parser.add_argument("-m", "--model", default=None, help="override the configured model")
+    parser.add_argument("-r", "--recursive", action="store_true", help="descend into sub-directories")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip images that already have a successful record in the output")
+    parser.add_argument("--no-cache", action="store_true", help="bypass the result cache")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="multiplex requests on one asyncio event loop instead of threads")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="only log warnings from host failover, the cache and the history")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO,
+                        format="[%(name)s] %(message)s")
+
+    images = collect_images(args.inputs, recursive=args.recursive)
+    if args.resume:
+        done = load_completed(args.output)
+        skipped = len([p for p in images if p in done])
+        images = [p for p in images if p not in done]
+        if skipped:
+            print(f"Resuming: skipping {skipped} already processed image(s)", file=sys.stderr)
+    if not images:
+        print("No images to process", file=sys.stderr)
+        return 0
+
+    total = len(images)
+    counter = {"n": 0}
+    start = time.time()
+
+    def report(record):
+        counter["n"] += 1
+        status = "error: " + record["error"] if "error" in record else f"{record['duration']:.1f}s"
+        print(f"[{counter['n']}/{total}] {record['image']} ({status})", file=sys.stderr)
+
+    runner = run_batch_async if args.use_async else run_batch
+    succeeded, failed = runner(images, args.output, workers=max(1, args.workers),
+                                  model=args.model, use_cache=not args.no_cache, on_record=report)
+    print(f"Done: {succeeded} succeeded, {failed} failed in {time.time() - start:.1f}s",
+          file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""
+Reproducible latency benchmarks for the capture pipeline.
+
+Runs against a local mock Ollama server by default, so numbers only reflect
+our own code plus a fixed, configurable generation cost:
+
+    python benchmark.py                          # print p50/p95 per stage
+    python benchmark.py --save-baseline bench.json
+    python benchmark.py --compare bench.json     # exit 1 on regressions
+    python benchmark.py --url http://127.0.0.1:11434 --iterations 3   # real server
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import contextlib
+
+from PIL import Image, ImageDraw
+
+from mock_ollama import MockOllamaServer
+
+SYNTHETIC_SIZES = [(640, 480), (1280, 720), (1920, 1080), (3840, 2160)]
+STAGES = ["decode", "resize", "encode", "request", "parse"]
+PIPELINES = ["twopass", "text_extractor", "capture_to_result"]
+
+
+def make_synthetic_image(width, height):
+    """Screenshot-like test image: a title bar, panels and rows of text."""
+    img = Image.new("RGB", (width, height), (30, 30, 30))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, 0, width, 28), fill=(60, 60, 60))
+    draw.text((10, 8), "benchmark.py - Vision Explorer", fill=(220, 220, 220))
+    draw.rectangle((0, 29, width // 5, height), fill=(40, 40, 40))
+    for i, y in enumerate(range(40, height - 16, 18)):
+        draw.text((8, y), f"file_{i:03d}.py", fill=(180, 180, 180))
+        draw.text((width // 5 + 12, y),
+                  f"{i:4d}  def function_{i}(arg, value={i * 7}): return arg * value  # comment",
+                  fill=(200, 200, 120) if i % 3 else (120, 200, 220))
+    return img
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    pos = (len(ordered) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def summarize(samples):
+    return {"p50_ms": round(percentile(samples, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+            "n": len(samples)}
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def bench_stages(png_bytes, model, iterations):
+    """Time each stage of one capture separately."""
+    from image_pipeline import load_image, prepare_image, PreparedImage
+    from ollama_vision_twopass import OllamaSession, TEXT_PROMPT
+    from text_extractor import extract_json_substring, smart_parse_json
+
+    samples = {stage: [] for stage in STAGES}
+    for _ in range(iterations):
+        t, img = timed(load_image, png_bytes)
+        samples["decode"].append(t)
+
+        t, prepared = timed(prepare_image, img, model)
+        samples["resize"].append(t)
+
+        fresh = PreparedImage(prepared.image)
+        t, b64 = timed(lambda: fresh.b64)
+        samples["encode"].append(t)
+
+        session = OllamaSession(model=model)
+        t, reply = timed(session.ask, TEXT_PROMPT + " Answer as JSON.", images=[b64])
+        session.close()
+        samples["request"].append(t)
+
+        t, _ = timed(lambda: smart_parse_json(extract_json_substring(reply)))
+        samples["parse"].append(t)
+    return {stage: summarize(values) for stage, values in samples.items()}
+
+
+def bench_pipelines(png_bytes, model, iterations):
+    """End-to-end timings of the public entry points (caches, history and metrics log disabled)."""
+    from image_pipeline import load_image, prepare_image
+    from ollama_vision_twopass import query_ollama_vision_twopass
+    from text_extractor import extract_text_from_image
+
+    samples = {name: [] for name in PIPELINES}
+    screen = make_synthetic_image(2560, 1440)
+    width, height = load_image(png_bytes).size
+    for _ in range(iterations):
+        t, _ = timed(query_ollama_vision_twopass, load_image(png_bytes), use_cache=False, model=model,
+                     record=False)
+        samples["twopass"].append(t)
+
+        t, _ = timed(extract_text_from_image, load_image(png_bytes), use_cache=False, record=False)
+        samples["text_extractor"].append(t)
+
+        # What the app does after the selection overlay closes, minus the GUI
+        def capture_to_result():
+            region = screen.crop((0, 0, min(screen.width, width), min(screen.height, height)))
+            prepared = prepare_image(region, model)
+            return query_ollama_vision_twopass(prepared, use_cache=False, model=model, record=False)
+        t, _ = timed(capture_to_result)
+        samples["capture_to_result"].append(t)
+    return {name: summarize(values) for name, values in samples.items()}
+
+
+def benchmark_images(include_sample=True, sizes=SYNTHETIC_SIZES):
+    images = {}
+    sample = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample.png")
+    if include_sample and os.path.exists(sample):
+        with open(sample, "rb") as f:
+            images["sample.png"] = f.read()
+    for w, h in sizes:
+        buf = io.BytesIO()
+        make_synthetic_image(w, h).save(buf, format="PNG")
+        images[f"synthetic_{w}x{h}"] = buf.getvalue()
+    return images
+
+
+def run(iterations=5, url=None, model=None, token_delay=0.005, sizes=SYNTHETIC_SIZES):
+    server = None
+    if url is None:
+        server = MockOllamaServer(token_delay=token_delay).start()
+        url = server.url
+    os.environ["VISIONEXPLORER_OLLAMA_URL"] = url
+
+    from ollama_vision_twopass import get_ollama_settings
+    model = model or get_ollama_settings()[1]
+
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                 "platform": platform.platform(), "model": model, "iterations": iterations,
+                 "server": "mock" if server else url, "token_delay": token_delay if server else None},
+        "images": {},
+    }
+    try:
+        for name, png_bytes in benchmark_images(sizes=sizes).items():
+            print(f"Benchmarking {name}...", file=sys.stderr)
+            # The pipelines print debug output; keep the report readable
+            with contextlib.redirect_stdout(io.StringIO()):
+                stages = bench_stages(png_bytes, model, iterations)
+                pipelines = bench_pipelines(png_bytes, model, iterations)
+            report["images"][name] = {"stages": stages, "pipelines": pipelines}
+    finally:
+        if server:
+            server.stop()
+    return report
+
+
+def _rows(report):
+    for image, data in report["images"].items():
+        for group in ("stages", "pipelines"):
+            for name, stats in data[group].items():
+                yield image, f"{group[:-1]}:{name}", stats
+
+
+def print_report(report, baseline=None):
+    base = {}
+    if baseline:
+        base = {(img, key): stats for img, key, stats in _rows(baseline)}
+    print(f"{'image':<24} {'measure':<28} {'p50 ms':>10} {'p95 ms':>10} {'Δp50':>8}")
+    for image, key, stats in _rows(report):
+        delta = ""
+        old = base.get((image, key))
+        if old and old["p50_ms"]:
+            delta = f"{(stats['p50_ms'] / old['p50_ms'] - 1) * 100:+.0f}%"
+        print(f"{image:<24} {key:<28} {stats['p50_ms']:>10.2f} {stats['p95_ms']:>10.2f} {delta:>8}")
+
+
+def find_regressions(report, baseline, threshold=0.20, min_ms=1.0):
+    """Measures whose p50 grew by more than `threshold` (ignoring sub-`min_ms` noise)."""
+    base = {(img, key): stats for img, key, stats in _rows(baseline)}
+    regressions = []
+    for image, key, stats in _rows(report):
+        old = base.get((image, key))
+        if not old:
+            continue
+        if stats["p50_ms"] - old["p50_ms"] > min_ms and stats["p50_ms"] > old["p50_ms"] * (1 + threshold):
+            regressions.append((image, key, old["p50_ms"], stats["p50_ms"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Vision Explorer pipeline.")
+    parser.add_argument("-n", "--iterations", type=int, default=5)
+    parser.add_argument("--url", help="benchmark a real Ollama server instead of the mock")
+    parser.add_argument("--model", help="model name (defaults to the configured one)")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="mock seconds per generated token")
+    parser.add_argument("--save-baseline", metavar="FILE", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.20, help="allowed p50 slowdown (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    report = run(iterations=args.iterations, url=args.url, model=args.model,
+                 token_delay=args.token_delay)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}", file=sys.stderr)
+
+    if baseline:
+        regressions = find_regressions(report, baseline, args.threshold)
+        for image, key, old, new in regressions:
+            print(f"REGRESSION {image} {key}: {old:.2f}ms -> {new:.2f}ms", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
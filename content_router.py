@@ -0,0 +1,284 @@
+"""
+Cheap local pre-analysis that decides which model passes a capture needs.
+
+A few NumPy statistics over the image (or a sample of it, for large captures)
+estimate how likely it is to contain text and how much there is to describe
+visually:
+
+- edge density: share of pixels with a strong local gradient;
+- connected components of the "ink" mask (pixels that stand out from their
+  neighbourhood), and how many look like glyphs: small, similar heights,
+  thin strokes relative to their height;
+- colour entropy of the quantised RGB histogram (text editors and terminals
+  use a handful of colours, photos thousands), the share of saturated pixels
+  (charts, maps) and how much of the area large non-glyph shapes cover.
+
+route_capture() turns these into a route: skip the visual pass on plain text,
+skip both on a blank capture, and optionally send simple captures to a smaller
+model. The OCR pass is only skipped when there is not a single glyph-like
+shape and the colours say photo: a lone "42" or a big "87%" still gets read. NumPy is optional;
+without it every capture takes the full route.
+"""
+
+import math
+import time
+
+from PIL import Image
+
+from settings import get_section
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+DEFAULT_ROUTER_SETTINGS = {
+    "enabled": True,
+    "analysis_pixels": 640000,  # pixel budget of the statistics (see _analysis_views)
+    "skip_text_min_entropy": 6.0,  # colour entropy (bits) a capture with no glyph-like shape needs to skip OCR
+    "skip_visual_below": 0.2,   # visual richness under which plain text gets no description...
+    "text_only_above": 0.5,     # ...provided the text likelihood is at least this
+    "small_model": None,        # e.g. "qwen2.5vl:3b" when the default is a larger model
+    "downgrade_below": 0.35,    # captures scoring under this on both axes use small_model
+}
+
+
+def get_router_settings():
+    cfg = dict(DEFAULT_ROUTER_SETTINGS)
+    cfg.update(get_section("router"))
+    return cfg
+
+
+def _clip(value):
+    return max(0.0, min(1.0, value))
+
+
+def color_stats(img, side=512):
+    """(entropy, colourful share) of a thumbnail.
+
+    entropy is the Shannon entropy (bits) of its colours quantised to 4 bits
+    per channel; colourful share is the fraction covered by solid saturated
+    areas.
+    """
+    thumb = img.convert("RGB")
+    thumb.thumbnail((side, side))
+    rgb = np.asarray(thumb, dtype=np.uint16) >> 4
+    codes = (rgb[..., 0] << 8) | (rgb[..., 1] << 4) | rgb[..., 2]
+    counts = np.bincount(codes.ravel(), minlength=4096)
+    p = counts[counts > 0] / codes.size
+    hsv = np.asarray(thumb.convert("HSV"))
+    colourful = (hsv[..., 1] > 40) & (hsv[..., 2] > 48)
+    # Only solid areas count: a 3x3 erosion drops thin strokes such as syntax-highlighted text
+    solid = colourful[1:-1, 1:-1].copy()
+    for dy in (0, 1, 2):
+        for dx in (0, 1, 2):
+            solid &= colourful[dy:dy + solid.shape[0], dx:dx + solid.shape[1]]
+    return float(-(p * np.log2(p)).sum()), float(solid.mean()) if solid.size else 0.0
+
+
+def edge_density(gray, threshold=48):
+    """Share of pixels whose horizontal plus vertical gradient exceeds `threshold`."""
+    gx = np.abs(np.diff(gray, axis=1))[:-1, :]
+    gy = np.abs(np.diff(gray, axis=0))[:, :-1]
+    return float(((gx + gy) > threshold).mean()) if gx.size else 0.0
+
+
+def ink_mask(gray, window=15, contrast=24):
+    """Pixels darker (or, on dark backgrounds, lighter) than their neighbourhood by `contrast`."""
+    h, w = gray.shape
+    r = window // 2
+    # Local mean through an integral image: O(1) per pixel whatever the window
+    padded = np.pad(gray, r + 1, mode="edge")
+    integral = padded.cumsum(axis=0).cumsum(axis=1)
+    total = (integral[window:window + h, window:window + w] - integral[:h, window:window + w]
+             - integral[window:window + h, :w] + integral[:h, :w])
+    local_mean = total / (window * window)
+    if np.median(gray) >= 128:
+        return gray < local_mean - contrast
+    return gray > local_mean + contrast
+
+
+def _row_runs(mask):
+    """Horizontal runs of True pixels as (rows, starts, ends), ends exclusive."""
+    h, w = mask.shape
+    padded = np.zeros((h, w + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    rows, cols = np.nonzero(np.diff(padded, axis=1))
+    return rows[0::2], cols[0::2], cols[1::2]
+
+
+def connected_components(mask):
+    """8-connected components of `mask` as a dict of per-component NumPy arrays.
+
+    Built from horizontal runs joined with union-find, so the Python-level
+    work scales with the number of runs rather than pixels. Keys: x0, y0, x1,
+    y1 (bounding box, exclusive), area, runs (run count).
+    """
+    rows, starts, ends = _row_runs(mask)
+    n = len(rows)
+    if n == 0:
+        return {k: np.zeros(0, dtype=np.int64) for k in ("x0", "y0", "x1", "y1", "area", "runs")}
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # Runs are sorted by row then column; walk each pair of adjacent rows with two pointers
+    row_start = np.searchsorted(rows, np.arange(mask.shape[0] + 1))
+    starts_l, ends_l = starts.tolist(), ends.tolist()
+    for y in range(mask.shape[0] - 1):
+        a, a_end = row_start[y], row_start[y + 1]
+        b, b_end = a_end, row_start[y + 2]
+        while a < a_end and b < b_end:
+            # 8-connectivity: diagonal neighbours touch, hence the +1
+            if starts_l[a] <= ends_l[b] and starts_l[b] <= ends_l[a]:
+                ra, rb = find(a), find(b)
+                if ra != rb:
+                    parent[rb] = ra
+            if ends_l[a] < ends_l[b]:
+                a += 1
+            else:
+                b += 1
+    roots = np.array([find(i) for i in range(n)])
+    labels, index = np.unique(roots, return_inverse=True)
+    k = len(labels)
+    comp = {
+        "x0": np.full(k, mask.shape[1]), "y0": np.full(k, mask.shape[0]),
+        "x1": np.zeros(k, dtype=np.int64), "y1": np.zeros(k, dtype=np.int64),
+        "area": np.zeros(k, dtype=np.int64), "runs": np.zeros(k, dtype=np.int64),
+    }
+    np.minimum.at(comp["x0"], index, starts)
+    np.minimum.at(comp["y0"], index, rows)
+    np.maximum.at(comp["x1"], index, ends)
+    np.maximum.at(comp["y1"], index, rows + 1)
+    np.add.at(comp["area"], index, ends - starts)
+    np.add.at(comp["runs"], index, 1)
+    return comp
+
+
+def _analysis_views(img, max_pixels):
+    """Grayscale arrays covering `img` within a pixel budget, at a scale where glyphs survive.
+
+    Small captures are analysed whole. Larger ones are halved at most (so
+    screen text keeps a readable height) and, if still over budget, sampled
+    as a 3x3 grid of crops spread over the image.
+    """
+    gray = img.convert("L")
+    scale = max(0.5, min(1.0, math.sqrt(max_pixels / (gray.width * gray.height))))
+    if scale == 0.5:
+        gray = gray.reduce(2)   # box filter, much cheaper than resampling
+    elif scale < 1.0:
+        gray = gray.resize((max(1, int(gray.width * scale)), max(1, int(gray.height * scale))),
+                           Image.Resampling.BILINEAR)
+    if gray.width * gray.height <= max_pixels * 1.05:
+        return [np.asarray(gray, dtype=np.float32)]
+    cw = min(gray.width // 3, int(math.sqrt(max_pixels / 9 * gray.width / gray.height)))
+    ch = min(gray.height // 3, int(max_pixels / 9 / max(cw, 1)))
+    views = []
+    for gy in range(3):
+        for gx in range(3):
+            left = gx * gray.width // 3 + (gray.width // 3 - cw) // 2
+            top = gy * gray.height // 3 + (gray.height // 3 - ch) // 2
+            views.append(np.asarray(gray.crop((left, top, left + cw, top + ch)), dtype=np.float32))
+    return views
+
+
+def analyze(img, max_pixels=640000):
+    """Content statistics of a PIL image (see the module docstring)."""
+    parts = {"w": [], "h": [], "area": [], "runs": [], "max_h": []}
+    edges, pixels = 0.0, 0
+    for gray in _analysis_views(img, max_pixels):
+        comp = connected_components(ink_mask(gray))
+        parts["w"].append(comp["x1"] - comp["x0"])
+        parts["h"].append(comp["y1"] - comp["y0"])
+        parts["area"].append(comp["area"])
+        parts["runs"].append(comp["runs"])
+        # Headings and KPI tiles use large fonts: a glyph may be as tall as most of the view
+        parts["max_h"].append(np.full(len(comp["area"]), max(48, int(gray.shape[0] * 0.9))))
+        edges += edge_density(gray) * gray.size
+        pixels += gray.size
+    w, h, area, runs, max_h = (np.concatenate(parts[k]) for k in ("w", "h", "area", "runs", "max_h"))
+
+    keep = area >= 4   # single specks are noise or anti-aliasing
+    w, h, area, runs, max_h = w[keep], h[keep], area[keep], runs[keep], max_h[keep]
+    fill = area / np.maximum(w * h, 1)
+    stroke = area / np.maximum(runs, 1)   # mean run length, about the stroke width
+    shaped = (h >= 4) & (w <= 12 * h) & (fill >= 0.08) & (fill <= 0.9) & (stroke <= 0.45 * h + 1)
+    glyph = shaped & (h <= max_h)
+    # Body-text sized glyphs drive the height consistency and the graphics estimate
+    body = shaped & (h <= 48)
+    heights = h[body]
+    height_cv = float(heights.std() / heights.mean()) if len(heights) >= 3 else 1.0
+    # Large shapes that are not body text (chart areas, icons, photo detail), by bounding-box area
+    graphic = ~body & (h > 48) & (w > 48)
+    entropy, colourful = color_stats(img)
+    return {
+        "pixels": pixels,
+        "edge_density": round(edges / max(pixels, 1), 4),
+        "components": int(keep.sum()),
+        "glyphs": int(glyph.sum()),
+        "glyph_share": round(float(glyph.mean()) if len(glyph) else 0.0, 3),
+        "glyph_height_cv": round(height_cv, 3),
+        "graphic_cover": round(min(1.0, float((w[graphic] * h[graphic]).sum()) / max(pixels, 1)), 3),
+        "color_entropy": round(entropy, 3),
+        "colourful_share": round(colourful, 3),
+    }
+
+
+def text_score(features):
+    """0..1 likelihood that the capture contains text worth an OCR pass."""
+    if features["glyphs"] == 0:
+        return 0.0
+    # Enough glyph-like shapes, making up most of the ink, with consistent heights
+    count = _clip(math.log1p(features["glyphs"]) / math.log1p(60))
+    consistency = _clip(1.0 - features["glyph_height_cv"])
+    return round(0.5 * count + 0.3 * features["glyph_share"] + 0.2 * consistency, 3)
+
+
+def visual_score(features):
+    """0..1 estimate of how much there is to describe beyond the text."""
+    # Any one strong cue is enough: many colours (photos), large saturated areas (charts,
+    # maps), or big non-text shapes
+    colours = _clip((features["color_entropy"] - 3.0) / 4.0)
+    colourful = _clip(features["colourful_share"] / 0.15)
+    graphics = _clip(features["graphic_cover"] / 0.25)
+    return round(max(colours, colourful, graphics), 3)
+
+
+def route_capture(image, model, cfg=None):
+    """Decide which passes to run for `image` (a PIL image) and on which model.
+
+    Returns {"decision", "text", "visual", "model", "downgraded", "scores",
+    "features", "time"}; decision is "full", "text_only", "visual_only" or
+    "empty", and "text"/"visual" say whether that pass runs.
+    """
+    cfg = cfg or get_router_settings()
+    route = {"decision": "full", "text": True, "visual": True, "model": model, "downgraded": False}
+    if not cfg["enabled"] or not HAS_NUMPY:
+        return route
+    start = time.perf_counter()
+    features = analyze(image, cfg["analysis_pixels"])
+    scores = {"text": text_score(features), "visual": visual_score(features)}
+
+    # A smooth gradient also has no edges or ink, so blank takes near-single-colour content too
+    blank = (features["components"] == 0 and features["edge_density"] < 0.001
+             and features["color_entropy"] < 1.0)
+    # Skipping OCR loses text outright, so it takes no glyph-like shape at all plus a blank
+    # capture or photo-like colours; a missed visual pass only costs a description
+    run_text = not (features["glyphs"] == 0
+                    and (blank or features["color_entropy"] >= cfg["skip_text_min_entropy"]))
+    run_visual = not (scores["visual"] < cfg["skip_visual_below"] and scores["text"] >= cfg["text_only_above"])
+    if blank:
+        run_visual = False   # blank or single-colour capture: nothing to read or describe
+    route.update(text=run_text, visual=run_visual, scores=scores, features=features)
+    route["decision"] = {(True, True): "full", (True, False): "text_only",
+                         (False, True): "visual_only", (False, False): "empty"}[(run_text, run_visual)]
+    if (cfg["small_model"] and route["decision"] != "empty"
+            and max(scores.values()) < cfg["downgrade_below"]):
+        route.update(model=cfg["small_model"], downgraded=True)
+    route["time"] = round(time.perf_counter() - start, 4)
+    return route
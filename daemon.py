@@ -0,0 +1,268 @@
+"""
+Resident daemon: keeps the interpreter, the UI and the Ollama connections warm
+between captures and takes commands from vx.py over a Unix domain socket.
+
+    python daemon.py              # Kivy window, hidden until the first capture
+    python daemon.py --headless   # no window; capture results go back to the client
+
+Protocol: one JSON request line per connection, answered by one JSON line,
+{"ok": true, ...} or {"ok": false, "error": "..."}. Commands:
+
+    ping                                   liveness check
+    status                                 uptime, mode and Ollama host health
+    capture  {wait, use_cache, multi}      select a screen region (several with multi) and read it
+    extract  {path, single, use_cache}     read an image file
+    show                                   bring the window up (UI mode)
+    quit                                   stop the daemon
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import logging
+import argparse
+import threading
+import socketserver
+
+from vx import socket_path
+
+
+def _result_reply(result):
+    reply = {"ok": True, "text": result["text"], "visual": result["visual"],
+             "route": result.get("route"), "metrics": result.get("metrics")}
+    if "regions" in result:
+        reply["regions"] = result["regions"]
+    return reply
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return  # a liveness probe that connected and hung up
+        try:
+            reply = self.server.daemon.handle(json.loads(line))
+        except Exception as e:
+            print(f"[DEBUG] daemon command failed: {e}")
+            reply = {"ok": False, "error": str(e)}
+        try:
+            self.wfile.write(json.dumps(reply, ensure_ascii=False).encode("utf-8") + b"\n")
+        except OSError:
+            pass  # the client gave up waiting
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Daemon:
+    """Socket server plus a main-thread call queue.
+
+    Tk and Kivy must run on the main thread, so commands that open the
+    selection overlay are handed to it: through Kivy's Clock when `app` (a
+    ScreenExplorerApp) is given, otherwise through a queue served by
+    run_headless().
+    """
+
+    def __init__(self, path=None, app=None):
+        self.path = path or socket_path()
+        self.app = app
+        self.started = time.time()
+        self.warmer = None
+        self._main_calls = queue.Queue()
+        self._stopped = threading.Event()
+        self._stop_lock = threading.Lock()
+        self._server = None
+
+    @property
+    def mode(self):
+        return "ui" if self.app is not None else "headless"
+
+    def call_on_main(self, fn):
+        """Run fn() on the main thread and return its result (or raise its error)."""
+        done = threading.Event()
+        box = {}
+
+        def run(*_):
+            try:
+                box["result"] = fn()
+            except BaseException as e:
+                box["error"] = e
+            done.set()
+
+        if self.app is not None:
+            from kivy.clock import Clock
+            Clock.schedule_once(run)
+        else:
+            self._main_calls.put(run)
+        while not done.wait(0.5):
+            if self._stopped.is_set():
+                raise RuntimeError("daemon is shutting down")
+        if "error" in box:
+            raise box["error"]
+        return box["result"]
+
+    def handle(self, request):
+        cmd = request.get("cmd")
+        if cmd == "ping":
+            return {"ok": True, "pid": os.getpid(), "mode": self.mode}
+        if cmd == "status":
+            from hosts import get_host_pool
+            return {"ok": True, "pid": os.getpid(), "mode": self.mode,
+                    "uptime": round(time.time() - self.started, 1), "hosts": get_host_pool().status()}
+        if cmd == "extract":
+            return self.extract(request["path"], request.get("single", False),
+                                request.get("use_cache", True))
+        if cmd == "capture":
+            return self.capture(request.get("wait", False), request.get("use_cache", True),
+                                request.get("multi", False))
+        if cmd == "show":
+            if self.app is None:
+                return {"ok": False, "error": "the headless daemon has no window"}
+            self.call_on_main(self.app.show_window)
+            return {"ok": True}
+        if cmd == "quit":
+            threading.Thread(target=self.stop, daemon=True).start()
+            return {"ok": True, "message": "stopping"}
+        return {"ok": False, "error": f"unknown command: {cmd!r}"}
+
+    def extract(self, path, single=False, use_cache=True):
+        if not os.path.isfile(path):
+            return {"ok": False, "error": f"no such file: {path}"}
+        if single:
+            from text_extractor import extract_text_from_image
+            text, visual = extract_text_from_image(path, use_cache=use_cache)
+            return {"ok": True, "text": text, "visual": visual}
+        from ollama_vision_twopass import query_ollama_vision_twopass
+        return _result_reply(query_ollama_vision_twopass(path, use_cache=use_cache))
+
+    def capture(self, wait=False, use_cache=True, multi=False):
+        if self.app is not None:
+            start = self.app.capture_regions if multi else self.app.capture_screen
+            job = self.call_on_main(lambda: start(None))
+            if job is None:
+                return {"ok": True, "message": "capture cancelled"}
+            if not wait:
+                return {"ok": True, "message": "capturing"}
+            job.wait()
+            if job.result is None:
+                return {"ok": False, "error": str(job.error or f"capture {job.state}")}
+            return _result_reply(job.result)
+
+        from screen_capture import ScreenSelector
+        from ollama_vision_twopass import query_ollama_vision_twopass
+        from metrics import CaptureMetrics
+
+        selector = ScreenSelector(exit_on_cancel=False, multi=multi)
+        image = self.call_on_main(selector.capture_image)
+        if image is None:
+            return {"ok": True, "message": "capture cancelled"}
+        metrics = CaptureMetrics()
+        metrics.add_stage("capture", selector.capture_duration)
+        if multi:
+            from regions import query_regions
+            return _result_reply(query_regions(image, selector.bboxes, use_cache=use_cache, metrics=metrics))
+        # The headless daemon has nowhere else to show the result, so it always waits
+        return _result_reply(query_ollama_vision_twopass(image, use_cache=use_cache, metrics=metrics))
+
+    def _claim_socket(self):
+        """Remove a stale socket file; refuse to start if another daemon answers on it."""
+        if not os.path.exists(self.path):
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(self.path)
+            except OSError:
+                os.unlink(self.path)
+                return
+        raise RuntimeError(f"a daemon is already listening on {self.path}")
+
+    def serve(self):
+        """Start accepting commands on a background thread."""
+        from ollama_vision_twopass import get_ollama_settings
+        from hosts import get_host_pool
+
+        self._claim_socket()
+        self._server = _Server(self.path, _Handler)
+        self._server.daemon = self
+        os.chmod(self.path, 0o600)
+        threading.Thread(target=self._server.serve_forever, name="daemon-socket", daemon=True).start()
+        # Connect to the hosts and load the model before the first command arrives
+        get_host_pool()
+        print(f"[DEBUG] Daemon listening on {self.path} ({self.mode}, model {get_ollama_settings()[1]})")
+        return self
+
+    def run_headless(self):
+        """Serve main-thread calls until stop(); used when there is no Kivy app."""
+        from settings import get_section
+        from ollama_vision_twopass import ModelWarmer
+
+        if get_section("prewarm").get("enabled", True):
+            self.warmer = ModelWarmer(interval=get_section("prewarm").get("interval")).start()
+        while not self._stopped.is_set():
+            try:
+                call = self._main_calls.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            call()
+
+    def stop(self):
+        with self._stop_lock:
+            server, self._server = self._server, None
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+                if os.path.exists(self.path):
+                    os.unlink(self.path)
+            # Set last, so the main thread cannot exit before the socket file is gone
+            self._stopped.set()
+        if self.warmer is not None:
+            self.warmer.stop()
+        if self.app is not None:
+            from kivy.clock import Clock
+            Clock.schedule_once(lambda dt: self.app.stop())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run VisionExplorer as a resident daemon.")
+    parser.add_argument("--headless", action="store_true", help="no window; results go to the client")
+    parser.add_argument("--socket", default=None, help="socket path (default: see vx.py)")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="only log warnings from host failover, the cache and the history")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO,
+                        format="[%(name)s] %(message)s")
+
+    try:
+        Daemon(args.socket)._claim_socket()
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    if args.headless:
+        daemon = Daemon(args.socket).serve()
+        try:
+            daemon.run_headless()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            daemon.stop()
+        return 0
+
+    from main import ScreenExplorerApp
+
+    app = ScreenExplorerApp(daemon_mode=True)
+    daemon = Daemon(args.socket, app).serve()
+    try:
+        app.run()
+    finally:
+        daemon.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+"""
+Payload encoder: picks the cheapest image encoding per content class.
+
+Every capture used to go out as default-compression PNG, which is slow to
+encode for large screenshots and makes big request bodies. Captures are now
+classed as "text" (screens of text and UI), "mixed" or "photo" from their
+colour count, and each class has candidate encodings:
+lossless ones for text and mixed content, where lossy artefacts hurt OCR, and
+lossy ones for photos. EncoderSelector measures each candidate on real
+captures (encode plus base64 time and payload size) and then uses the one with
+the lowest cost. A lossy candidate added for text or mixed content is checked
+against `min_psnr` every `validate_every` captures it encodes, not only
+while it is being measured, and dropped for that class the first time it falls short. Cost is encode time plus transfer
+time at `bandwidth_mb_per_s`. Every `explore_every` captures of a class it
+re-measures another candidate.
+
+Encoding runs on a small worker pool (see PreparedImage.encode_async), so
+it overlaps with routing and the cache lookup.
+
+    python encoder.py sample.png shot.png    # compare every encoding on some images
+"""
+
+import logging
+import io
+import sys
+import math
+import time
+import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageChops, ImageStat, features
+
+from settings import get_section
+
+logger = logging.getLogger(__name__)
+
+# name -> (PIL format, save options)
+PROFILES = {
+    "png": ("PNG", {}),
+    "png_fast": ("PNG", {"compress_level": 1}),
+    "webp_lossless": ("WEBP", {"lossless": True, "quality": 0, "method": 0}),
+    "jpeg_hq": ("JPEG", {"quality": 92, "subsampling": 0}),
+    "jpeg": ("JPEG", {"quality": 85}),
+    "webp": ("WEBP", {"quality": 85, "method": 0}),
+}
+LOSSLESS = {"png", "png_fast", "webp_lossless"}
+
+DEFAULT_ENCODER_SETTINGS = {
+    "enabled": True,
+    "candidates": {
+        "text": ["png_fast", "webp_lossless"],
+        "mixed": ["png_fast", "webp_lossless"],
+        "photo": ["jpeg", "webp", "jpeg_hq"],
+    },
+    "min_psnr": 40.0,           # lossy encodings of text and mixed captures must keep this PSNR (dB)...
+    "validate_every": 1,        # ...checked on every Nth capture they encode (1: all of them)
+    "bandwidth_mb_per_s": 100,  # transfer speed used to weigh payload size against encode time
+    "explore_every": 50,        # re-measure a candidate every N captures of a class
+    "workers": 2,
+}
+
+
+def get_encoder_settings():
+    cfg = dict(DEFAULT_ENCODER_SETTINGS)
+    cfg.update(get_section("encoder"))
+    return cfg
+
+
+def content_class(img):
+    """"text", "mixed" or "photo", from the share of distinct colours in a 96x96 sample."""
+    sample = img.convert("RGB").resize((96, 96), Image.Resampling.NEAREST)
+    colors = sample.getcolors(96 * 96)
+    ratio = len(colors) / (96 * 96)
+    if ratio < 0.12:
+        return "text"
+    if ratio < 0.45:
+        return "mixed"
+    return "photo"
+
+
+def psnr(a, b):
+    """Peak signal-to-noise ratio between two same-sized images, in dB."""
+    diff = ImageChops.difference(a.convert("RGB"), b.convert("RGB"))
+    mse = sum(rms * rms for rms in ImageStat.Stat(diff).rms) / 3
+    return float("inf") if mse == 0 else 20 * math.log10(255 / math.sqrt(mse))
+
+
+def encode(img, profile):
+    """Encode `img` with a profile from PROFILES; returns the bytes."""
+    fmt, options = PROFILES[profile]
+    if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    elif fmt == "WEBP" and img.mode not in ("RGB", "RGBA", "L"):
+        img = img.convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, **options)
+    return buf.getvalue()
+
+
+class Encoded:
+    """One encoded payload: bytes, base64 text and what it cost."""
+
+    def __init__(self, data, b64, profile, content_class, seconds):
+        self.data = data
+        self.b64 = b64
+        self.profile = profile
+        self.content_class = content_class
+        self.seconds = seconds
+
+    def info(self):
+        return {"format": self.profile, "class": self.content_class, "bytes": len(self.data),
+                "b64_bytes": len(self.b64), "encode_ms": round(self.seconds * 1000, 1)}
+
+
+class EncoderSelector:
+    """Learns the cheapest acceptable encoding of each content class from the captures it encodes."""
+
+    def __init__(self, cfg=None):
+        self.cfg = cfg or get_encoder_settings()
+        available = {name for name, (fmt, _) in PROFILES.items()
+                     if fmt != "WEBP" or features.check("webp")}
+        self.candidates = {cls: [p for p in names if p in available]
+                           for cls, names in self.cfg["candidates"].items()}
+        self._stats = {}      # (class, profile) -> [seconds per megapixel, bytes per megapixel, samples]
+        self._rejected = set()
+        self._counts = {}
+        self._uses = {}       # (class, profile) -> captures encoded, for validate_every
+        self._lock = threading.Lock()
+
+    def cost(self, seconds_per_mp, bytes_per_mp):
+        return seconds_per_mp + bytes_per_mp / (self.cfg["bandwidth_mb_per_s"] * 1e6)
+
+    def choose(self, cls):
+        """(profile, exploring) for the next capture of class `cls`."""
+        with self._lock:
+            candidates = [p for p in self.candidates.get(cls) or ["png_fast"]
+                          if (cls, p) not in self._rejected] or ["png_fast"]
+            count = self._counts[cls] = self._counts.get(cls, 0) + 1
+            unmeasured = [p for p in candidates if (cls, p) not in self._stats]
+            if unmeasured:
+                return unmeasured[0], True
+            if len(candidates) > 1 and count % self.cfg["explore_every"] == 0:
+                # Re-measure the candidate with the fewest samples, in case conditions changed
+                return min(candidates, key=lambda p: self._stats[(cls, p)][2]), True
+            return min(candidates, key=lambda p: self.cost(*self._stats[(cls, p)][:2])), False
+
+    def record(self, cls, profile, megapixels, seconds, nbytes, quality=None):
+        with self._lock:
+            if quality is not None and quality < self.cfg["min_psnr"]:
+                self._rejected.add((cls, profile))
+                return
+            mp = max(megapixels, 0.01)
+            sample = (seconds / mp, nbytes / mp)
+            entry = self._stats.get((cls, profile))
+            if entry is None:
+                self._stats[(cls, profile)] = [sample[0], sample[1], 1]
+            else:
+                # Moving average, so one slow encode (e.g. a busy CPU) doesn't decide for good
+                entry[0] += (sample[0] - entry[0]) * 0.3
+                entry[1] += (sample[1] - entry[1]) * 0.3
+                entry[2] += 1
+
+    def encode(self, img, cls=None):
+        """Encoded payload of `img`, choosing the encoding for its content class."""
+        cls = cls or content_class(img)
+        profile, exploring = self.choose(cls)
+        start = time.perf_counter()
+        data = encode(img, profile)
+        b64 = base64.b64encode(data).decode()
+        seconds = time.perf_counter() - start
+        quality = None
+        if profile not in LOSSLESS and cls != "photo" and (exploring or self._validation_due(cls, profile)):
+            with Image.open(io.BytesIO(data)) as decoded:
+                quality = psnr(img, decoded)
+        self.record(cls, profile, img.size[0] * img.size[1] / 1e6, seconds, len(b64), quality)
+        if quality is not None and quality < self.cfg["min_psnr"]:
+            # Too lossy for this content: fall back to the lossless default for this capture
+            logger.debug("%s too lossy for %s content (%.1f dB), not using it", profile, cls, quality)
+            return self.encode(img, cls)
+        return Encoded(data, b64, profile, cls, seconds)
+
+    def _validation_due(self, cls, profile):
+        with self._lock:
+            uses = self._uses[(cls, profile)] = self._uses.get((cls, profile), 0) + 1
+            return uses % max(1, self.cfg["validate_every"]) == 0
+
+    def status(self):
+        with self._lock:
+            return {f"{cls}/{p}": {"ms_per_mp": round(s[0] * 1000, 1), "kb_per_mp": round(s[1] / 1024),
+                                   "samples": s[2]}
+                    for (cls, p), s in self._stats.items()}
+
+
+_selector = None
+_pool = None
+_lock = threading.Lock()
+
+
+def get_encoder():
+    """The process-wide EncoderSelector, or None when the encoder is disabled (plain PNG)."""
+    global _selector
+    cfg = get_encoder_settings()
+    if not cfg["enabled"]:
+        return None
+    with _lock:
+        if _selector is None:
+            _selector = EncoderSelector(cfg)
+        return _selector
+
+
+def get_encode_pool():
+    """Worker threads that encode payloads in the background."""
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=get_encoder_settings()["workers"],
+                                       thread_name_prefix="encode")
+        return _pool
+
+
+def bench(paths, repeat=3):
+    """Encode each image with every profile; prints time, size and PSNR."""
+    print(f"{'image':<24}{'class':<7}{'profile':<15}{'encode ms':>10}{'b64 KB':>9}{'PSNR':>8}")
+    for path in paths:
+        img = Image.open(path)
+        img.load()
+        cls = content_class(img)
+        for profile in PROFILES:
+            if PROFILES[profile][0] == "WEBP" and not features.check("webp"):
+                continue
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                data = encode(img, profile)
+                b64 = base64.b64encode(data)
+                times.append(time.perf_counter() - start)
+            with Image.open(io.BytesIO(data)) as decoded:
+                quality = psnr(img, decoded)
+            name = path if len(path) <= 23 else "…" + path[-22:]
+            print(f"{name:<24}{cls:<7}{profile:<15}{min(times) * 1000:>10.1f}{len(b64) / 1024:>9.0f}"
+                  f"{quality:>8.1f}")
+
+
+if __name__ == "__main__":
+    bench(sys.argv[1:] or ["sample.png"])
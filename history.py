@@ -0,0 +1,295 @@
+"""
+Capture history: every result with its timings and a thumbnail, kept in a
+local SQLite database with an FTS5 full-text index over the extracted text
+and the visual description.
+
+Writes go through a background thread so recording never delays a result.
+Searches use the FTS index in rowid order and stop at the requested page, so
+they stay fast with tens of thousands of captures. The store also backs the
+result cache (see result_cache.py): a capture whose cache key matches a
+stored one is answered from here even after the cache itself has evicted it.
+"""
+
+import logging
+import io
+import os
+import re
+import json
+import time
+import queue
+import sqlite3
+import threading
+
+from settings import get_section, get_data_dir
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HISTORY_SETTINGS = {
+    "enabled": True,
+    "path": None,              # defaults to ~/.cache/visionexplorer/history.sqlite3
+    "max_entries": 100000,     # oldest captures are pruned beyond this; 0 keeps everything
+    "thumbnail_side": 256,
+    "thumbnail_quality": 70,   # JPEG quality of the stored thumbnails
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    source TEXT,
+    model TEXT,
+    mode TEXT,
+    route TEXT,
+    width INTEGER,
+    height INTEGER,
+    text TEXT NOT NULL DEFAULT '',
+    visual TEXT NOT NULL DEFAULT '',
+    metrics TEXT,
+    digest TEXT,
+    content TEXT
+);
+CREATE TABLE IF NOT EXISTS thumbnails (
+    capture_id INTEGER PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS captures_thumbnail_ad AFTER DELETE ON captures BEGIN
+    DELETE FROM thumbnails WHERE capture_id = old.id;
+END;
+"""
+
+# External-content FTS table kept in sync by triggers, so the text is stored only once
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS captures_fts USING fts5(
+    text, visual, content='captures', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS captures_fts_ai AFTER INSERT ON captures BEGIN
+    INSERT INTO captures_fts(rowid, text, visual) VALUES (new.id, new.text, new.visual);
+END;
+CREATE TRIGGER IF NOT EXISTS captures_fts_ad AFTER DELETE ON captures BEGIN
+    INSERT INTO captures_fts(captures_fts, rowid, text, visual) VALUES ('delete', old.id, old.text, old.visual);
+END;
+"""
+
+_LIST_COLUMNS = "c.id, c.created, c.model, c.mode, c.route, c.width, c.height"
+
+
+def get_history_settings():
+    cfg = dict(DEFAULT_HISTORY_SETTINGS)
+    cfg.update(get_section("history"))
+    return cfg
+
+
+def fts_query(text):
+    """FTS5 expression for free text: every word must match, the last one as a prefix."""
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    terms = ['"%s"' % w for w in words]
+    terms[-1] += "*"   # match while the user is still typing
+    return " ".join(terms)
+
+
+def make_thumbnail(img, side=256, quality=70):
+    """JPEG bytes of `img` scaled down to fit in side x side."""
+    thumb = img.convert("RGB")
+    thumb.thumbnail((side, side))
+    buf = io.BytesIO()
+    thumb.save(buf, format="JPEG", quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+class HistoryStore:
+    """SQLite capture history; add() queues a write, the other methods query directly."""
+
+    def __init__(self, path, max_entries=100000, thumbnail_side=256, thumbnail_quality=70):
+        self.path = path
+        self.max_entries = max_entries
+        self.thumbnail_side = thumbnail_side
+        self.thumbnail_quality = thumbnail_quality
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        columns = {row["name"] for row in self._db.execute("PRAGMA table_info(captures)")}
+        if "content" not in columns:
+            # Databases from before exact content keys: their perceptual keys are never matched
+            self._db.execute("ALTER TABLE captures ADD COLUMN content TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS captures_content ON captures(digest, content)")
+        try:
+            self._db.executescript(FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError as e:
+            # SQLite built without FTS5: search falls back to LIKE scans
+            logger.warning("FTS5 unavailable, history search will be slower: %s", e)
+            self.has_fts = False
+        self._queue = queue.Queue()
+        self._inserts = 0
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+
+    # ---------------------------------------------------------------- writing
+
+    def add(self, result, image=None, source=None, model=None, key=None):
+        """Queue one capture: a pipeline result dict, the image for its thumbnail and its cache key."""
+        self._queue.put((time.time(), dict(result), image, source, model, key))
+
+    def flush(self):
+        """Block until every queued capture has been written."""
+        self._queue.join()
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._insert(*item)
+            except Exception as e:
+                logger.warning("history write failed: %s", e)
+            finally:
+                self._queue.task_done()
+
+    def _insert(self, created, result, image, source, model, key):
+        metrics = result.get("metrics") or {}
+        route = result.get("route") or {}
+        thumbnail = None
+        if image is not None:
+            thumbnail = make_thumbnail(image, self.thumbnail_side, self.thumbnail_quality)
+        size = metrics.get("original_size") or (list(image.size) if image is not None else [None, None])
+        digest, content = (key.digest, key.content) if key else (None, None)
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                cur = self._db.execute(
+                    "INSERT INTO captures (created, source, model, mode, route, width, height, text, visual,"
+                    " metrics, digest, content) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (created, source, model or metrics.get("model"), metrics.get("mode"),
+                     route.get("decision") or metrics.get("route"), size[0], size[1],
+                     result.get("text") or "", result.get("visual") or "",
+                     json.dumps(metrics) if metrics else None,
+                     digest, content))
+                if thumbnail is not None:
+                    self._db.execute("INSERT INTO thumbnails (capture_id, data) VALUES (?, ?)",
+                                     (cur.lastrowid, thumbnail))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._inserts += 1
+            if self.max_entries and self._inserts % 100 == 1:
+                self._prune()
+
+    def _prune(self):
+        row = self._db.execute("SELECT id FROM captures ORDER BY id DESC LIMIT 1 OFFSET ?",
+                               (self.max_entries,)).fetchone()
+        if row is not None:
+            self._db.execute("DELETE FROM captures WHERE id <= ?", (row["id"],))
+
+    def delete(self, capture_id):
+        with self._lock:
+            self._db.execute("DELETE FROM captures WHERE id = ?", (capture_id,))
+
+    # ---------------------------------------------------------------- reading
+
+    def search(self, query="", limit=50, before=None, marks=("[", "]")):
+        """Newest captures matching `query` (all captures if empty), at most `limit`.
+
+        Each row is a dict with id, created, model, mode, route, width, height
+        and snippet (the matching excerpt with matches wrapped in `marks`, or
+        the start of the text). Pass the last id as `before` for the next page.
+        """
+        match = fts_query(query) if query else None
+        before = before if before is not None else 1 << 62
+        with self._lock:
+            if match and self.has_fts:
+                rows = self._db.execute(
+                    f"SELECT {_LIST_COLUMNS}, snippet(captures_fts, -1, ?, ?, '…', 10) AS snippet"
+                    " FROM captures_fts JOIN captures c ON c.id = captures_fts.rowid"
+                    " WHERE captures_fts MATCH ? AND captures_fts.rowid < ?"
+                    " ORDER BY captures_fts.rowid DESC LIMIT ?", (*marks, match, before, limit)).fetchall()
+            elif query:
+                like = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                rows = self._db.execute(
+                    f"SELECT {_LIST_COLUMNS}, substr(c.text, 1, 120) AS snippet FROM captures c"
+                    " WHERE (c.text LIKE ? ESCAPE '\\' OR c.visual LIKE ? ESCAPE '\\') AND c.id < ?"
+                    " ORDER BY c.id DESC LIMIT ?", (like, like, before, limit)).fetchall()
+            else:
+                rows = self._db.execute(
+                    f"SELECT {_LIST_COLUMNS}, substr(c.text, 1, 120) AS snippet FROM captures c"
+                    " WHERE c.id < ? ORDER BY c.id DESC LIMIT ?", (before, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, capture_id):
+        """The full record of one capture (text, visual, metrics...), or None."""
+        with self._lock:
+            row = self._db.execute("SELECT * FROM captures WHERE id = ?", (capture_id,)).fetchone()
+        if row is None:
+            return None
+        record = dict(row)
+        record["metrics"] = json.loads(record["metrics"]) if record["metrics"] else None
+        return record
+
+    def thumbnail(self, capture_id):
+        """JPEG bytes of a capture's thumbnail, or None."""
+        with self._lock:
+            row = self._db.execute("SELECT data FROM thumbnails WHERE capture_id = ?",
+                                   (capture_id,)).fetchone()
+        return row["data"] if row else None
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM captures").fetchone()[0]
+
+    def lookup(self, digest, content):
+        """Stored result for a result-cache key: same prompts and size, and exactly the same pixels.
+
+        Only thumbnails are kept, so near duplicates can't be checked
+        pixel by pixel and are never served from here.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT text, visual FROM captures WHERE digest = ? AND content = ?"
+                " ORDER BY id DESC LIMIT 1", (digest, content)).fetchone()
+        if row is None:
+            return None
+        return {
+            "text": row["text"],
+            "visual": row["visual"],
+            "combined": f"TEXT CONTENT:\n{row['text']}\n\nVISUAL DESCRIPTION:\n{row['visual']}",
+        }
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join(timeout=5)
+        with self._lock:
+            self._db.close()
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_history():
+    """The process-wide HistoryStore, or None when history is disabled."""
+    global _history
+    cfg = get_history_settings()
+    if not cfg["enabled"]:
+        return None
+    with _history_lock:
+        if _history is None:
+            path = cfg["path"] or os.path.join(get_data_dir(), "history.sqlite3")
+            _history = HistoryStore(path, cfg["max_entries"], cfg["thumbnail_side"],
+                                    cfg["thumbnail_quality"])
+        return _history
+
+
+def record_capture(result, plan):
+    """Queue a finished two-pass result (see ollama_vision_twopass.finish_twopass)."""
+    store = get_history()
+    if store is None:
+        return
+    source = plan.get("source")
+    store.add(result, plan["prepared"].image, source if isinstance(source, str) else None,
+              plan["model"], plan["cache_key"])
@@ -0,0 +1,193 @@
+"""
+Searchable capture history popup for the Kivy app (see history.py).
+
+The list is a RecycleView, so only the visible rows exist as widgets; queries
+run on a worker thread after a short typing pause and results arrive a page
+at a time as the list is scrolled to the end.
+"""
+
+import io
+import time
+import threading
+
+from kivy.clock import Clock
+from kivy.core.image import Image as CoreImage
+from kivy.properties import NumericProperty, ObjectProperty
+from kivy.uix.behaviors import ButtonBehavior
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.button import Button
+from kivy.uix.image import Image
+from kivy.uix.label import Label
+from kivy.uix.popup import Popup
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.textinput import TextInput
+from kivy.utils import escape_markup
+from PIL import Image as PILImage
+
+from metrics import format_summary
+
+# Seconds without typing before a search runs, and rows fetched per page
+SEARCH_DELAY = 0.15
+PAGE_SIZE = 100
+
+# Match markers passed to the store; swapped for Kivy markup after escaping
+_MARKS = ("\x01", "\x02")
+
+
+def _row_text(row):
+    when = time.strftime("%Y-%m-%d %H:%M", time.localtime(row["created"]))
+    details = " · ".join(str(v) for v in (f"{row['width']}x{row['height']}" if row["width"] else None,
+                                          row["route"] or row["mode"], row["model"]) if v)
+    snippet = escape_markup(" ".join((row["snippet"] or "").split()))
+    snippet = snippet.replace(_MARKS[0], "[b][color=ffd966]").replace(_MARKS[1], "[/color][/b]")
+    return f"[color=999999]{when}  {escape_markup(details)}[/color]\n{snippet or '[i](no text)[/i]'}"
+
+
+class HistoryRow(ButtonBehavior, Label):
+    capture_id = NumericProperty(0)
+    panel = ObjectProperty(None, allownone=True)
+
+    def __init__(self, **kwargs):
+        super().__init__(markup=True, halign="left", valign="middle", shorten=True,
+                         shorten_from="right", color=(0.9, 0.9, 0.9, 1), **kwargs)
+        self.bind(size=self.setter("text_size"))
+
+    def on_release(self):
+        self.panel.select(self.capture_id)
+
+
+class HistoryPopup(Popup):
+    """Search box and result list on the left, thumbnail and details of the selected capture on the right.
+
+    on_open_capture(record, image) is called on the main thread when "Load"
+    is pressed, with the stored record (see HistoryStore.get) and the
+    thumbnail as a PIL image (or None).
+    """
+
+    def __init__(self, store, on_open_capture=None, **kwargs):
+        kwargs.setdefault("title", "Capture History")
+        kwargs.setdefault("size_hint", (0.9, 0.9))
+        super().__init__(**kwargs)
+        self.store = store
+        self.on_open_capture = on_open_capture
+        self._query = ""
+        self._generation = 0
+        self._search_event = None
+        self._loading = False
+        self._exhausted = False
+        self._selected = None
+
+        layout = BoxLayout(orientation="horizontal", spacing=10)
+        left = BoxLayout(orientation="vertical", spacing=5)
+        self.search_input = TextInput(hint_text="Search extracted text and descriptions",
+                                      multiline=False, size_hint_y=None, height=36)
+        self.search_input.bind(text=self.on_search_text)
+        left.add_widget(self.search_input)
+
+        self.results = RecycleView(viewclass=HistoryRow, bar_width=8, scroll_type=["bars", "content"])
+        rows = RecycleBoxLayout(orientation="vertical", default_size=(None, 52),
+                                default_size_hint=(1, None), size_hint_y=None, spacing=2)
+        rows.bind(minimum_height=rows.setter("height"))
+        self.results.add_widget(rows)
+        self.results.bind(scroll_y=self.on_scroll)
+        left.add_widget(self.results)
+
+        self.count_label = Label(text="", size_hint_y=None, height=20, halign="left",
+                                 color=(0.6, 0.6, 0.6, 1), font_size="12sp")
+        self.count_label.bind(size=self.count_label.setter("text_size"))
+        left.add_widget(self.count_label)
+
+        right = BoxLayout(orientation="vertical", spacing=5, size_hint_x=0.45)
+        self.preview = Image(allow_stretch=True, keep_ratio=True)
+        right.add_widget(self.preview)
+        self.details = TextInput(text="", readonly=True, background_color=(0.2, 0.2, 0.2, 1),
+                                 foreground_color=(0.9, 0.9, 0.9, 1))
+        right.add_widget(self.details)
+        buttons = BoxLayout(orientation="horizontal", size_hint_y=None, height=40, spacing=5)
+        self.load_btn = Button(text="Load", disabled=True)
+        self.load_btn.bind(on_press=self.on_load)
+        close_btn = Button(text="Close")
+        close_btn.bind(on_press=lambda *_: self.dismiss())
+        buttons.add_widget(self.load_btn)
+        buttons.add_widget(close_btn)
+        right.add_widget(buttons)
+
+        layout.add_widget(left)
+        layout.add_widget(right)
+        self.content = layout
+        self.bind(on_open=lambda *_: self.run_search(""))
+
+    # ---------------------------------------------------------------- searching
+
+    def on_search_text(self, instance, text):
+        if self._search_event is not None:
+            self._search_event.cancel()
+        self._search_event = Clock.schedule_once(lambda dt: self.run_search(text.strip()), SEARCH_DELAY)
+
+    def run_search(self, query):
+        self._query = query
+        self._generation += 1
+        self._exhausted = False
+        self.results.data = []
+        self.results.scroll_y = 1
+        self._fetch(None)
+
+    def on_scroll(self, instance, scroll_y):
+        data = self.results.data
+        if scroll_y <= 0.02 and data and not self._loading and not self._exhausted:
+            self._fetch(data[-1]["capture_id"])
+
+    def _fetch(self, before):
+        """Query one page on a worker thread; stale replies (the query changed meanwhile) are dropped."""
+        generation, query = self._generation, self._query
+        self._loading = True
+
+        def work():
+            start = time.time()
+            try:
+                rows = self.store.search(query, limit=PAGE_SIZE, before=before, marks=_MARKS)
+            except Exception as e:
+                print(f"[DEBUG] history search failed: {e}")
+                rows = []
+            elapsed = time.time() - start
+            Clock.schedule_once(lambda dt: self._apply(generation, rows, elapsed))
+
+        threading.Thread(target=work, daemon=True).start()
+
+    def _apply(self, generation, rows, elapsed):
+        if generation != self._generation:
+            return
+        self._loading = False
+        self._exhausted = len(rows) < PAGE_SIZE
+        self.results.data = self.results.data + [
+            {"text": _row_text(row), "capture_id": row["id"], "panel": self} for row in rows]
+        shown = len(self.results.data)
+        more = "" if self._exhausted else "+"
+        self.count_label.text = f"{shown}{more} captures ({elapsed * 1000:.0f} ms)"
+
+    # ---------------------------------------------------------------- selection
+
+    def select(self, capture_id):
+        record = self.store.get(capture_id)
+        if record is None:
+            return
+        data = self.store.thumbnail(capture_id)
+        image = PILImage.open(io.BytesIO(data)) if data else None
+        self._selected = (record, image)
+        self.preview.texture = CoreImage(io.BytesIO(data), ext="jpg").texture if data else None
+        when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record["created"]))
+        lines = [f"Captured: {when}", f"Model: {record['model']}  Mode: {record['mode']}"]
+        if record["route"]:
+            lines.append(f"Route: {record['route']}")
+        if record["metrics"]:
+            lines.append(format_summary(record["metrics"]))
+        lines += ["", "TEXT:", record["text"], "", "VISUAL:", record["visual"]]
+        self.details.text = "\n".join(lines)
+        self.details.cursor = (0, 0)
+        self.load_btn.disabled = self.on_open_capture is None
+
+    def on_load(self, instance):
+        if self._selected is not None and self.on_open_capture is not None:
+            self.on_open_capture(*self._selected)
+            self.dismiss()
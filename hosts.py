@@ -0,0 +1,290 @@
+"""
+Load balancing across several Ollama servers.
+
+config.json may list the servers under "ollama_endpoints":
+
+    "ollama_endpoints": [
+        {"url": "http://10.0.0.11:11434", "weight": 2, "models": ["qwen2.5vl:3b"]},
+        {"url": "http://10.0.0.12:11434"}
+    ]
+
+Without it the single "ollama_url" is used, as before. VISIONEXPLORER_OLLAMA_URL
+overrides both and may hold several comma-separated URLs.
+
+Each request goes to the endpoint serving the model with the fewest
+outstanding requests relative to its weight. A background thread probes
+/api/tags; hosts that fail a probe or a request are ejected for a back-off
+period and re-admitted once a probe succeeds. Requests that share an
+affinity key (the passes of one capture) stick to the same host so its
+loaded model and prompt cache are reused.
+"""
+
+import logging
+import os
+import json
+import time
+import itertools
+import threading
+from collections import OrderedDict
+
+import requests
+
+from settings import get_section
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST_SETTINGS = {
+    "probe_interval": 15.0,    # seconds between health probes (0 disables them)
+    "probe_timeout": 2.0,
+    "eject_seconds": 10.0,     # first ejection; doubles on every further failure
+    "max_eject_seconds": 300.0,
+    "max_attempts": 3,         # hosts tried for one request before giving up
+    "affinity_size": 256,      # remembered capture -> host assignments
+}
+
+# Gateway errors mean the host (or a proxy in front of it) is unusable, not the request
+RETRY_STATUSES = (502, 503, 504)
+
+
+def get_host_settings():
+    cfg = dict(DEFAULT_HOST_SETTINGS)
+    cfg.update(get_section("hosts"))
+    return cfg
+
+
+def _model_name(name):
+    """Ollama treats "model" and "model:latest" as the same model."""
+    return name if ":" in name else name + ":latest"
+
+
+def is_host_failure(error):
+    """True if `error` means the host could not serve the request (worth trying another)."""
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) or getattr(error, "status_code", None) \
+        or getattr(error, "status", None)
+    if isinstance(status, int):
+        return status in RETRY_STATUSES
+    if isinstance(error, requests.RequestException):
+        return isinstance(error, requests.ConnectionError)
+    # asyncio / stdlib socket errors, and httpx's errors from the ollama library
+    return isinstance(error, OSError) or type(error).__name__ in ("ConnectError", "ConnectTimeout")
+
+
+class Endpoint:
+    """One Ollama server and its live load/health state."""
+
+    def __init__(self, url, weight=1.0, models=None):
+        self.url = url.rstrip("/")
+        self.weight = max(float(weight), 0.01)
+        self.models = {_model_name(m) for m in models} if models else None
+        self.discovered_models = None   # from the last successful probe
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.last_error = None
+
+    def serves(self, model):
+        models = self.models or self.discovered_models
+        return not model or models is None or _model_name(model) in models
+
+    def ejected(self, now=None):
+        return (now or time.time()) < self.ejected_until
+
+    def load(self):
+        return (self.outstanding + 1) / self.weight
+
+    def status(self):
+        return {"url": self.url, "weight": self.weight, "outstanding": self.outstanding,
+                "failures": self.failures, "ejected": self.ejected(),
+                "last_error": self.last_error}
+
+    def __repr__(self):
+        return f"Endpoint({self.url!r}, weight={self.weight}, outstanding={self.outstanding})"
+
+
+def load_endpoints():
+    """Endpoints from the environment override or config.json (falling back to ollama_url)."""
+    from ollama_vision_twopass import get_ollama_settings
+
+    override = os.environ.get("VISIONEXPLORER_OLLAMA_URL")
+    if override:
+        return [Endpoint(u.strip()) for u in override.split(",") if u.strip()]
+    config_path = os.path.join(os.path.dirname(__file__), "config.json")
+    entries = []
+    if os.path.exists(config_path):
+        with open(config_path, "r") as f:
+            entries = json.load(f).get("ollama_endpoints") or []
+    endpoints = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"url": entry}
+        endpoints.append(Endpoint(entry["url"], entry.get("weight", 1.0), entry.get("models")))
+    return endpoints or [Endpoint(get_ollama_settings()[0])]
+
+
+class HostPool:
+    """Least-outstanding selection with health probes, ejection and capture affinity."""
+
+    def __init__(self, endpoints, cfg=None):
+        if not endpoints:
+            raise ValueError("HostPool needs at least one endpoint")
+        self.endpoints = list(endpoints)
+        self.cfg = cfg or get_host_settings()
+        self._lock = threading.Lock()
+        self._affinity = OrderedDict()
+        self._turn = itertools.count()
+        self._stop = threading.Event()
+        self._prober = None
+
+    def select(self, model=None, affinity=None, exclude=()):
+        """Endpoint for the next request, or None if every candidate is in `exclude`.
+
+        Ejected hosts are only used when nothing else is left, soonest-back first.
+        """
+        with self._lock:
+            now = time.time()
+            candidates = [e for e in self.endpoints if e.url not in exclude]
+            if not candidates:
+                return None
+            # If no host claims the model, let a server report the error rather than failing here
+            candidates = [e for e in candidates if e.serves(model)] or candidates
+            healthy = [e for e in candidates if not e.ejected(now)]
+            if affinity is not None:
+                sticky = self._affinity.get(affinity)
+                if sticky in healthy:
+                    self._affinity.move_to_end(affinity)
+                    return sticky
+            if healthy:
+                # Rotate before taking the minimum so equally loaded hosts share the work
+                shift = next(self._turn) % len(healthy)
+                chosen = min(healthy[shift:] + healthy[:shift], key=Endpoint.load)
+            else:
+                chosen = min(candidates, key=lambda e: e.ejected_until)
+            if affinity is not None:
+                self._remember(affinity, chosen)
+            return chosen
+
+    def failover(self, endpoint, error, tried, model=None, affinity=None):
+        """Host to retry on after `endpoint` failed with `error`, or None to give up.
+
+        `tried` collects the URLs used so far. Only host failures are retried,
+        on at most max_attempts hosts; a capture's affinity follows the retry.
+        """
+        tried.add(endpoint.url)
+        if not is_host_failure(error) or len(tried) >= self.cfg["max_attempts"]:
+            return None
+        chosen = self.select(model, exclude=tried)
+        if chosen is None:
+            return None
+        logger.warning("%s failed (%s), retrying on %s", endpoint.url, error, chosen.url)
+        self.reassign(affinity, chosen)
+        return chosen
+
+    def reassign(self, affinity, endpoint):
+        """Move a capture to `endpoint` (after its host failed)."""
+        if affinity is not None:
+            with self._lock:
+                self._remember(affinity, endpoint)
+
+    def _remember(self, affinity, endpoint):
+        self._affinity[affinity] = endpoint
+        self._affinity.move_to_end(affinity)
+        while len(self._affinity) > self.cfg["affinity_size"]:
+            self._affinity.popitem(last=False)
+
+    def begin(self, endpoint):
+        with self._lock:
+            endpoint.outstanding += 1
+
+    def end(self, endpoint, error=None):
+        """Finish a request started with begin(); host failures eject the endpoint."""
+        with self._lock:
+            endpoint.outstanding = max(0, endpoint.outstanding - 1)
+        if error is None:
+            self.mark_ok(endpoint)
+        elif is_host_failure(error):
+            self.mark_failed(endpoint, error)
+
+    def mark_ok(self, endpoint):
+        with self._lock:
+            endpoint.failures = 0
+            endpoint.ejected_until = 0.0
+
+    def mark_failed(self, endpoint, error):
+        with self._lock:
+            endpoint.failures += 1
+            endpoint.last_error = str(error)
+            backoff = min(self.cfg["eject_seconds"] * 2 ** (endpoint.failures - 1),
+                          self.cfg["max_eject_seconds"])
+            endpoint.ejected_until = time.time() + backoff
+        logger.warning("Ejected %s for %.0fs: %s", endpoint.url, backoff, error)
+
+    def available(self, model=None):
+        """Healthy endpoints serving `model` (all of them if none is healthy)."""
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.serves(model)] or list(self.endpoints)
+            return [e for e in candidates if not e.ejected()] or candidates
+
+    def probe(self, endpoint):
+        """Check one host; a success re-admits it and refreshes its model list."""
+        try:
+            resp = requests.get(f"{endpoint.url}/api/tags", timeout=self.cfg["probe_timeout"])
+            resp.raise_for_status()
+            models = {_model_name(m["name"]) for m in resp.json().get("models", []) if m.get("name")}
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            if not endpoint.ejected():
+                self.mark_failed(endpoint, e)
+            return False
+        with self._lock:
+            endpoint.discovered_models = models or None
+            was_ejected = endpoint.failures > 0
+        self.mark_ok(endpoint)
+        if was_ejected:
+            logger.info("Re-admitted %s", endpoint.url)
+        return True
+
+    def probe_all(self):
+        for endpoint in self.endpoints:
+            self.probe(endpoint)
+
+    def start_probing(self):
+        if self._prober is None and self.cfg["probe_interval"]:
+            self._prober = threading.Thread(target=self._probe_loop, name="ollama-probe", daemon=True)
+            self._prober.start()
+        return self
+
+    def _probe_loop(self):
+        while not self._stop.is_set():
+            self.probe_all()
+            self._stop.wait(self.cfg["probe_interval"])
+
+    def close(self):
+        self._stop.set()
+
+    def status(self):
+        with self._lock:
+            return [e.status() for e in self.endpoints]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_host_pool():
+    """The process-wide HostPool; probing only runs when there is more than one host."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = HostPool(load_endpoints())
+            if len(_pool.endpoints) > 1:
+                _pool.start_probing()
+        return _pool
+
+
+def reset_host_pool():
+    """Forget the pool so the next get_host_pool() re-reads the configuration."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = None
@@ -0,0 +1,243 @@
+import io
+import time
+import base64
+import threading
+from PIL import Image, ImageChops, ImageOps
+
+from settings import get_app_settings
+
+MAX_IMAGE_SIDE = 1200
+
+# Per-step defaults; the "preprocessing" section of app_settings.json overrides
+# them under "default" and per model family under "models" (matched by prefix).
+DEFAULT_PREPROCESSING = {
+    "max_side": MAX_IMAGE_SIDE,
+    "max_pixels": None,        # cap on width*height, None for no cap
+    "patch_size": None,        # snap both sides down to a multiple of the vision patch
+    "trim_borders": True,
+    "border_tolerance": 10,    # max channel difference still counted as border colour
+    "border_margin": 4,        # pixels of border kept around the trimmed content
+    "ocr_variant": None,       # None, "grayscale", "contrast" or "grayscale+contrast"
+}
+
+
+class PreparedImage:
+    """A capture ready to send: the processed PIL image and its lazily encoded bytes.
+
+    Everything stays in memory, from the screen grab to the request payload.
+    With `fmt` None the encoding is chosen per content class by encoder.py
+    (plain PNG when the encoder is disabled); encode_async() starts it on a
+    worker thread so it overlaps with whatever comes next.
+    """
+
+    def __init__(self, image, original_size=None, fmt=None, ocr=None, ocr_variant=None,
+                 source=None, content_class=None):
+        self.image = image
+        self.source = source or image   # full-resolution (trimmed) capture, e.g. for tiling
+        self.original_size = original_size or image.size
+        self.format = fmt
+        self.ocr = ocr                  # optional PreparedImage tuned for the text pass
+        self.ocr_variant = ocr_variant
+        self.content_class = content_class  # "text", "mixed" or "photo"; detected when None
+        self.raw = None                 # the capture as loaded, before any preprocessing
+        self.preprocess = None          # the settings prepare_image used (see get_preprocess_settings)
+        self._encoded = None
+        self._future = None
+        self._lock = threading.Lock()
+
+    @property
+    def ocr_input(self):
+        """The image to send with the OCR prompt."""
+        return self.ocr or self
+
+    @property
+    def size(self):
+        return self.image.size
+
+    @property
+    def resized(self):
+        return self.size != self.original_size
+
+    def encode_async(self):
+        """Start encoding on the encoder's worker pool; data/b64 wait for it."""
+        from encoder import get_encode_pool
+
+        with self._lock:
+            if self._encoded is None and self._future is None:
+                self._future = get_encode_pool().submit(self._encode)
+        return self
+
+    def _encode(self):
+        with self._lock:
+            if self._encoded is None:
+                self._encoded = encode_payload(self.image, self.format, self.content_class)
+            return self._encoded
+
+    def _result(self):
+        future = self._future
+        if future is not None:
+            return future.result()
+        return self._encode()
+
+    @property
+    def data(self):
+        return self._result().data
+
+    @property
+    def b64(self):
+        return self._result().b64
+
+    @property
+    def encoding(self):
+        """Format, size and encode time of the payload, or None if not encoded yet."""
+        encoded = self._encoded
+        return encoded.info() if encoded is not None else None
+
+
+def load_image(source):
+    """PIL image from a file path, raw encoded bytes or an existing PIL image."""
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, PreparedImage):
+        return source.image
+    if isinstance(source, (bytes, bytearray)):
+        img = Image.open(io.BytesIO(source))
+    else:
+        img = Image.open(source)
+    img.load()  # decode now so the file handle can be released
+    return img
+
+
+def resize_image(img, max_side=MAX_IMAGE_SIDE):
+    """Downscale so the longest side is at most `max_side` (returns `img` unchanged if it fits)."""
+    w, h = img.size
+    if w <= max_side and h <= max_side:
+        return img
+    if w > h:
+        nw, nh = max_side, int(h * max_side / w)
+    else:
+        nh, nw = max_side, int(w * max_side / h)
+    return img.resize((nw, nh), Image.Resampling.LANCZOS)
+
+
+def get_preprocess_settings(model=None):
+    """Preprocessing steps for `model`: defaults, then "default", then the longest matching family."""
+    cfg = dict(DEFAULT_PREPROCESSING)
+    settings = get_app_settings()
+    section = settings.get("preprocessing") or {}
+    cfg.update(section.get("default") or {})
+    if model:
+        families = section.get("models") or {}
+        for family in sorted(families, key=len):
+            if model.startswith(family):
+                cfg.update(families[family])
+    if not settings.get("resize_large_images", True):
+        cfg["max_side"] = None
+        cfg["max_pixels"] = None
+    return cfg
+
+
+def trim_borders(img, tolerance=10, margin=4):
+    """Crop away uniform borders (the top-left pixel's colour) around the content."""
+    rgb = img.convert("RGB")
+    background = Image.new("RGB", rgb.size, rgb.getpixel((0, 0)))
+    diff = ImageChops.difference(rgb, background).convert("L")
+    bbox = diff.point(lambda v: 255 if v > tolerance else 0).getbbox()
+    if bbox is None:
+        return img  # blank capture: nothing to trim to
+    left, top, right, bottom = bbox
+    left, top = max(0, left - margin), max(0, top - margin)
+    right, bottom = min(img.width, right + margin), min(img.height, bottom + margin)
+    if (left, top, right, bottom) == (0, 0, img.width, img.height):
+        return img
+    return img.crop((left, top, right, bottom))
+
+
+def snap_to_patches(img, patch_size):
+    """Resize so both sides are whole multiples of the model's vision patch size.
+
+    Sides are rounded down, so the number of vision tokens never grows and the
+    server does not have to resize again.
+    """
+    w, h = img.size
+    nw = max(patch_size, w // patch_size * patch_size)
+    nh = max(patch_size, h // patch_size * patch_size)
+    if (nw, nh) == (w, h):
+        return img
+    return img.resize((nw, nh), Image.Resampling.LANCZOS)
+
+
+def limit_pixels(img, max_pixels):
+    w, h = img.size
+    if w * h <= max_pixels:
+        return img
+    scale = (max_pixels / float(w * h)) ** 0.5
+    return img.resize((max(1, int(w * scale)), max(1, int(h * scale))), Image.Resampling.LANCZOS)
+
+
+def make_ocr_variant(img, variant):
+    """Grayscale and/or contrast-stretched copy of `img` for the text pass."""
+    steps = variant.split("+")
+    out = img
+    if "grayscale" in steps:
+        out = ImageOps.grayscale(out)
+    if "contrast" in steps:
+        out = ImageOps.autocontrast(out if out.mode in ("L", "RGB") else out.convert("RGB"), cutoff=1)
+    return out
+
+
+def encode_payload(img, fmt=None, content_class=None):
+    """encoder.Encoded payload of `img`: in `fmt` if given, else the encoder's pick for its content."""
+    from encoder import Encoded, get_encoder
+
+    encoder = get_encoder() if fmt is None else None
+    if encoder is not None:
+        return encoder.encode(img, content_class)
+    start = time.perf_counter()
+    data = encode_image(img, fmt or "PNG")
+    b64 = base64.b64encode(data).decode()
+    return Encoded(data, b64, (fmt or "PNG").lower(), content_class, time.perf_counter() - start)
+
+
+def encode_image(img, fmt="PNG"):
+    """Encode a PIL image to bytes in memory."""
+    if fmt.upper() in ("JPEG", "JPG") and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format=fmt)
+    return buf.getvalue()
+
+
+def prepare_image(source, model=None):
+    """Load and preprocess a capture for `model` (see get_preprocess_settings).
+
+    Steps: trim uniform borders, cap the longest side / pixel count, snap to
+    the vision patch grid and optionally derive an OCR variant. A
+    PreparedImage is returned as is if it was prepared with the same settings,
+    else its raw capture is prepared again for `model`.
+    """
+    cfg = get_preprocess_settings(model)
+    if isinstance(source, PreparedImage):
+        if source.raw is None or source.preprocess == cfg:
+            return source
+        source = source.raw
+    raw = img = load_image(source)
+    original_size = img.size
+
+    if cfg["trim_borders"]:
+        img = trim_borders(img, cfg["border_tolerance"], cfg["border_margin"])
+    source = img
+    if cfg["max_side"]:
+        img = resize_image(img, cfg["max_side"])
+    if cfg["max_pixels"]:
+        img = limit_pixels(img, cfg["max_pixels"])
+    if cfg["patch_size"]:
+        img = snap_to_patches(img, cfg["patch_size"])
+
+    ocr = None
+    if cfg["ocr_variant"]:
+        ocr = PreparedImage(make_ocr_variant(img, cfg["ocr_variant"]), original_size, content_class="text")
+    prepared = PreparedImage(img, original_size, ocr=ocr, ocr_variant=cfg["ocr_variant"],
+                             source=source)
+    prepared.raw, prepared.preprocess = raw, cfg
+    return prepared
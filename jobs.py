@@ -0,0 +1,166 @@
+"""
+Bounded job queue for captures.
+
+Jobs run on a fixed number of worker threads. A new job can supersede the
+older ones: pending jobs are dropped and running ones are cancelled through
+their CancelToken, which the Ollama sessions use to close their HTTP stream
+right away instead of generating a reply nobody will read.
+"""
+
+import logging
+import queue
+import itertools
+import threading
+from collections import deque
+
+from settings import get_section
+from ollama_vision_twopass import GenerationCancelled, CancelToken
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_SETTINGS = {
+    "max_concurrent": 1,   # captures processed at the same time
+    "max_pending": 4,      # queued captures beyond that; submit raises queue.Full when exceeded
+}
+
+
+def get_job_settings():
+    cfg = dict(DEFAULT_JOB_SETTINGS)
+    cfg.update(get_section("jobs"))
+    return cfg
+
+
+def _cancel_in_background(jobs):
+    """Cancel running jobs without blocking the caller (closing a busy HTTP stream can take a while)."""
+    jobs = list(jobs)
+    if jobs:
+        threading.Thread(target=lambda: [job.cancel() for job in jobs], daemon=True).start()
+
+
+class Job:
+    """One unit of work; fn(*args, cancel_event=token, **kwargs) runs on a worker."""
+
+    PENDING, RUNNING, DONE, FAILED, CANCELLED = "pending", "running", "done", "failed", "cancelled"
+
+    def __init__(self, job_id, fn, args, kwargs, token=None, on_done=None):
+        self.id = job_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.token = token or CancelToken()
+        self.on_done = on_done
+        self.state = Job.PENDING
+        self.result = None
+        self.error = None
+        self._finished = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self.token.is_set()
+
+    def cancel(self):
+        self.token.cancel()
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+
+class JobScheduler:
+    """Run jobs on `max_concurrent` workers with at most `max_pending` queued."""
+
+    def __init__(self, max_concurrent=None, max_pending=None):
+        cfg = get_job_settings()
+        self.max_concurrent = max(1, max_concurrent or cfg["max_concurrent"])
+        self.max_pending = max(0, cfg["max_pending"] if max_pending is None else max_pending)
+        self._pending = deque()
+        self._running = set()
+        self._cond = threading.Condition()
+        self._ids = itertools.count(1)
+        self._closed = False
+        self._workers = [threading.Thread(target=self._work, daemon=True)
+                         for _ in range(self.max_concurrent)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, fn, *args, supersede=False, token=None, on_done=None, **kwargs):
+        """Queue fn; with `supersede`, older pending jobs are dropped and running ones cancelled.
+
+        on_done(job) is called on the worker thread once the job has finished,
+        failed or been cancelled.
+        """
+        job = Job(next(self._ids), fn, args, kwargs, token, on_done)
+        dropped = []
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("scheduler is shut down")
+            if supersede:
+                dropped = list(self._pending)
+                self._pending.clear()
+                _cancel_in_background(self._running)
+            elif len(self._pending) >= self.max_pending:
+                raise queue.Full(f"{len(self._pending)} captures already queued")
+            self._pending.append(job)
+            self._cond.notify()
+        for old in dropped:
+            old.cancel()
+            self._finish(old, Job.CANCELLED)
+        return job
+
+    def cancel_all(self):
+        with self._cond:
+            dropped = list(self._pending)
+            self._pending.clear()
+            _cancel_in_background(self._running)
+        for job in dropped:
+            job.cancel()
+            self._finish(job, Job.CANCELLED)
+
+    def shutdown(self, cancel=True):
+        if cancel:
+            self.cancel_all()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                job = self._pending.popleft()
+                if not job.cancelled:
+                    job.state = Job.RUNNING
+                    self._running.add(job)
+            if job.cancelled:
+                with self._cond:
+                    self._running.discard(job)
+                self._finish(job, Job.CANCELLED)
+                continue
+            try:
+                job.result = job.fn(*job.args, cancel_event=job.token, **job.kwargs)
+                state = Job.CANCELLED if job.cancelled else Job.DONE
+            except GenerationCancelled:
+                state = Job.CANCELLED
+            except Exception as e:
+                job.error = e
+                state = Job.CANCELLED if job.cancelled else Job.FAILED
+            finally:
+                with self._cond:
+                    self._running.discard(job)
+            self._finish(job, state)
+
+    def _finish(self, job, state):
+        job.state = state
+        job._finished.set()
+        if job.on_done is not None:
+            try:
+                job.on_done(job)
+            except Exception as e:
+                logger.warning("job callback failed: %s", e)
@@ -1,17 +1,28 @@
-import os
+import logging
 import threading
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.label import Label
 from kivy.uix.button import Button
-from kivy.uix.scrollview import ScrollView
-from kivy.uix.textinput import TextInput
 from kivy.uix.image import Image
 from kivy.clock import Clock
 from kivy.core.window import Window
 from kivy.core.text import LabelBase
+from kivy.graphics.texture import Texture
 from screen_capture import ScreenSelector
-from text_extractor_twopass import extract_text_from_image_twopass as extract_text_from_image
+from ollama_vision_twopass import (query_ollama_vision_twopass, ModelWarmer, get_ollama_settings,
+                                   GenerationCancelled, CancelToken)
+from image_pipeline import prepare_image
+from settings import get_section
+from metrics import CaptureMetrics
+from watch import RegionWatcher
+from jobs import JobScheduler
+from history import get_history
+from text_viewer import TextViewer
+from regions import query_regions
+
+# Streamed tokens are buffered and pushed to the text panes at most this often (seconds)
+STREAM_FLUSH_INTERVAL = 0.1
 
 # Register a font that supports Unicode characters
 try:
@@ -19,7 +30,20 @@ try:
 except:
     pass  # Use default font if DejaVu not available
 
+def image_to_texture(img):
+    """Kivy texture straight from a PIL image's pixel buffer (no encode/decode round trip)"""
+    rgba = img if img.mode == 'RGBA' else img.convert('RGBA')
+    texture = Texture.create(size=rgba.size, colorfmt='rgba')
+    texture.blit_buffer(rgba.tobytes(), colorfmt='rgba', bufferfmt='ubyte')
+    texture.flip_vertical()
+    return texture
+
 class ScreenExplorerApp(App):
+    def __init__(self, daemon_mode=False, **kwargs):
+        super().__init__(**kwargs)
+        # In daemon mode (daemon.py) captures are triggered over a socket and the app outlives them
+        self.daemon_mode = daemon_mode
+
     def build(self):
         Window.hide()
         Window.clearcolor = (0.1, 0.1, 0.1, 1)  # Dark background
@@ -65,10 +89,8 @@ class ScreenExplorerApp(App):
         text_label.bind(size=text_label.setter('text_size'))
         text_layout.add_widget(text_label)
         
-        self.text_area = TextInput(
+        self.text_area = TextViewer(
             text='Starting capture...',
-            multiline=True,
-            readonly=True,
             background_color=(0.2, 0.2, 0.2, 1),
             foreground_color=(0.9, 0.9, 0.9, 1),
             font_name='RobotoMono-Regular',
@@ -88,10 +110,8 @@ class ScreenExplorerApp(App):
         visual_label.bind(size=visual_label.setter('text_size'))
         visual_layout.add_widget(visual_label)
         
-        self.visual_area = TextInput(
+        self.visual_area = TextViewer(
             text='',
-            multiline=True,
-            readonly=True,
             background_color=(0.2, 0.2, 0.2, 1),
             foreground_color=(0.9, 0.9, 0.9, 1),
             font_name='RobotoMono-Regular',
@@ -113,34 +133,121 @@ class ScreenExplorerApp(App):
             color=(0.9, 0.9, 0.9, 1)  # Light text
         )
         capture_btn.bind(on_press=self.capture_screen)
-        main_layout.add_widget(capture_btn)
         
-        Clock.schedule_once(self.initial_capture, 0.5)
+        # Regions button: several areas of one snapshot, read as a batch (see regions.py)
+        regions_btn = Button(
+            text='Capture Regions',
+            size_hint=(0.3, None),
+            height=50,
+            background_color=(0.3, 0.3, 0.3, 1),
+            color=(0.9, 0.9, 0.9, 1)
+        )
+        regions_btn.bind(on_press=self.capture_regions)
+        
+        # Watch button: re-read a fixed region whenever it changes
+        self.watch_btn = Button(
+            text='Watch Region',
+            size_hint=(0.3, None),
+            height=50,
+            background_color=(0.3, 0.3, 0.3, 1),
+            color=(0.9, 0.9, 0.9, 1)
+        )
+        self.watch_btn.bind(on_press=self.toggle_watch)
+        
+        # History button: search earlier captures (see history.py)
+        history_btn = Button(
+            text='History',
+            size_hint=(0.2, None),
+            height=50,
+            background_color=(0.3, 0.3, 0.3, 1),
+            color=(0.9, 0.9, 0.9, 1),
+            disabled=get_history() is None
+        )
+        history_btn.bind(on_press=self.show_history)
+        
+        button_layout = BoxLayout(orientation='horizontal', size_hint_y=None, height=50, spacing=10)
+        button_layout.add_widget(capture_btn)
+        button_layout.add_widget(regions_btn)
+        button_layout.add_widget(self.watch_btn)
+        button_layout.add_widget(history_btn)
+        main_layout.add_widget(button_layout)
+        
+        # Per-capture timings (see metrics.py)
+        self.status_label = Label(
+            text='',
+            size_hint_y=None,
+            height=24,
+            halign='left',
+            color=(0.6, 0.6, 0.6, 1),
+            font_size='12sp'
+        )
+        self.status_label.bind(size=self.status_label.setter('text_size'))
+        main_layout.add_widget(self.status_label)
+        
+        self._stream_lock = threading.Lock()
+        self._stream_pending = {"text": [], "visual": []}
+        self._stream_started = set()
+        self._stream_event = None
+        self._stream_owner = None
+        
+        # Captures run as jobs; a new capture supersedes (and aborts) the previous one
+        self.scheduler = JobScheduler()
+        self.current_token = None
+
+        self.watcher = None
+        
+        # Load the model in the background so the first capture doesn't pay for it
+        self.warmer = None
+        if get_section("prewarm").get("enabled", True):
+            self.warmer = ModelWarmer(interval=get_section("prewarm").get("interval")).start()
+
+        if self.daemon_mode:
+            Window.bind(on_request_close=self.on_request_close)
+        else:
+            Clock.schedule_once(self.initial_capture, 0.5)
         
         return main_layout
     
     def initial_capture(self, dt):
         self.capture_screen(None)
     
+    def on_request_close(self, *args, **kwargs):
+        """Closing the window only hides it while the daemon keeps running"""
+        Window.hide()
+        return True
+    
+    def show_window(self):
+        Window.show()
+        Window.raise_window()
+    
     def capture_screen(self, instance):
+        """Select a region and queue it for processing; returns the Job, or None if cancelled"""
+        self.stop_watch()
         Window.hide()
+        if self.warmer:
+            self.warmer.warm_now()  # runs while the user drags the selection
         
         try:
-            selector = ScreenSelector()
-            image_path = selector.capture_area()
+            selector = ScreenSelector(exit_on_cancel=not self.daemon_mode)
+            image = selector.capture_image()
             
-            if image_path:
+            if image is not None:
+                metrics = CaptureMetrics()
+                metrics.add_stage("capture", selector.capture_duration)
+                
                 # Show image immediately
-                self.image_display.source = image_path
+                self.image_display.texture = image_to_texture(image)
                 self.image_label.text = 'Captured Image: Processing...'
                 self.text_area.text = 'Processing with Ollama...'
                 self.visual_area.text = ''
+                self.status_label.text = ''
                 Window.show()
                 
-                # Process in background thread
-                thread = threading.Thread(target=self.process_image, args=(image_path,))
-                thread.daemon = False  # Don't kill thread when main exits
-                thread.start()
+                # Process as a background job; only the newest job may touch the UI
+                token = CancelToken()
+                self.current_token = token
+                self.start_streaming(token)
+                return self.scheduler.submit(self.process_image, image, metrics, supersede=True, token=token)
             else:
                 self.text_area.text = 'Capture cancelled'
                 self.visual_area.text = ''
@@ -151,55 +258,232 @@ class ScreenExplorerApp(App):
             self.visual_area.text = ''
             Window.show()
     
-    def process_image(self, image_path):
+    def process_image(self, image, metrics=None, cancel_event=None):
         """Process image in background thread"""
+        metrics = metrics if metrics is not None else CaptureMetrics()
+        ui = lambda fn: self.run_if_current(cancel_event, fn)
         try:
             print("Starting Ollama processing...")
             
-            # Get original and processed dimensions
-            from PIL import Image as PILImage
-            with PILImage.open(image_path) as img:
-                orig_w, orig_h = img.size
-            
-            # Get processed image path to check final dimensions
-            from text_extractor_twopass import resize_image_if_needed
-            proc_path = resize_image_if_needed(image_path)
-            
-            with PILImage.open(proc_path) as img:
-                proc_w, proc_h = img.size
+            # Resize and encode in memory; no temp files between capture and request
+            with metrics.stage("preprocess"):
+                prepared = prepare_image(image, model=get_ollama_settings()[1])
+            prepared.encode_async()  # encodes on a worker thread while the UI updates
+            orig_w, orig_h = prepared.original_size
+            proc_w, proc_h = prepared.size
             
             # Update label with both dimensions
-            if proc_path != image_path:
-                Clock.schedule_once(lambda dt: setattr(self.image_label, 'text', f'Captured Image: {orig_w}x{orig_h} → {proc_w}x{proc_h} (resized)'))
+            if prepared.resized:
+                ui(lambda: setattr(self.image_label, 'text', f'Captured Image: {orig_w}x{orig_h} → {proc_w}x{proc_h} (resized)'))
             else:
-                Clock.schedule_once(lambda dt: setattr(self.image_label, 'text', f'Captured Image: {orig_w}x{orig_h}'))
+                ui(lambda: setattr(self.image_label, 'text', f'Captured Image: {orig_w}x{orig_h}'))
             
-            text_content, visual_content, _ = extract_text_from_image(image_path)
+            result = query_ollama_vision_twopass(
+                prepared, metrics=metrics, cancel_event=cancel_event,
+                stream_callback=lambda field, token: self.on_stream_token(field, token, cancel_event),
+                progress_callback=lambda message: ui(lambda: setattr(self.status_label, 'text', message)))
+            text_content, visual_content = result["text"], result["visual"]
             print("Ollama processing completed")
+            summary = metrics.summary()
+            print(f"[DEBUG] {summary}")
+            ui(lambda: setattr(self.status_label, 'text', summary))
             # Update UI from main thread
-            Clock.schedule_once(lambda dt: self.update_results(image_path, text_content, visual_content))
+            ui(lambda: self.update_results(text_content, visual_content))
+            return result
+        except GenerationCancelled:
+            print("[DEBUG] Capture superseded, generation cancelled")
         except Exception as e:
-            print(f"Error in process_image: {str(e)}")
-            Clock.schedule_once(lambda dt: self.update_results(image_path, f'Error: {str(e)}', f'Processing failed: {str(e)}'))
-        # Don't delete image file yet - display it first
+            error = str(e)  # `e` is unbound once the except block ends
+            print(f"Error in process_image: {error}")
+            ui(lambda: self.update_results(f'Error: {error}', f'Processing failed: {error}'))
     
-    def update_results(self, image_path, text_content, visual_content):
+    def capture_regions(self, instance):
+        """Select several regions on one snapshot and queue them as one batch; returns the Job, or None if cancelled"""
+        from regions_panel import RegionsPopup
+        
+        self.stop_watch()
+        Window.hide()
+        if self.warmer:
+            self.warmer.warm_now()
+        
+        try:
+            selector = ScreenSelector(exit_on_cancel=not self.daemon_mode, multi=True)
+            images = selector.capture_images()
+            
+            if images:
+                metrics = CaptureMetrics()
+                metrics.add_stage("capture", selector.capture_duration)
+                
+                self.image_display.texture = image_to_texture(images[0])
+                self.image_label.text = f'Captured Image: {len(images)} regions'
+                self.text_area.text = f'Processing {len(images)} regions with Ollama...'
+                self.visual_area.text = ''
+                self.status_label.text = ''
+                popup = RegionsPopup([(image_to_texture(img), img.size) for img in images])
+                Window.show()
+                popup.open()
+                
+                # Region results go to the popup's columns, so nothing streams into the main panes
+                token = CancelToken()
+                self.current_token = token
+                self.stop_streaming()
+                return self.scheduler.submit(self.process_regions, images, selector.bboxes, metrics, popup,
+                                             supersede=True, token=token)
+            else:
+                self.text_area.text = 'Capture cancelled'
+                self.visual_area.text = ''
+                Window.show()
+        
+        except Exception as e:
+            self.text_area.text = f'Capture error: {str(e)}'
+            self.visual_area.text = ''
+            Window.show()
+    
+    def process_regions(self, images, bboxes, metrics, popup, cancel_event=None):
+        """Process the regions of one capture in a background thread"""
+        ui = lambda fn: self.run_if_current(cancel_event, fn)
+        try:
+            result = query_regions(
+                images, bboxes, metrics=metrics, cancel_event=cancel_event,
+                region_callback=lambda index, region: ui(lambda: popup.set_result(index, region)),
+                progress_callback=lambda message: ui(lambda: popup.set_status(message)))
+            summary = metrics.summary()
+            print(f"[DEBUG] {summary}")
+            ui(lambda: popup.set_status(summary))
+            ui(lambda: setattr(self.status_label, 'text', summary))
+            # The main panes get every region under a heading, for copying and searching
+            ui(lambda: self.update_results(result["text"], result["visual"]))
+            return result
+        except GenerationCancelled:
+            print("[DEBUG] Capture superseded, generation cancelled")
+        except Exception as e:
+            error = str(e)
+            print(f"Error in process_regions: {error}")
+            ui(lambda: popup.set_status(f'Error: {error}'))
+            ui(lambda: self.update_results(f'Error: {error}', f'Processing failed: {error}'))
+    
+    def run_if_current(self, token, fn):
+        """Run fn on the main thread unless `token`'s capture has been superseded"""
+        def apply(dt):
+            if token is None or (token is self.current_token and not token.is_set()):
+                fn()
+        Clock.schedule_once(apply)
+    
+    def toggle_watch(self, instance):
+        if self.watcher is not None:
+            self.stop_watch()
+            return
+        Window.hide()
+        try:
+            selector = ScreenSelector(exit_on_cancel=not self.daemon_mode)
+            image = selector.capture_image()
+        except Exception as e:
+            self.text_area.text = f'Capture error: {str(e)}'
+            Window.show()
+            return
+        Window.show()
+        if image is None:
+            self.text_area.text = 'Capture cancelled'
+            return
+        self.image_display.texture = image_to_texture(image)
+        w, h = image.size
+        self.image_label.text = f'Watching: {w}x{h}'
+        self.text_area.text = 'Processing with Ollama...'
+        self.visual_area.text = ''
+        # Watching replaces any capture still being processed
+        self.scheduler.cancel_all()
+        self.current_token = None
+        self.stop_streaming()
+        self.watcher = RegionWatcher(selector.bbox, on_result=self.on_watch_result,
+                                     on_status=self.on_progress).start()
+        self.watch_btn.text = 'Stop Watching'
+    
+    def stop_watch(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+        self.watch_btn.text = 'Watch Region'
+    
+    def on_watch_result(self, result):
+        """New text for the watched region (called from the watcher thread)"""
+        status = f"Updated {result['bands_read']}/{result['bands_total']} bands"
+        def apply(dt):
+            if self.watcher is None:
+                return  # stopped while the last tick was running
+            self.update_results(result["text"], result["visual"])
+            self.status_label.text = status
+        Clock.schedule_once(apply)
+    
+    def show_history(self, instance):
+        from history_panel import HistoryPopup
+        HistoryPopup(get_history(), on_open_capture=self.open_history_capture).open()
+    
+    def open_history_capture(self, record, thumbnail):
+        """Show a capture picked in the history panel in the main panes"""
+        self.stop_watch()
+        self.scheduler.cancel_all()
+        self.current_token = None
+        if thumbnail is not None:
+            self.image_display.texture = image_to_texture(thumbnail)
+        self.image_label.text = f"History: {record['width']}x{record['height']}"
+        self.status_label.text = ''
+        self.update_results(record['text'], record['visual'])
+    
+    def on_progress(self, message):
+        """Show pipeline progress in the status line (called from the worker thread)"""
+        Clock.schedule_once(lambda dt: setattr(self.status_label, 'text', message))
+    
+    def on_stream_token(self, field, token, owner=None):
+        """Collect a streamed token (called from the worker thread)"""
+        with self._stream_lock:
+            if owner is not self._stream_owner:
+                return  # token from a superseded capture
+            self._stream_pending[field].append(token)
+    
+    def start_streaming(self, owner=None):
+        self.stop_streaming()
+        with self._stream_lock:
+            self._stream_owner = owner
+            self._stream_pending = {"text": [], "visual": []}
+        self._stream_started = set()
+        self._stream_event = Clock.schedule_interval(self.flush_stream, STREAM_FLUSH_INTERVAL)
+    
+    def stop_streaming(self):
+        if self._stream_event is not None:
+            self._stream_event.cancel()
+            self._stream_event = None
+    
+    def flush_stream(self, dt):
+        """Append buffered tokens to the panes in one update per field"""
+        with self._stream_lock:
+            pending = self._stream_pending
+            self._stream_pending = {"text": [], "visual": []}
+        for field, area in (("text", self.text_area), ("visual", self.visual_area)):
+            if not pending[field]:
+                continue
+            chunk = ''.join(pending[field])
+            if field not in self._stream_started:
+                # First tokens replace the "Processing..." placeholder
+                self._stream_started.add(field)
+                area.text = chunk
+            else:
+                area.append(chunk)
+    
+    def update_results(self, text_content, visual_content):
         """Update UI with results (called from main thread)"""
-        # Image already displayed, just update text areas
+        self.stop_streaming()
+        # Final reply replaces whatever was streamed so far
         self.text_area.text = text_content
         self.visual_area.text = visual_content
-        
-        # Clean up temp file after displaying
-        Clock.schedule_once(lambda dt: self.cleanup_image(image_path), 2)
     
-    def cleanup_image(self, image_path):
-        """Clean up temporary image file"""
-        try:
-            os.unlink(image_path)
-        except:
-            pass
+    def on_stop(self):
+        self.scheduler.shutdown()
+        self.stop_watch()
+        if self.warmer:
+            self.warmer.stop()
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="[%(name)s] %(message)s")
     try:
         ScreenExplorerApp().run()
     except Exception as e:
@@ -0,0 +1,165 @@
+"""
+Per-capture instrumentation: stage timings, Ollama eval statistics and a
+rotating JSONL metrics log.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+from settings import get_section, get_data_dir
+
+# Timing fields Ollama returns with the final chunk of every generation
+OLLAMA_STAT_KEYS = ("total_duration", "load_duration", "prompt_eval_count",
+                    "prompt_eval_duration", "eval_count", "eval_duration")
+
+DEFAULT_METRICS_SETTINGS = {
+    "enabled": True,
+    "path": None,            # defaults to ~/.cache/visionexplorer/metrics.jsonl
+    "max_bytes": 1024 * 1024,
+    "backup_count": 5,
+}
+
+
+def response_stats(response):
+    """Ollama timing fields from a response dict or ollama-library response object."""
+    stats = {}
+    for key in OLLAMA_STAT_KEYS:
+        if isinstance(response, dict):
+            value = response.get(key)
+        else:
+            value = getattr(response, key, None)
+        if value is not None:
+            stats[key] = value
+    return stats
+
+
+def _per_second(count, duration_ns):
+    if not count or not duration_ns:
+        return None
+    return round(count / (duration_ns / 1e9), 2)
+
+
+class CaptureMetrics:
+    """Timings for one capture: local stages (seconds) and model passes."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = {}
+        self.passes = {}
+        self.info = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_pass(self, name, stats, wall_time=None):
+        """Record one generation; `stats` are Ollama's raw timing fields (nanoseconds)."""
+        entry = dict(stats or {})
+        if wall_time is not None:
+            entry["wall_time"] = round(wall_time, 4)
+        entry["prompt_tokens_per_sec"] = _per_second(entry.get("prompt_eval_count"),
+                                                     entry.get("prompt_eval_duration"))
+        entry["eval_tokens_per_sec"] = _per_second(entry.get("eval_count"), entry.get("eval_duration"))
+        with self._lock:
+            self.passes[name] = entry
+
+    def set(self, key, value):
+        with self._lock:
+            self.info[key] = value
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "stages": {k: round(v, 4) for k, v in self.stages.items()},
+                "passes": {k: dict(v) for k, v in self.passes.items()},
+                **self.info,
+            }
+
+    def summary(self):
+        """One-line summary for the status label."""
+        return format_summary(self.to_dict())
+
+
+def format_summary(data):
+    parts = []
+    stages = data.get("stages", {})
+    for name in ("capture", "preprocess", "route", "encode"):
+        if name in stages:
+            parts.append(f"{name} {stages[name] * 1000:.0f}ms")
+    payload = data.get("payload", {}).get("image")
+    if payload:
+        parts.append(f"{payload['format']} {payload['b64_bytes'] / 1024:.0f}KB")
+    passes = data.get("passes", {})
+    tiles = [k for k in passes if k.startswith("tile")]
+    for name, entry in passes.items():
+        if name in tiles:
+            continue
+        text = f"{name} {entry.get('wall_time', 0):.1f}s"
+        if entry.get("eval_count"):
+            # Prompt tokens show whether a follow-up pass re-evaluated the image
+            text += f" ({entry.get('prompt_eval_count', 0)} in, {entry['eval_count']} out"
+            if entry.get("eval_tokens_per_sec"):
+                text += f", {entry['eval_tokens_per_sec']:.0f} tok/s"
+            text += ")"
+        if entry.get("repetition"):
+            text += " loop cut"
+        parts.append(text)
+    if tiles:
+        slowest = max(passes[k].get("wall_time", 0) for k in tiles)
+        loops = sum(1 for k in tiles if passes[k].get("repetition"))
+        parts.append(f"{len(tiles)} tiles (slowest {slowest:.1f}s" + (f", {loops} loops cut)" if loops else ")"))
+    if data.get("regions"):
+        parts.append(f"{data['regions']} regions ({data.get('region_mode')})")
+    if data.get("route") not in (None, "full"):
+        parts.append(f"route {data['route'].replace('_', ' ')}")
+    if data.get("cache_hit"):
+        parts.append("cache hit")
+    if "total" in stages:
+        parts.append(f"total {stages['total']:.1f}s")
+    return " · ".join(parts)
+
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def _get_logger(cfg):
+    global _logger
+    with _logger_lock:
+        if _logger is None:
+            path = cfg["path"] or os.path.join(get_data_dir(), "metrics.jsonl")
+            handler = RotatingFileHandler(path, maxBytes=cfg["max_bytes"],
+                                          backupCount=cfg["backup_count"], encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            _logger = logging.getLogger("visionexplorer.metrics")
+            _logger.setLevel(logging.INFO)
+            _logger.propagate = False
+            _logger.addHandler(handler)
+        return _logger
+
+
+def log_metrics(record):
+    """Append one metrics record to the rotating JSONL file (if enabled)."""
+    cfg = dict(DEFAULT_METRICS_SETTINGS)
+    cfg.update(get_section("metrics"))
+    if not cfg["enabled"]:
+        return
+    try:
+        _get_logger(cfg).info(json.dumps(record, ensure_ascii=False))
+    except OSError as e:
+        print(f"[DEBUG] metrics log failed: {e}")
@@ -0,0 +1,245 @@
+"""
+Local stand-in for the parts of the Ollama HTTP API this app uses
+(/api/chat, /api/generate, /api/tags), for benchmarks and offline testing.
+
+    with MockOllamaServer(token_delay=0.01) as server:
+        os.environ["VISIONEXPLORER_OLLAMA_URL"] = server.url
+        ...
+
+Replies are generated word by word with a configurable per-token delay, and
+prompt evaluation is simulated from the prompt size and the image patch
+count, so the timing fields (prompt_eval_count, eval_count, *_duration)
+behave like the real server's.
+"""
+
+import io
+import json
+import time
+import base64
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_REPLY = (
+    "File Edit Selection View Go Run Terminal Help\n"
+    "def query_ollama_vision_twopass(image, progress_callback=None):\n"
+    "    session = OllamaSession()\n"
+    "    return session.ask(TEXT_PROMPT, images=[image])\n"
+)
+
+
+def _image_tokens(b64, patch_size):
+    """Vision tokens an image would cost: one per patch_size x patch_size patch."""
+    try:
+        from PIL import Image
+        with Image.open(io.BytesIO(base64.b64decode(b64))) as img:
+            w, h = img.size
+    except Exception:
+        return 256
+    return max(1, (w // patch_size) * (h // patch_size))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server.mock
+        if self.path.rstrip("/") in ("", "/"):
+            self._send_raw(200, b"Ollama is running", "text/plain")
+        elif self.path == "/api/tags":
+            models = [{"name": m, "model": m, "size": 0, "details": {"families": ["qwen25vl"]}}
+                      for m in server.models]
+            self._send_json(200, {"models": models})
+        elif self.path == "/api/version":
+            self._send_json(200, {"version": "mock"})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        server = self.server.mock
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": "invalid JSON"})
+            return
+        if self.path == "/api/chat":
+            self._generate(server, body, chat=True)
+        elif self.path == "/api/generate":
+            self._generate(server, body, chat=False)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    # ------------------------------------------------------------------ helpers
+
+    def _send_raw(self, status, data, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_json(self, status, obj):
+        self._send_raw(status, json.dumps(obj).encode(), "application/json")
+
+    def _write_chunk(self, obj):
+        line = (json.dumps(obj) + "\n").encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def _generate(self, server, body, chat):
+        server.record_request(self.path, body)
+        model = body.get("model", "")
+        if server.fail_status:
+            self._send_json(server.fail_status, {"error": "mock failure"})
+            return
+        if server.format_status and body.get("format"):
+            self._send_json(server.format_status, {"error": "format is not supported"})
+            return
+
+        if chat:
+            messages = body.get("messages") or []
+            prompt = " ".join(m.get("content", "") for m in messages)
+            images = [img for m in messages for img in (m.get("images") or [])]
+            context = None
+        else:
+            prompt = body.get("prompt", "")
+            images = body.get("images") or []
+            context = body.get("context")
+            if not prompt and not images:
+                # Empty generate request: just "load" the model
+                self._send_json(200, {"model": model, "response": "", "done": True,
+                                      "done_reason": "load"})
+                return
+
+        # Tokens in a previously returned context are treated as cached
+        prompt_tokens = len(prompt.split()) + sum(_image_tokens(i, server.patch_size) for i in images)
+        prompt_eval_seconds = prompt_tokens * server.prompt_token_delay
+        time.sleep(prompt_eval_seconds)
+
+        reply = server.reply_for(body, prompt)
+        words = [w + " " for w in reply.split(" ")]
+        words[-1] = words[-1][:-1]
+        done_reason = "stop"
+        num_predict = (body.get("options") or {}).get("num_predict")
+        if num_predict and len(words) > num_predict:
+            words, done_reason = words[:num_predict], "length"
+            reply = "".join(words)
+        stream = body.get("stream", True)
+        start = time.time()
+
+        def final(extra):
+            eval_seconds = time.time() - start
+            stats = {
+                "model": model, "done": True, "done_reason": done_reason,
+                "total_duration": int((prompt_eval_seconds + eval_seconds) * 1e9),
+                "load_duration": 0,
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(prompt_eval_seconds * 1e9),
+                "eval_count": len(words),
+                "eval_duration": int(eval_seconds * 1e9),
+            }
+            if not chat:
+                stats["context"] = list(context or []) + list(range(prompt_tokens + len(words)))
+            stats.update(extra)
+            return stats
+
+        def piece(text):
+            return {"message": {"role": "assistant", "content": text}} if chat else {"response": text}
+
+        if not stream:
+            time.sleep(server.token_delay * len(words))
+            try:
+                self._send_json(200, final(piece(reply)))
+            except (BrokenPipeError, ConnectionResetError):
+                server.record_abort()  # client gave up waiting
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for word in words:
+                time.sleep(server.token_delay)
+                chunk = {"model": model, "done": False}
+                chunk.update(piece(word))
+                self._write_chunk(chunk)
+            self._write_chunk(final(piece("")))
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            server.record_abort()  # client cancelled the stream
+
+
+class MockOllamaServer:
+    """Threaded mock Ollama server on localhost (port 0 picks a free port)."""
+
+    def __init__(self, host="127.0.0.1", port=0, token_delay=0.005, prompt_token_delay=0.0001,
+                 reply=DEFAULT_REPLY, models=("qwen2.5vl:3b",), patch_size=28):
+        self.token_delay = token_delay
+        self.prompt_token_delay = prompt_token_delay
+        self.reply = reply
+        self.models = list(models)
+        self.patch_size = patch_size
+        self.fail_status = None        # set to e.g. 500 to make generation requests fail
+        self.format_status = None      # e.g. 400: reject requests with a "format" schema
+        self.requests = []
+        self.aborted = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.mock = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reply_for(self, body, prompt):
+        """Reply text for a request; prompts asking for JSON get a JSON object."""
+        if "JSON" in prompt or body.get("format"):
+            return json.dumps({"text": self.reply, "visual": "A dark editor window with code."})
+        return self.reply
+
+    def record_request(self, path, body):
+        with self._lock:
+            self.requests.append((path, body.get("model"), time.time()))
+
+    def record_abort(self):
+        with self._lock:
+            self.aborted += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run a mock Ollama server.")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    args = parser.parse_args()
+    server = MockOllamaServer(port=args.port, token_delay=args.token_delay)
+    print(f"Mock Ollama listening on {server.url}")
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,348 @@
+"""
+Model calibration and latency-aware model selection.
+
+`calibrate` runs every installed vision model over a labelled image set
+(images with a .txt ground truth next to them, e.g. shot.png and
+shot.txt) at several sizes, and records the OCR character error rate and
+latency of each. At runtime select_model() uses those results to pick, for a
+capture of a given size, the fastest model whose error rate meets the target
+and whose estimated latency fits the budget.
+
+    python model_select.py calibrate shots/ --sizes 640 1024 1600
+    python model_select.py show
+    python model_select.py pick 1920x1080 --budget 5 --max-cer 0.05
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+import requests
+from PIL import Image
+
+from settings import get_section, get_data_dir
+
+DEFAULT_MODEL_SELECT_SETTINGS = {
+    "enabled": True,            # only takes effect once a calibration file exists
+    "calibration_file": None,   # defaults to ~/.cache/visionexplorer/model_calibration.json
+    "max_cer": 0.1,             # accuracy target: highest acceptable character error rate
+    "latency_budget": 10.0,     # seconds for the text pass
+    "sizes": [640, 1024, 1600], # longest sides calibrated
+}
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+
+# Model families with a vision encoder, for servers whose /api/show has no "capabilities"
+VISION_FAMILIES = {"clip", "mllama", "qwen2vl", "qwen25vl", "qwen3vl", "gemma3", "llava", "minicpmv",
+                   "moondream", "granite-vision", "mistral3", "llama4"}
+
+
+def get_model_select_settings():
+    cfg = dict(DEFAULT_MODEL_SELECT_SETTINGS)
+    cfg.update(get_section("model_select"))
+    return cfg
+
+
+def calibration_path(cfg=None):
+    cfg = cfg or get_model_select_settings()
+    return cfg["calibration_file"] or os.path.join(get_data_dir(), "model_calibration.json")
+
+
+# ---------------------------------------------------------------- scoring
+
+def edit_distance(a, b):
+    """Levenshtein distance between two strings."""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def char_error_rate(hypothesis, reference):
+    """Character error rate with whitespace runs collapsed, so layout differences don't count."""
+    hyp = " ".join(hypothesis.split())
+    ref = " ".join(reference.split())
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    return edit_distance(hyp, ref) / len(ref)
+
+
+# ---------------------------------------------------------------- calibration
+
+def list_vision_models(url):
+    """Names of the models installed on `url` that accept images."""
+    resp = requests.get(f"{url}/api/tags", timeout=10)
+    resp.raise_for_status()
+    models = []
+    for m in resp.json().get("models", []):
+        name = m.get("name")
+        try:
+            show = requests.post(f"{url}/api/show", json={"model": name}, timeout=10)
+            show.raise_for_status()
+            capabilities = show.json().get("capabilities")
+        except (requests.RequestException, ValueError):
+            capabilities = None
+        if capabilities is not None:
+            if "vision" in capabilities:
+                models.append(name)
+        elif VISION_FAMILIES & set((m.get("details") or {}).get("families") or []):
+            models.append(name)
+    return models
+
+
+def load_labelled_set(paths):
+    """(image path, ground truth) pairs from image files and directories.
+
+    Every image needs a .txt file with the same name holding its expected text.
+    """
+    items = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, f) for f in os.listdir(path)
+                           if f.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            files = [path]
+        for image_path in files:
+            truth_path = os.path.splitext(image_path)[0] + ".txt"
+            if not os.path.exists(truth_path):
+                print(f"[DEBUG] skipping {image_path}: no ground truth at {truth_path}")
+                continue
+            with open(truth_path, "r", encoding="utf-8") as f:
+                items.append((image_path, f.read()))
+    return items
+
+
+def calibrate(items, models=None, sizes=None, runs=1, progress=print):
+    """Measure every model on every labelled image at every size.
+
+    Returns the calibration dict that select_model() reads: per model and
+    size, the mean OCR latency (seconds), character error rate and pixel count.
+    """
+    from image_pipeline import PreparedImage, resize_image
+    from ollama_vision_twopass import OllamaSession, TEXT_PROMPT, get_ollama_settings
+
+    url = get_ollama_settings()[0]
+    sizes = sizes or get_model_select_settings()["sizes"]
+    models = models or list_vision_models(url)
+    images = [(Image.open(path).convert("RGB"), truth) for path, truth in items]
+    results = {}
+    for model in models:
+        progress(f"{model}: loading")
+        session = OllamaSession(model=model)
+        try:
+            session.ask("Reply with OK.")  # load the model so the first sample isn't charged for it
+        finally:
+            session.close()
+        results[model] = {}
+        for side in sizes:
+            latencies, errors, pixels = [], [], []
+            for img, truth in images:
+                resized = resize_image(img, side)
+                b64 = PreparedImage(resized).b64
+                for _ in range(runs):
+                    session = OllamaSession(model=model)
+                    try:
+                        start = time.time()
+                        reply = session.ask(TEXT_PROMPT, images=[b64])
+                        latencies.append(time.time() - start)
+                    finally:
+                        session.close()
+                    errors.append(char_error_rate(reply, truth))
+                    pixels.append(resized.size[0] * resized.size[1])
+            entry = {"latency": sum(latencies) / len(latencies), "cer": sum(errors) / len(errors),
+                     "pixels": sum(pixels) / len(pixels)}
+            results[model][str(side)] = entry
+            progress(f"{model} @ {side}px: {entry['latency']:.2f}s, CER {entry['cer']:.3f}")
+    return {"created": time.time(), "url": url, "images": [path for path, _ in items],
+            "sizes": list(sizes), "models": results}
+
+
+def save_calibration(data, path=None):
+    path = path or calibration_path()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+    return path
+
+
+_calibration = {"path": None, "mtime": None, "data": None}
+_calibration_lock = threading.Lock()
+
+
+def load_calibration(path=None):
+    """The saved calibration (re-read when the file changes), or None."""
+    path = path or calibration_path()
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _calibration_lock:
+        if _calibration["path"] != path or _calibration["mtime"] != mtime:
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[DEBUG] unreadable model calibration {path}: {e}")
+                data = None
+            _calibration.update(path=path, mtime=mtime, data=data)
+        return _calibration["data"]
+
+
+# ---------------------------------------------------------------- selection
+
+def estimate(entries, size):
+    """(latency, cer) of one model for a capture of `size`, from its calibrated sizes.
+
+    Latency is interpolated linearly in pixel count (extrapolated past the
+    largest calibrated size); the error rate is the one of the closest size.
+    """
+    points = sorted((e["pixels"], e["latency"], e["cer"], int(side)) for side, e in entries.items())
+    pixels = size[0] * size[1]
+    side = max(size)
+    cer = min(points, key=lambda p: abs(p[3] - side))[2]
+    if len(points) == 1 or pixels <= points[0][0]:
+        return points[0][1], cer
+    for lo, hi in zip(points, points[1:]):
+        if pixels <= hi[0] or hi is points[-1]:
+            span = (hi[0] - lo[0]) or 1
+            return lo[1] + (hi[1] - lo[1]) * (pixels - lo[0]) / span, cer
+    return points[-1][1], cer
+
+
+def processed_size(size, model):
+    """Size a capture is sent at to `model`, after the longest-side and pixel caps of prepare_image."""
+    from image_pipeline import get_preprocess_settings
+
+    cfg = get_preprocess_settings(model)
+    w, h = size
+    if cfg["max_side"] and max(w, h) > cfg["max_side"]:
+        scale = cfg["max_side"] / max(w, h)
+        w, h = int(w * scale), int(h * scale)
+    if cfg["max_pixels"] and w * h > cfg["max_pixels"]:
+        scale = (cfg["max_pixels"] / (w * h)) ** 0.5
+        w, h = int(w * scale), int(h * scale)
+    return w, h
+
+
+def rank_models(size, calibration, budget, max_cer, installed=None, preprocess=True):
+    """Calibrated models as (latency, cer, model) for a capture of `size`, best first.
+
+    Models meeting the accuracy target come first, fastest first; among them
+    those within the latency budget lead. The rest follow, most accurate first.
+    """
+    ranked = []
+    for model, entries in calibration.get("models", {}).items():
+        if not entries or (installed is not None and not installed(model)):
+            continue
+        latency, cer = estimate(entries, processed_size(size, model) if preprocess else size)
+        ranked.append((latency, cer, model))
+    accurate = sorted(r for r in ranked if r[1] <= max_cer)
+    accurate.sort(key=lambda r: r[0] > budget)   # stable: keeps the speed order within each group
+    rest = sorted((r for r in ranked if r[1] > max_cer), key=lambda r: (r[1], r[0]))
+    return accurate + rest
+
+
+def select_model(size, budget=None, max_cer=None, default=None):
+    """Fastest calibrated model meeting the accuracy target for a capture of `size`.
+
+    Falls back to `default` (the configured model) when selection is
+    disabled, nothing is calibrated or no calibrated model meets the target.
+    If accurate models exist but none fits `budget`, the fastest of them is used.
+    """
+    from hosts import get_host_pool
+    from ollama_vision_twopass import get_ollama_settings
+
+    default = default or get_ollama_settings()[1]
+    cfg = get_model_select_settings()
+    if not cfg["enabled"] or size is None:
+        return default
+    calibration = load_calibration(calibration_path(cfg))
+    if not calibration:
+        return default
+    budget = cfg["latency_budget"] if budget is None else budget
+    max_cer = cfg["max_cer"] if max_cer is None else max_cer
+    pool = get_host_pool()
+    installed = lambda model: any(e.serves(model) for e in pool.endpoints)
+    ranked = rank_models(size, calibration, budget, max_cer, installed)
+    if not ranked or ranked[0][1] > max_cer:
+        return default
+    return ranked[0][2]
+
+
+def image_size(image):
+    """Size of a capture given as a path, PIL image or PreparedImage (only the header of a file is read)."""
+    if hasattr(image, "original_size"):
+        return image.original_size
+    if isinstance(image, str):
+        with Image.open(image) as img:
+            return img.size
+    return image.size
+
+
+# ---------------------------------------------------------------- CLI
+
+def print_calibration(data):
+    print(f"{'model':<28}{'size':>6}{'latency':>10}{'CER':>8}")
+    for model, entries in sorted(data.get("models", {}).items()):
+        for side, e in sorted(entries.items(), key=lambda kv: int(kv[0])):
+            print(f"{model:<28}{side:>6}{e['latency']:>9.2f}s{e['cer']:>8.3f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calibrate vision models and pick one per capture size.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    cal = sub.add_parser("calibrate", help="measure installed vision models on labelled images")
+    cal.add_argument("items", nargs="+", help="images or directories (each image needs a .txt ground truth)")
+    cal.add_argument("--models", nargs="+", help="models to measure (default: every installed vision model)")
+    cal.add_argument("--sizes", nargs="+", type=int, help="longest sides to test (default from settings)")
+    cal.add_argument("--runs", type=int, default=1, help="requests per image and size")
+    cal.add_argument("--output", help="calibration file (default: see model_select settings)")
+    sub.add_parser("show", help="print the saved calibration")
+    pick = sub.add_parser("pick", help="show the model chosen for a capture size")
+    pick.add_argument("size", help="WIDTHxHEIGHT")
+    pick.add_argument("--budget", type=float, help="latency budget in seconds")
+    pick.add_argument("--max-cer", type=float, help="highest acceptable character error rate")
+    args = parser.parse_args(argv)
+
+    if args.command == "calibrate":
+        labelled = load_labelled_set(args.items)
+        if not labelled:
+            print("No labelled images: put the expected text of each image in a .txt file next to it.",
+                  file=sys.stderr)
+            return 1
+        data = calibrate(labelled, args.models, args.sizes, args.runs)
+        print(f"Saved to {save_calibration(data, args.output)}")
+        print_calibration(data)
+        return 0
+
+    if args.command == "show":
+        data = load_calibration()
+        if not data:
+            print(f"No calibration at {calibration_path()}; run: python model_select.py calibrate IMAGES")
+            return 1
+        print_calibration(data)
+        return 0
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    cfg = get_model_select_settings()
+    budget = cfg["latency_budget"] if args.budget is None else args.budget
+    max_cer = cfg["max_cer"] if args.max_cer is None else args.max_cer
+    data = load_calibration() or {}
+    for latency, cer, model in rank_models((width, height), data, budget, max_cer):
+        print(f"{model:<28}{latency:>9.2f}s{cer:>8.3f}")
+    print(f"Selected: {select_model((width, height), args.budget, args.max_cer)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
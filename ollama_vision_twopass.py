@@ -1,9 +1,17 @@
 import os
 import json
-import base64
 import requests
 import time
-from PIL import Image as PILImage
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+from settings import get_section
+from image_pipeline import prepare_image
+from result_cache import get_result_cache
+from metrics import CaptureMetrics, response_stats, log_metrics
+from hosts import get_host_pool, is_host_failure
+from stream_guard import RepetitionGuard, get_guard_settings, image_dimensions, num_predict_for
 
 try:
     import ollama
@@ -23,113 +31,784 @@ def get_ollama_settings():
             ollama_url = cfg.get("ollama_url", ollama_url)
             ollama_model = cfg.get("ollama_default_model", ollama_model)
             keep_alive = cfg.get("keep_alive", keep_alive)
-    return ollama_url, ollama_model, keep_alive
+    # Lets benchmarks and scripts point the app at another server without editing config.json
+    ollama_url = os.environ.get("VISIONEXPLORER_OLLAMA_URL", ollama_url)
+    # Several servers (see hosts.py) are balanced by the sessions; this is the first one
+    return ollama_url.split(",")[0].strip(), ollama_model, keep_alive
 
 
-class OllamaSession:
+# Process-wide clients, one per host, so keep-alive connections are reused
+# across passes, captures and sessions instead of reconnecting every request.
+HTTP_POOL_SIZE = 8
+_clients = {}
+_clients_lock = threading.Lock()
 
-    def __init__(self, model=None):
-        self.url, default_model, self.keep_alive = get_ollama_settings()
-        self.model = model or default_model
-        self.messages = []
-        self.session = requests.Session() if not HAS_OLLAMA_LIB else None
 
-    def ask(self, content, images=None, callback=None):
-        msg = {"role": "user", "content": content}
-        if images:
-            msg["images"] = images
-        self.messages.append(msg)
+def get_http_session(url):
+    """Shared requests.Session for `url`."""
+    with _clients_lock:
+        key = ("requests", url)
+        if key not in _clients:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _clients[key] = session
+        return _clients[key]
 
-        if HAS_OLLAMA_LIB:
 
-            client = ollama.Client(host=self.url)
-            response = client.chat(model=self.model,
-                                   messages=self.messages,
-                                   stream=False,
-                                   keep_alive=self.keep_alive)
-            reply = response['message']['content']
+def get_client(url):
+    """Shared ollama.Client for `url` (requires the ollama library)."""
+    with _clients_lock:
+        key = ("ollama", url)
+        if key not in _clients:
+            _clients[key] = ollama.Client(host=url)
+        return _clients[key]
+
+
+def parse_keep_alive(value):
+    """Seconds for an Ollama keep_alive value ("10m", "1h30m", 300, "-1"); None means forever."""
+    if isinstance(value, (int, float)):
+        return None if value < 0 else float(value)
+    value = str(value).strip()
+    if value.startswith("-"):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {"h": 3600, "m": 60, "s": 1}
+    total, number = 0.0, ""
+    for ch in value:
+        if ch.isdigit() or ch == ".":
+            number += ch
+        elif ch in units and number:
+            total += float(number) * units[ch]
+            number = ""
         else:
+            raise ValueError(f"Unrecognised keep_alive value: {value!r}")
+    return total
+
+
+def warm_up_model(model=None, url=None, timeout=300):
+    """Load `model` into memory and (re)start its keep_alive timer.
+
+    Without `url` every available host in the pool is warmed. An /api/generate request without a prompt makes Ollama load the model and
+    return immediately once it is resident.
+    """
+    _, default_model, keep_alive = get_ollama_settings()
+    model = model or default_model
+    if url is None:
+        # Keep the model resident on every host a capture may be sent to
+        pool = get_host_pool()
+        endpoints, errors = pool.available(model), []
+        for endpoint in endpoints:
+            try:
+                warm_up_model(model, endpoint.url, timeout)
+            except requests.RequestException as e:
+                if is_host_failure(e):
+                    pool.mark_failed(endpoint, e)
+                errors.append(e)
+        if len(errors) == len(endpoints):
+            raise errors[0]
+        return
+    resp = get_http_session(url).post(
+        f"{url}/api/generate",
+        json={"model": model, "keep_alive": keep_alive},
+        timeout=(5, timeout))
+    resp.raise_for_status()
+
+
+class ModelWarmer:
+    """Background thread that pre-loads the model and keeps it resident.
+
+    warm_now() requests an immediate (non-blocking) warm-up, e.g. while the
+    capture overlay is open; otherwise the model is re-touched every
+    `interval` seconds, half the configured keep_alive by default.
+    """
+
+    def __init__(self, model=None, interval=None):
+        self.model = model
+        if interval is None:
+            keep_alive = parse_keep_alive(get_ollama_settings()[2])
+            interval = None if keep_alive is None else max(30.0, keep_alive / 2)
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="model-warmer", daemon=True)
+            self._thread.start()
+            self._wake.set()
+        return self
+
+    def warm_now(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                start = time.time()
+                warm_up_model(self.model)
+                print(f"[DEBUG] Model warm-up took {time.time() - start:.2f}s")
+            except Exception as e:
+                print(f"[DEBUG] Model warm-up failed: {e}")
+
+
+class GenerationCancelled(Exception):
+    """Raised inside a streaming request whose cancel event was set."""
+
+
+class CancelToken(threading.Event):
+    """A cancel event that also runs callbacks (e.g. OllamaSession.abort) when set."""
+
+    def __init__(self):
+        super().__init__()
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    def add_callback(self, callback):
+        """Run `callback` when cancelled (immediately if already cancelled)."""
+        with self._callbacks_lock:
+            if not self.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self._callbacks_lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
 
+    def set(self):
+        with self._callbacks_lock:
+            if self.is_set():
+                return
+            super().set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"[DEBUG] cancel callback failed: {e}")
+
+    cancel = set
+
+
+def linked_cancel_token(parent=None):
+    """A fresh CancelToken that is also cancelled when `parent` (a CancelToken) is."""
+    token = CancelToken()
+    if parent is not None and hasattr(parent, "add_callback"):
+        parent.add_callback(token.set)
+    return token
+
+
+class SessionBase:
+    """Conversation state and request building shared by the sync and async sessions.
+
+    mode "chat" re-sends the whole message history (including images) on
+    every turn. mode "generate" uses /api/generate and passes back the
+    `context` the server returned, so later turns only evaluate their new
+    prompt tokens instead of the image again. The default comes from the
+    "twopass" settings (session_mode).
+    """
+
+    def __init__(self, model=None, mode=None, affinity=None):
+        _, default_model, self.keep_alive = get_ollama_settings()
+        self.model = model or default_model
+        self.mode = mode or get_twopass_settings()["session_mode"]
+        self.messages = []
+        self.context = None   # token context from the last /api/generate reply
+        self.last_stats = {}  # Ollama timing fields (and host) of the most recent reply
+        # Size of the conversation's image, for the reply length cap (see stream_guard.py)
+        self.image_size = None
+        self.guard_cfg = get_guard_settings()
+        # The host is picked once, so every turn of the conversation stays on it
+        self.affinity = affinity
+        self.pool = get_host_pool()
+        self._use_endpoint(self.pool.select(self.model, affinity))
+
+    def _use_endpoint(self, endpoint):
+        self.endpoint = endpoint
+        self.url = endpoint.url
+
+    def _failover(self, error, tried):
+        """After a host failure, move the session to another host; False if there is none."""
+        endpoint = self.pool.failover(self.endpoint, error, tried, self.model, self.affinity)
+        if endpoint is None:
+            return False
+        self._use_endpoint(endpoint)
+        return True
+
+    def _request(self, stream):
+        """(endpoint, payload) for the latest user turn."""
+        # Without a context from the previous reply, only the full history carries the image
+        if self.mode == "generate" and (self.context or len(self.messages) == 1):
+            turn = self.messages[-1]
             payload = {
+                "model": self.model,
+                "prompt": turn["content"],
+                "stream": stream,
+                "keep_alive": self.keep_alive
+            }
+            if turn.get("images"):
+                payload["images"] = turn["images"]
+            endpoint = "/api/generate"
+            if self.context:
+                payload["context"] = self.context
+        else:
+            endpoint, payload = "/api/chat", {
                 "model": self.model,
                 "messages": self.messages,
-                "stream": False,
+                "stream": stream,
                 "keep_alive": self.keep_alive
             }
-            resp = self.session.post(
-                f"{self.url}/api/chat",
-                json=payload,
-                headers={"Content-Type": "application/json"},
-                timeout=(30, 300))
+        num_predict = num_predict_for(self.image_size, self.guard_cfg)
+        if num_predict:
+            payload["options"] = {"num_predict": num_predict}
+        return endpoint, payload
+
+    def _record_reply(self, chunk):
+        """Keep the stats (and generate context) of a final response chunk."""
+        self.last_stats = response_stats(chunk)
+        self.last_stats["host"] = self.url
+        if chunk.get("done_reason") == "length":
+            self.last_stats["done_reason"] = "length"  # stopped by the num_predict cap
+        context = chunk.get("context")
+        if context:
+            self.context = list(context)
+
+    @staticmethod
+    def _reply_text(chunk):
+        if chunk.get("response") is not None:
+            return chunk.get("response")
+        message = chunk.get("message") or {}
+        return message.get("content") or ""
+
+    def _add_user_message(self, content, images):
+        msg = {"role": "user", "content": content}
+        if images:
+            msg["images"] = images
+            sizes = [size for size in map(image_dimensions, images) if size]
+            if len(sizes) == 1:
+                self.image_size = sizes[0]
+            elif sizes:
+                # Several images: cap the reply by their combined pixel count
+                self.image_size = (sum(w * h for w, h in sizes), 1)
+        self.messages.append(msg)
+
+    def _new_guard(self):
+        """A RepetitionGuard for the next streamed reply, or None when disabled."""
+        if not self.guard_cfg["enabled"]:
+            return None
+        return RepetitionGuard(self.guard_cfg, num_predict_for(self.image_size, self.guard_cfg))
+
+    def _finish_reply(self, parts, guard):
+        """The reply text; a looping one is trimmed and the event kept in last_stats."""
+        if guard is None or not guard.tripped:
+            return "".join(parts)
+        print(f"[DEBUG] Generation stuck in a loop, stopped early: {guard.event}")
+        self.last_stats["host"] = self.url
+        self.last_stats["repetition"] = guard.event
+        return guard.trimmed()
+
+    def close(self):
+        """End the conversation. Pooled connections stay open for the next session."""
+        self.messages = []
+        self.context = None
+
+
+class OllamaSession(SessionBase):
+    """A blocking session, over the ollama library when installed, else pooled requests.
+
+    Requests go to a host from hosts.get_host_pool(); sessions created with the
+    same `affinity` key share a host. If the host is unreachable before any
+    reply token arrived, the turn is retried on another one.
+    """
+
+    def __init__(self, model=None, mode=None, affinity=None):
+        self._active_response = None
+        super().__init__(model, mode, affinity)
+
+    def _use_endpoint(self, endpoint):
+        super()._use_endpoint(endpoint)
+        self.session = get_http_session(self.url) if not HAS_OLLAMA_LIB else None
+
+    def _lib_request(self, stream):
+        endpoint, payload = self._request(stream)
+        client = get_client(self.url)
+        if endpoint == "/api/generate":
+            return client.generate(**payload)
+        return client.chat(**payload)
+
+    def _post(self):
+        """One non-streaming request to the current host."""
+        if HAS_OLLAMA_LIB:
+            return self._lib_request(stream=False)
+        endpoint, payload = self._request(stream=False)
+        resp = self.session.post(
+            f"{self.url}{endpoint}",
+            json=payload,
+            headers={"Content-Type": "application/json"},
+            timeout=(30, 300))
+        resp.raise_for_status()
+        return resp.json()
+
+    def _stream_chunks(self, check_cancelled):
+        """Yield the reply chunks of one streaming request to the current host."""
+        if HAS_OLLAMA_LIB:
+            stream = self._lib_request(stream=True)
+            try:
+                for chunk in stream:
+                    check_cancelled()
+                    yield chunk
+            finally:
+                stream.close()  # closes the HTTP stream if we stopped early
+            return
+        endpoint, payload = self._request(stream=True)
+        resp = self.session.post(
+            f"{self.url}{endpoint}",
+            json=payload,
+            headers={"Content-Type": "application/json"},
+            timeout=(30, 300),
+            stream=True)
+        self._active_response = resp
+        try:
             resp.raise_for_status()
-            reply = resp.json()["message"]["content"]
+            for line in resp.iter_lines():
+                check_cancelled()
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if "error" in chunk:
+                    raise RuntimeError(chunk["error"])
+                yield chunk
+        except (requests.RequestException, AttributeError, ValueError):
+            # abort() closed the stream under us: report it as a cancellation
+            check_cancelled()
+            raise
+        finally:
+            self._active_response = None
+            resp.close()
+
+    def ask(self, content, images=None, callback=None, cancel_event=None):
+        """Send one user turn and return the whole reply.
+
+        If `callback` is given the reply is streamed and callback(token) is
+        called for every chunk as it arrives. Setting `cancel_event` (also
+        streamed) aborts the request with GenerationCancelled. With the
+        repetition guard enabled replies are always streamed, so a looping
+        one can be stopped.
+        """
+        if callback is not None or cancel_event is not None or self.guard_cfg["enabled"]:
+            for token in self.ask_stream(content, images=images, cancel_event=cancel_event):
+                if callback is not None:
+                    callback(token)
+            return self.messages[-1]["content"]
+
+        self._add_user_message(content, images)
+        tried = set()
+        while True:
+            endpoint, error = self.endpoint, None
+            self.pool.begin(endpoint)
+            try:
+                response = self._post()
+                break
+            except Exception as e:
+                error = e
+                if not self._failover(e, tried):
+                    raise
+            finally:
+                self.pool.end(endpoint, error)
+        reply = self._reply_text(response)
+        self._record_reply(response)
 
         self.messages.append({"role": "assistant", "content": reply})
         return reply
 
+    def ask_stream(self, content, images=None, cancel_event=None):
+        """Send one user turn and yield reply tokens as the model generates them.
+
+        If the reply falls into a loop the stream is closed; the conversation
+        keeps the reply without its repeated tail.
+        """
+        self._add_user_message(content, images)
+        self.last_stats = {}
+        parts = []
+        guard = self._new_guard()
+
+        def check_cancelled():
+            if cancel_event is not None and cancel_event.is_set():
+                raise GenerationCancelled()
+
+        # A CancelToken closes the HTTP stream the moment it is cancelled
+        add_callback = getattr(cancel_event, "add_callback", None)
+        if add_callback is not None:
+            add_callback(self.abort)
+
+        tried = set()
+        try:
+            check_cancelled()
+            while True:
+                endpoint, error = self.endpoint, None
+                chunks = self._stream_chunks(check_cancelled)
+                self.pool.begin(endpoint)
+                try:
+                    for chunk in chunks:
+                        if chunk.get("done"):
+                            self._record_reply(chunk)
+                        token = self._reply_text(chunk)
+                        if token:
+                            parts.append(token)
+                            yield token
+                            if guard is not None and guard.feed(token):
+                                break  # closing the stream stops the generation
+                    break
+                except Exception as e:
+                    error = e
+                    # Only a turn that produced nothing yet can be replayed elsewhere
+                    if parts or not self._failover(e, tried):
+                        raise
+                finally:
+                    chunks.close()
+                    self.pool.end(endpoint, error)
+        finally:
+            if add_callback is not None:
+                cancel_event.remove_callback(self.abort)
+            # Keep the conversation consistent even if the consumer stops early
+            self.messages.append({"role": "assistant", "content": self._finish_reply(parts, guard)})
+
+    def abort(self):
+        """Close the in-flight streaming response (if any) from another thread.
+
+        Only the raw requests path can be interrupted mid-read; the ollama
+        library path stops at the next chunk once its cancel event is set.
+        """
+        resp = self._active_response
+        if resp is not None:
+            resp.close()
+
     def close(self):
-        if self.session:
-            self.session.close()
+        super().close()
+        self._active_response = None
 
 
-def query_ollama_vision_twopass(image_path, progress_callback=None):
-    """Two-pass approach: first extract text, then describe visual elements"""
+def field_callback(stream_callback, field):
+    """callback(token) for one field of a stream_callback(field, token), or None."""
+    if stream_callback is None:
+        return None
+    return lambda token: stream_callback(field, token)
 
-    session = OllamaSession()
 
-    from PIL import Image as PILImage
-    with PILImage.open(image_path) as img:
-        img_width, img_height = img.size
+TEXT_PROMPT = (
+    "If you find text in this image, please read the entire text carefully, neatly formatted. "
+    "Don't miss out any words. Don't rely on your memory about the subject in the text. "
+    "Stay grounded to the text in the image."
+    "By text I mean all text, typed, hand written, photographed, painted, drawn and all text variations"
+    "Don't provide any explanations of what you see,only provide the extracted the text. "
+    "Your job is to extract text just similar to a good OCR app")
 
-    if HAS_OLLAMA_LIB:
-        image_input = image_path
+VISUAL_PROMPT = (
+    "Now focus only on the visual aspects - describe the layout, colors, objects, and spatial relationships. "
+    "Do NOT repeat any text content from your previous response.")
 
-    else:
-        with open(image_path, "rb") as f:
-            raw = f.read()
-        image_input = base64.b64encode(raw).decode()
+# Used when the visual pass runs on its own, without the OCR turn in its history
+VISUAL_PROMPT_STANDALONE = (
+    "Focus only on the visual aspects of this image - describe the layout, colors, objects, and spatial relationships. "
+    "Do NOT transcribe the text it contains.")
 
-    try:
-        start_time = time.time()
 
-        if progress_callback:
-            progress_callback("Extracting text...")
+def get_twopass_settings():
+    """The "twopass" section of app_settings.json, with defaults."""
+    cfg = {"concurrent_passes": False, "session_mode": "chat"}
+    cfg.update(get_section("twopass"))
+    return cfg
 
-        text_prompt = (
-            "If you find text in this image, please read the entire text carefully, neatly formatted. "
-            "Don't miss out any words. Don't rely on your memory about the subject in the text. "
-            "Stay grounded to the text in the image."
-            "By text I mean all text, typed, hand written, photographed, painted, drawn and all text variations"
-            "Don't provide any explanations of what you see,only provide the extracted the text. "
-            "Your job is to extract text just similar to a good OCR app")
 
-        first_start = time.time()
-        first_pass_response = session.ask(text_prompt, images=[image_input])
-        first_duration = time.time() - first_start
+# One request of a planned capture: `image` is a PreparedImage, or None for a turn that
+# relies on the image already in the conversation; `status` is shown when the request starts
+PassStep = namedtuple("PassStep", "field prompt image status")
+
+
+def plan_passes(mode, prepared, session_mode):
+    """The requests for a pass mode, as conversations of PassSteps (shared by both pipelines).
+
+    Conversations run at the same time on one host; the steps of a conversation
+    run in order in one session. Tiled captures are read by the tiling runners,
+    so they get no conversations here, and neither do empty ones.
+    """
+    text = PassStep("text", TEXT_PROMPT, prepared.ocr_input, "Extracting text...")
+    if mode == "text_only":
+        return [[text._replace(status="Extracting text (no visual pass needed)...")]]
+    if mode == "visual_only":
+        return [[PassStep("visual", VISUAL_PROMPT_STANDALONE, prepared,
+                          "Describing visual elements (no text detected)...")]]
+    if mode == "concurrent":
+        return [[text._replace(status="Extracting text and describing visual elements...")],
+                [PassStep("visual", VISUAL_PROMPT_STANDALONE, prepared, None)]]
+    if mode == "sequential":
+        # If the OCR pass saw a grayscale/contrast variant, show the model the real colours,
+        # except in generate mode: a new image there is evaluated again on top of the context
+        colour = prepared if prepared.ocr is not None and session_mode != "generate" else None
+        return [[text, PassStep("visual", VISUAL_PROMPT, colour, "Describing visual elements...")]]
+    return []
 
-        if progress_callback:
-            progress_callback("Describing visual elements...")
 
-        visual_prompt = (
-            "Now focus only on the visual aspects - describe the layout, colors, objects, and spatial relationships. "
-            "Do NOT repeat any text content from your previous response.")
+def encode_step(step, metrics):
+    """The base64 payload of a PassStep's image (None for a turn without one)."""
+    if step.image is None:
+        return None
+    with metrics.stage("encode"):
+        return step.image.b64
 
-        second_start = time.time()
-        second_pass_response = session.ask(visual_prompt)
-        second_duration = time.time() - second_start
 
-        text_content = first_pass_response
-        visual_description = second_pass_response
+def run_planned_passes(plan, stream_callback=None, progress_callback=None, metrics=None,
+                       cancel_event=None):
+    """Run plan["passes"] with blocking sessions; returns (text, visual).
 
-        total_duration = time.time() - start_time
+    If one of several conversations fails the others are cancelled and the
+    first real error is re-raised. Cancelling `cancel_event` (a CancelToken)
+    aborts them all with GenerationCancelled.
+    """
+    metrics = metrics if metrics is not None else CaptureMetrics()
+    conversations = plan["passes"]
+    if len(conversations) > 1:
+        cancel_event = linked_cancel_token(cancel_event)
+    # All conversations of the capture go to the same host, where the model is already loaded
+    affinity = object()
+    sessions = [OllamaSession(model=plan["model"], mode=plan["session_mode"], affinity=affinity)
+                for _ in conversations]
+    replies = {}
 
-        return {
-            "text":
-            text_content,
-            "visual":
-            visual_description,
-            "combined":
-            f"TEXT CONTENT:\n{text_content}\n\nVISUAL DESCRIPTION:\n{visual_description}"
-        }
+    def run(session, steps):
+        try:
+            for step in steps:
+                if progress_callback and step.status:
+                    progress_callback(step.status)
+                image_input = encode_step(step, metrics)
+                start = time.time()
+                replies[step.field] = session.ask(step.prompt,
+                                                  images=[image_input] if image_input else None,
+                                                  callback=field_callback(stream_callback, step.field),
+                                                  cancel_event=cancel_event)
+                metrics.add_pass(step.field, session.last_stats, time.time() - start)
+        except Exception:
+            if len(sessions) > 1:
+                # Stop the sibling passes right away so their server slots free up
+                cancel_event.set()
+                for other in sessions:
+                    if other is not session:
+                        other.abort()
+            raise
+
+    try:
+        if len(sessions) == 1:
+            run(sessions[0], conversations[0])
+        elif sessions:
+            with ThreadPoolExecutor(max_workers=len(sessions)) as pool:
+                futures = [pool.submit(run, session, steps) for session, steps in zip(sessions, conversations)]
+                wait(futures, return_when=FIRST_EXCEPTION)
+                wait(futures)
+            errors = [f.exception() for f in futures if f.exception() is not None]
+            real_errors = [e for e in errors if not isinstance(e, GenerationCancelled)]
+            if errors:
+                raise (real_errors or errors)[0]
     finally:
-        session.close()
+        for session in sessions:
+            session.close()
+    return replies.get("text", ""), replies.get("visual", "")
+
+
+def plan_twopass(image, model=None, use_cache=True, concurrent=None, tiled=None, metrics=None,
+                 route=None, record=True):
+    """Preprocess a capture and pick the pass mode (shared by the sync and async pipelines).
+
+    Returns a dict with model, prepared, mode ("sequential", "concurrent",
+    "tiled", "text_only", "visual_only" or "empty"), visual (whether a tiled
+    capture also gets the visual pass), route (the content_router decision, or
+    None), prompts, passes (see plan_passes), session_mode, tiling_cfg, cache,
+    cache_key, cached (the cached result, or None), source (the `image`
+    argument) and record (whether the finish_* helpers write the metrics log and
+    history). Timings go to `metrics`, a new CaptureMetrics unless one is
+    passed in.
+    """
+    from tiling import get_tiling_settings, should_tile
+    from content_router import get_router_settings, route_capture
+
+    metrics = metrics if metrics is not None else CaptureMetrics()
+    twopass_cfg = get_twopass_settings()
+    if concurrent is None:
+        concurrent = twopass_cfg["concurrent_passes"]
+    if model is None:
+        from model_select import select_model, image_size
+        default = get_ollama_settings()[1]
+        model = select_model(image_size(image), default=default)
+        if model != default:
+            metrics.set("model_selected", True)
+
+    with metrics.stage("preprocess"):
+        prepared = start_encoding(prepare_image(image, model=model))
+    router_cfg = get_router_settings()
+    routing = None
+    if router_cfg["enabled"] if route is None else route:
+        with metrics.stage("route"):
+            routing = route_capture(prepared.source, model, dict(router_cfg, enabled=True))
+        if routing["model"] != model:
+            model = routing["model"]
+            with metrics.stage("preprocess"):
+                prepared = start_encoding(prepare_image(image, model=model))
+    run_text = routing is None or routing["text"]
+    run_visual = routing is None or routing["visual"]
+    tiling_cfg = get_tiling_settings()
+    if tiled is None:
+        tiled = should_tile(prepared.source.size, tiling_cfg)
+
+    if not run_text:
+        mode = "visual_only" if run_visual else "empty"
+        prompts = (mode, VISUAL_PROMPT_STANDALONE) if run_visual else (mode,)
+    elif tiled:
+        mode, prompts = "tiled", ("tiled", TEXT_PROMPT) + ((VISUAL_PROMPT_STANDALONE,) if run_visual else ())
+    elif not run_visual:
+        mode, prompts = "text_only", ("text_only", TEXT_PROMPT)
+    elif concurrent:
+        mode, prompts = "concurrent", (TEXT_PROMPT, VISUAL_PROMPT_STANDALONE)
+    else:
+        mode, prompts = "sequential", (TEXT_PROMPT, VISUAL_PROMPT)
+    metrics.set("model", model)
+    metrics.set("mode", mode)
+    metrics.set("session_mode", twopass_cfg["session_mode"])
+    metrics.set("original_size", list(prepared.original_size))
+    metrics.set("image_size", list(prepared.size))
+    if routing is not None:
+        metrics.set("route", routing["decision"])
+
+    cache = get_result_cache() if use_cache else None
+    cache_key = cache.key_for(prepared.image, model, prepared.ocr_variant or "",
+                              *prompts) if cache else None
+    return {
+        "model": model,
+        "prepared": prepared,
+        "mode": mode,
+        "visual": run_visual,
+        "route": routing,
+        "prompts": prompts,
+        "passes": plan_passes(mode, prepared, twopass_cfg["session_mode"]),
+        "session_mode": twopass_cfg["session_mode"],
+        "tiling_cfg": tiling_cfg,
+        "cache": cache,
+        "cache_key": cache_key,
+        "cached": cache.get(cache_key) if cache else None,
+        "source": image,
+        "record": record,
+    }
+
+
+def start_encoding(prepared):
+    """Encode the payloads in the background while routing and the cache lookup run."""
+    prepared.encode_async()
+    if prepared.ocr is not None:
+        prepared.ocr.encode_async()
+    return prepared
+
+
+def payload_info(prepared):
+    """Format, size and encode time of each payload that was encoded for a capture."""
+    info = {}
+    for name, image in (("image", prepared), ("ocr", prepared.ocr)):
+        if image is not None and image.encoding is not None:
+            info[name] = image.encoding
+    return info
+
+
+def finish_twopass(plan, text_content, visual_description, metrics, start_time):
+    """Build the result dict, store it in the cache and (with plan["record"]) history and the metrics log."""
+    from history import record_capture
+
+    metrics.add_stage("total", time.time() - start_time)
+    result = {
+        "text":
+        text_content,
+        "visual":
+        visual_description,
+        "combined":
+        f"TEXT CONTENT:\n{text_content}\n\nVISUAL DESCRIPTION:\n{visual_description}"
+    }
+    if plan["route"] is not None:
+        result["route"] = plan["route"]
+    if plan["cache"]:
+        plan["cache"].put(plan["cache_key"], result)
+    metrics.set("payload", payload_info(plan["prepared"]))
+    result["metrics"] = metrics.to_dict()
+    if plan["record"]:
+        log_metrics(result["metrics"])
+        record_capture(result, plan)
+    return result
+
+
+def finish_cached_twopass(plan, metrics, start_time):
+    metrics.set("cache_hit", True)
+    metrics.add_stage("total", time.time() - start_time)
+    cached = plan["cached"]
+    cached["metrics"] = metrics.to_dict()
+    if plan["record"]:
+        log_metrics(cached["metrics"])
+    return cached
+
+
+def query_ollama_vision_twopass(image, progress_callback=None, use_cache=True, model=None,
+                                stream_callback=None, concurrent=None, tiled=None, metrics=None,
+                                cancel_event=None, route=None, record=True):
+    """Two-pass approach: first extract text, then describe visual elements
+
+    `image` may be a file path, a PIL image or an image_pipeline.PreparedImage;
+    it is resized and encoded in memory, without temporary files.
+
+    stream_callback(field, token) receives reply tokens as they are generated,
+    with field "text" for the OCR pass and "visual" for the description pass.
+    With `concurrent` (default from the "twopass" settings) both passes run as
+    independent requests at the same time instead of one conversation.
+    With `tiled` (default: the "tiling" settings decide by capture size) the
+    text pass reads overlapping full-resolution tiles concurrently.
+
+    Stage timings and Ollama eval statistics are collected in `metrics` (a new
+    CaptureMetrics unless one is passed in), returned under result["metrics"]
+    and, with `record`, appended to the metrics log; the result also goes to
+    the capture history. Benchmarks pass record=False to keep both untouched.
+
+    Cancelling `cancel_event` (a CancelToken) closes the in-flight HTTP
+    streams and raises GenerationCancelled.
+
+    With `route` (default from the "router" settings) a quick local analysis
+    (content_router.py) skips passes the capture doesn't need: no OCR on a
+    photo, no description of plain text, nothing at all on a blank capture.
+    Skipped fields come back empty and the decision is in result["route"].
+    """
+    from tiling import run_tiled_passes
+
+    start_time = time.time()
+    metrics = metrics if metrics is not None else CaptureMetrics()
+    plan = plan_twopass(image, model, use_cache, concurrent, tiled, metrics, route, record)
+    if plan["cached"] is not None:
+        if progress_callback:
+            progress_callback("Loaded cached result")
+        return finish_cached_twopass(plan, metrics, start_time)
+
+    if plan["mode"] == "tiled":
+        text_content, visual_description = run_tiled_passes(
+            plan["prepared"], plan["model"], stream_callback, progress_callback, plan["tiling_cfg"],
+            metrics, cancel_event, visual=plan["visual"])
+    else:
+        text_content, visual_description = run_planned_passes(plan, stream_callback, progress_callback,
+                                                              metrics, cancel_event)
+
+    return finish_twopass(plan, text_content, visual_description, metrics, start_time)
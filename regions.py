@@ -0,0 +1,236 @@
+"""
+Multi-region captures: several areas selected on one screenshot
+(ScreenSelector.capture_images) and processed as one batch.
+
+mode "jobs" runs the two-pass pipeline on every region at the same time,
+`workers` at once (hosts.py spreads them over the configured hosts). Each
+region keeps its own caching, routing, tiling and history.
+
+mode "combined" sends all regions in one multi-image request that asks for
+a section per region, so the model is prompted once instead of per region.
+Regions whose section is missing from the reply fall back to their own job.
+
+"auto" combines small batches and runs the rest as jobs. A batch is small
+when it has at most `max_combined_regions` regions and at most
+`max_combined_pixels` pixels after preprocessing.
+"""
+
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from settings import get_section, default_workers
+from metrics import CaptureMetrics, log_metrics
+from image_pipeline import prepare_image
+from ollama_vision_twopass import (OllamaSession, GenerationCancelled, query_ollama_vision_twopass,
+                                   get_ollama_settings, start_encoding)
+
+DEFAULT_REGION_SETTINGS = {
+    "mode": "auto",                  # "auto", "jobs" or "combined"
+    "workers": None,                 # regions processed at once in jobs mode; None: OLLAMA_NUM_PARALLEL or 2
+    "max_combined_regions": 4,
+    "max_combined_pixels": 1500000,  # total preprocessed pixels of a combined request
+}
+
+COMBINED_PROMPT = (
+    "These {count} images are regions of one screen, in order. For each region write a section "
+    "that starts with a line '=== Region N ===' (N from 1 to {count}), then a line 'TEXT:' followed "
+    "by all text visible in that region exactly as written, then a line 'DESCRIPTION:' followed by "
+    "a brief description of its visual elements (charts, icons, layout). Do not skip any region."
+)
+
+_SECTION = re.compile(r"^\W*region\s+(\d+)\W*$", re.I | re.M)
+_DESCRIPTION = re.compile(r"^\W*description\s*:[*_\s]*", re.I | re.M)
+_TEXT = re.compile(r"^\W*text\s*:[*_\s]*", re.I)
+
+
+def get_region_settings():
+    cfg = dict(DEFAULT_REGION_SETTINGS)
+    cfg.update(get_section("regions"))
+    return cfg
+
+
+def split_sections(reply, count):
+    """{region index: (text, visual)} from a combined reply; missing or empty sections are left out."""
+    found = {}
+    matches = list(_SECTION.finditer(reply))
+    for m, nxt in zip(matches, matches[1:] + [None]):
+        index = int(m.group(1)) - 1
+        if not 0 <= index < count or index in found:
+            continue
+        body = reply[m.end():nxt.start() if nxt else len(reply)].strip()
+        parts = _DESCRIPTION.split(body, maxsplit=1)
+        text = _TEXT.sub("", parts[0], count=1).strip()
+        visual = parts[1].strip() if len(parts) > 1 else ""
+        if text or visual:
+            found[index] = (text, visual)
+    return found
+
+
+def _check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise GenerationCancelled()
+
+
+def _region_result(index, bbox, text="", visual="", metrics=None, error=None):
+    result = {"index": index, "bbox": list(bbox) if bbox else None, "text": text, "visual": visual}
+    if metrics is not None:
+        result["metrics"] = metrics
+    if error is not None:
+        result["error"] = error
+    return result
+
+
+def run_jobs(images, indices, bboxes, model=None, use_cache=True, workers=2, stream_callback=None,
+             region_callback=None, cancel_event=None):
+    """Run the two-pass pipeline on each region in `indices` concurrently; {index: region result}."""
+    def run(index):
+        _check_cancelled(cancel_event)
+        stream = None
+        if stream_callback:
+            stream = lambda field, token: stream_callback(index, field, token)
+        return query_ollama_vision_twopass(images[index], use_cache=use_cache, model=model,
+                                           stream_callback=stream, cancel_event=cancel_event)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(indices))),
+                            thread_name_prefix="region") as pool:
+        futures = {pool.submit(run, index): index for index in indices}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                out = future.result()
+                result = _region_result(index, bboxes[index], out["text"], out["visual"], out["metrics"])
+            except GenerationCancelled:
+                continue
+            except Exception as e:
+                print(f"[DEBUG] region {index + 1} failed: {e}")
+                result = _region_result(index, bboxes[index], error=str(e))
+            results[index] = result
+            if region_callback:
+                region_callback(index, result)
+    _check_cancelled(cancel_event)
+    return results
+
+
+def run_combined(images, bboxes, model=None, metrics=None, region_callback=None, cancel_event=None,
+                 prepared=None):
+    """All regions in one multi-image request; {index: region result} for the sections found in the reply."""
+    from history import record_capture
+    from model_select import select_model, image_size
+
+    metrics = metrics if metrics is not None else CaptureMetrics()
+    if model is None:
+        largest = max(map(image_size, images), key=lambda s: s[0] * s[1])
+        model = select_model(largest, default=get_ollama_settings()[1])
+    if prepared is None:
+        with metrics.stage("preprocess"):
+            prepared = [start_encoding(prepare_image(img, model=model)) for img in images]
+    with metrics.stage("encode"):
+        payload = [p.b64 for p in prepared]
+    session = OllamaSession(model=model)
+    try:
+        start = time.time()
+        reply = session.ask(COMBINED_PROMPT.format(count=len(images)), images=payload,
+                            cancel_event=cancel_event)
+        metrics.add_pass("combined", session.last_stats, time.time() - start)
+    finally:
+        session.close()
+
+    results = {}
+    for index, (text, visual) in split_sections(reply, len(images)).items():
+        results[index] = _region_result(index, bboxes[index], text, visual)
+        # Each region is kept in the history on its own, like a single capture
+        info = {"mode": "combined", "model": model, "original_size": list(prepared[index].original_size)}
+        record_capture({"text": text, "visual": visual, "metrics": info},
+                       {"prepared": prepared[index], "model": model, "cache_key": None, "source": None})
+        if region_callback:
+            region_callback(index, results[index])
+    return results
+
+
+def choose_mode(prepared, cfg):
+    """"combined" or "jobs" for a batch of preprocessed regions."""
+    if cfg["mode"] != "auto":
+        return cfg["mode"]
+    if len(prepared) < 2 or len(prepared) > cfg["max_combined_regions"]:
+        return "jobs"
+    pixels = sum(p.size[0] * p.size[1] for p in prepared)
+    return "combined" if pixels <= cfg["max_combined_pixels"] else "jobs"
+
+
+def join_results(regions, field):
+    """One text for all regions, each under a "── Region N ──" heading."""
+    parts = []
+    for r in regions:
+        body = f"Error: {r['error']}" if r.get("error") else r[field]
+        parts.append(f"── Region {r['index'] + 1} ──\n{body}")
+    return "\n\n".join(parts)
+
+
+def query_regions(images, bboxes=None, mode=None, model=None, use_cache=True, stream_callback=None,
+                  region_callback=None, progress_callback=None, metrics=None, cancel_event=None):
+    """Process several regions of one capture as a batch.
+
+    `images` are PIL images (or paths). `mode` overrides the "regions"
+    settings. stream_callback(index, field, token) receives tokens of the
+    per-region jobs. region_callback(index, result) is called from a worker
+    thread as each region finishes.
+
+    Returns {"mode", "regions", "text", "visual", "metrics"}. "regions"
+    holds one dict per region, in selection order, with index, bbox, text,
+    visual and the region's metrics or error. "text" and "visual" join all
+    regions under a heading each.
+    """
+    from model_select import select_model, image_size
+
+    start_time = time.time()
+    cfg = get_region_settings()
+    if mode is not None:
+        cfg["mode"] = mode
+    metrics = metrics if metrics is not None else CaptureMetrics()
+    bboxes = list(bboxes) if bboxes is not None else [None] * len(images)
+    workers = cfg["workers"] or default_workers()
+
+    prepared = None
+    if cfg["mode"] != "jobs" and len(images) > 1:
+        # A combined request goes to one model: the one picked for the largest region
+        largest = max(map(image_size, images), key=lambda s: s[0] * s[1])
+        combined_model = model or select_model(largest, default=get_ollama_settings()[1])
+        with metrics.stage("preprocess"):
+            prepared = [start_encoding(prepare_image(img, model=combined_model)) for img in images]
+        mode = choose_mode(prepared, cfg)
+    else:
+        mode = "jobs"
+    metrics.set("regions", len(images))
+    metrics.set("region_mode", mode)
+
+    results = {}
+    if mode == "combined":
+        if progress_callback:
+            progress_callback(f"Reading {len(images)} regions in one request...")
+        try:
+            results = run_combined(images, bboxes, combined_model, metrics, region_callback, cancel_event,
+                                   prepared)
+        except GenerationCancelled:
+            raise
+        except Exception as e:
+            print(f"[DEBUG] combined request failed, running regions separately: {e}")
+        missing = [i for i in range(len(images)) if i not in results]
+        if missing:
+            print(f"[DEBUG] no section for regions {[i + 1 for i in missing]}, running them separately")
+            metrics.set("region_fallbacks", len(missing))
+    else:
+        missing = list(range(len(images)))
+    if missing:
+        if progress_callback:
+            progress_callback(f"Reading {len(missing)} regions ({min(workers, len(missing))} at a time)...")
+        results.update(run_jobs(images, missing, bboxes, model, use_cache, workers, stream_callback,
+                                region_callback, cancel_event))
+
+    metrics.add_stage("total", time.time() - start_time)
+    regions = [results[i] for i in sorted(results)]
+    summary = metrics.to_dict()
+    log_metrics(summary)
+    return {"mode": mode, "regions": regions, "text": join_results(regions, "text"),
+            "visual": join_results(regions, "visual"), "metrics": summary}
@@ -0,0 +1,90 @@
+"""
+Side-by-side results of a multi-region capture (see regions.py).
+
+One column per region, in selection order: the region's image, its status
+and a TextViewer with the extracted text and description. Columns fill in
+as regions finish; with many regions the row scrolls sideways.
+"""
+
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.button import Button
+from kivy.uix.image import Image
+from kivy.uix.label import Label
+from kivy.uix.popup import Popup
+from kivy.uix.scrollview import ScrollView
+
+from metrics import format_summary
+from text_viewer import TextViewer
+
+# Narrowest column before the row starts scrolling sideways
+MIN_COLUMN_WIDTH = 320
+
+
+def region_text(result):
+    """Text shown in a region's column."""
+    if result.get("error"):
+        return f"Error: {result['error']}"
+    return f"TEXT:\n{result['text']}\n\nVISUAL:\n{result['visual']}"
+
+
+class RegionColumn(BoxLayout):
+    def __init__(self, index, texture, size, **kwargs):
+        super().__init__(orientation="vertical", spacing=5, **kwargs)
+        title = Label(text=f"Region {index + 1}: {size[0]}x{size[1]}", size_hint_y=None, height=24,
+                      halign="left", color=(0.9, 0.9, 0.9, 1))
+        title.bind(size=title.setter("text_size"))
+        self.add_widget(title)
+        preview = Image(allow_stretch=True, keep_ratio=True, size_hint_y=0.35)
+        preview.texture = texture
+        self.add_widget(preview)
+        self.status = Label(text="Processing...", size_hint_y=None, height=20, halign="left",
+                            color=(0.6, 0.6, 0.6, 1), font_size="12sp", shorten=True)
+        self.status.bind(size=self.status.setter("text_size"))
+        self.add_widget(self.status)
+        self.viewer = TextViewer(text="", toolbar=False, background_color=(0.2, 0.2, 0.2, 1),
+                                 foreground_color=(0.9, 0.9, 0.9, 1), font_name="RobotoMono-Regular",
+                                 font_size="13sp")
+        self.add_widget(self.viewer)
+
+    def show(self, result):
+        self.viewer.text = region_text(result)
+        metrics = result.get("metrics")
+        self.status.text = format_summary(metrics) if metrics else ("Failed" if result.get("error") else "Done")
+
+
+class RegionsPopup(Popup):
+    """Columns for the regions of one capture; set_result() fills one in (main thread only).
+
+    `regions` are (texture, (width, height)) pairs in selection order.
+    """
+
+    def __init__(self, regions, **kwargs):
+        kwargs.setdefault("title", f"{len(regions)} Regions")
+        kwargs.setdefault("size_hint", (0.95, 0.9))
+        super().__init__(**kwargs)
+        layout = BoxLayout(orientation="vertical", spacing=5)
+        scroll = ScrollView(do_scroll_y=False, bar_width=8, scroll_type=["bars", "content"])
+        row = BoxLayout(orientation="horizontal", spacing=10, size_hint_x=None)
+        scroll.bind(width=lambda _, width: setattr(
+            row, "width", max(width, len(regions) * (MIN_COLUMN_WIDTH + 10))))
+        self.columns = [RegionColumn(i, texture, size) for i, (texture, size) in enumerate(regions)]
+        for column in self.columns:
+            row.add_widget(column)
+        scroll.add_widget(row)
+        layout.add_widget(scroll)
+
+        self.status_label = Label(text="", size_hint_y=None, height=20, halign="left",
+                                  color=(0.6, 0.6, 0.6, 1), font_size="12sp")
+        self.status_label.bind(size=self.status_label.setter("text_size"))
+        layout.add_widget(self.status_label)
+        close_btn = Button(text="Close", size_hint_y=None, height=40)
+        close_btn.bind(on_press=lambda *_: self.dismiss())
+        layout.add_widget(close_btn)
+        self.content = layout
+
+    def set_result(self, index, result):
+        if 0 <= index < len(self.columns):
+            self.columns[index].show(result)
+
+    def set_status(self, text):
+        self.status_label.text = text
@@ -0,0 +1,337 @@
+import logging
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from PIL import Image, ImageChops
+
+from settings import get_section, get_data_dir
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SETTINGS = {
+    "enabled": True,
+    "max_entries": 256,
+    "max_memory_bytes": 32 * 1024 * 1024,
+    "max_disk_bytes": 256 * 1024 * 1024,
+    "near_duplicate_threshold": 0,   # opt-in: >0 also reuses captures whose dHash is this close...
+    "near_duplicate_tolerance": 16,  # ...if no pixel differs by more than this (0-255, grayscale)
+    "hash_size": 16,
+    "directory": None,
+    "use_history": True,   # fall back to the capture history (history.py) on a miss
+}
+
+
+# digest: model, size and prompts; content: hash of the exact pixels; phash: dHash for near duplicates.
+# `image` is the preprocessed capture, kept so near hits can be checked pixel by pixel.
+CacheKey = namedtuple("CacheKey", "digest content phash image")
+
+
+def content_hash(img):
+    """Hash of the exact pixels (with mode and size) of a PIL image."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(("%s %dx%d\0" % (img.mode, img.width, img.height)).encode())
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+
+def pixels_match(a, b, tolerance=16):
+    """True if two same-sized images differ by at most `tolerance` grey levels at every pixel."""
+    if a is None or b is None or a.size != b.size:
+        return False
+    diff = ImageChops.difference(a.convert("L"), b.convert("L"))
+    return diff.getextrema()[1] <= tolerance
+
+
+def image_phash(img, hash_size=16):
+    """Difference hash of a PIL image: robust to rescaling and small rendering noise."""
+    small = img.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    px = list(small.getdata())
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (px[offset + col] > px[offset + col + 1])
+    return bits
+
+
+def prompt_digest(model, *parts):
+    """Stable digest of the model name and the prompt text(s) used for a result."""
+    h = hashlib.sha1(model.encode())
+    for p in parts:
+        h.update(b"\0" + p.encode())
+    return h.hexdigest()[:16]
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class ResultCache:
+    """Two-tier (memory LRU + on-disk JSON) cache of pipeline results.
+
+    Entries are keyed on (prompt digest, content hash of the preprocessed
+    pixels), so only the exact same image is a hit. With
+    `near_duplicate_threshold` > 0, an entry whose perceptual hash is within
+    that many bits is also a hit, but only after a pixel diff confirms no pixel
+    moved by more than `near_duplicate_tolerance` (the stored image is kept for
+    that). `backing` (a history.HistoryStore, optional) is consulted after both
+    tiers miss.
+    """
+
+    def __init__(self, directory=None, max_entries=256, max_memory_bytes=32 * 1024 * 1024,
+                 max_disk_bytes=256 * 1024 * 1024, near_duplicate_threshold=0, hash_size=16,
+                 near_duplicate_tolerance=16):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.threshold = near_duplicate_threshold
+        self.tolerance = near_duplicate_tolerance
+        self.hash_size = hash_size
+
+        self._memory = OrderedDict()   # (digest, content) -> (result, nbytes, phash, grayscale image or None)
+        self._memory_bytes = 0
+        self._disk_index = None        # digest -> {content: (phash, path)}, built lazily
+        self._lock = threading.Lock()
+        self.backing = None
+
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.hits_backing = 0
+        self.misses = 0
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    # ---------------------------------------------------------------- keys
+
+    def key_for(self, img, model, *prompts):
+        # The image size goes into the digest so crops of different shape never collide
+        size = "%dx%d" % img.size
+        return CacheKey(prompt_digest(model, size, *prompts), content_hash(img),
+                        image_phash(img, self.hash_size), img if self.threshold > 0 else None)
+
+    # ---------------------------------------------------------------- lookup
+
+    def get(self, key):
+        with self._lock:
+            mem_key = self._match_memory(key)
+            if mem_key is not None:
+                self._memory.move_to_end(mem_key)
+                self.hits_memory += 1
+                return dict(self._memory[mem_key][0])
+
+            result = self._load_disk(key)
+            if result is not None:
+                self.hits_disk += 1
+                self._store_memory(key, result)
+                return dict(result)
+
+            if self.backing is not None:
+                result = self.backing.lookup(key.digest, key.content)
+                if result is not None:
+                    self.hits_backing += 1
+                    self._store_memory(key, result)
+                    return dict(result)
+
+            self.misses += 1
+            return None
+
+    def put(self, key, result):
+        with self._lock:
+            self._store_memory(key, result)
+            self._store_disk(key, result)
+
+    def stats(self):
+        with self._lock:
+            hits = self.hits_memory + self.hits_disk + self.hits_backing
+            lookups = hits + self.misses
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "hits_backing": self.hits_backing,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            for entries in (self._disk_index or {}).values():
+                for _, path in entries.values():
+                    for p in (path, _pixels_path(path)):
+                        try: os.unlink(p)
+                        except OSError: pass
+            self._disk_index = None
+
+    # ---------------------------------------------------------------- memory tier
+
+    def _match_memory(self, key):
+        if (key.digest, key.content) in self._memory:
+            return (key.digest, key.content)
+        if self.threshold <= 0 or key.image is None:
+            return None
+        near = sorted((hamming(entry[2], key.phash), k) for k, entry in self._memory.items()
+                      if k[0] == key.digest and entry[3] is not None)
+        for dist, k in near:
+            if dist > self.threshold:
+                break
+            # A few hash bits can hide a changed word; only reuse it if the pixels agree
+            if pixels_match(self._memory[k][3], key.image, self.tolerance):
+                return k
+        return None
+
+    def _store_memory(self, key, result):
+        pixels = key.image.convert("L") if key.image is not None else None
+        nbytes = len(json.dumps(result)) + (pixels.width * pixels.height if pixels is not None else 0)
+        mem_key = (key.digest, key.content)
+        if mem_key in self._memory:
+            self._memory_bytes -= self._memory.pop(mem_key)[1]
+        self._memory[mem_key] = (dict(result), nbytes, key.phash, pixels)
+        self._memory_bytes += nbytes
+        while self._memory and (len(self._memory) > self.max_entries
+                                or self._memory_bytes > self.max_memory_bytes):
+            _, entry = self._memory.popitem(last=False)
+            self._memory_bytes -= entry[1]
+
+    # ---------------------------------------------------------------- disk tier
+
+    def _index(self):
+        if self._disk_index is None:
+            self._disk_index = {}
+            if self.directory:
+                for entry in os.scandir(self.directory):
+                    parsed = _parse_name(entry.name)
+                    if parsed is not None:
+                        digest, content, phash = parsed
+                        self._disk_index.setdefault(digest, {})[content] = (phash, entry.path)
+        return self._disk_index
+
+    def _load_disk(self, key):
+        if not self.directory:
+            return None
+        entries = self._index().get(key.digest, {})
+        path = entries[key.content][1] if key.content in entries else None
+        if path is None and self.threshold > 0 and key.image is not None:
+            near = sorted((hamming(h, key.phash), p) for h, p in entries.values())
+            for dist, p in near:
+                if dist > self.threshold:
+                    break
+                try:
+                    with Image.open(_pixels_path(p)) as stored:
+                        if pixels_match(stored, key.image, self.tolerance):
+                            path = p
+                            break
+                except OSError:
+                    continue  # stored without pixels: exact hits only
+        if path is None:
+            return None
+        try:
+            with open(path, "r") as f:
+                result = json.load(f)
+            os.utime(path)  # mtime doubles as the disk tier's LRU clock
+            return result
+        except (OSError, ValueError):
+            return None
+
+    def _store_disk(self, key, result):
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f"{key.digest}-{key.content}-{key.phash:016x}.json")
+        tmp = path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(result, f)
+            os.replace(tmp, path)
+            if key.image is not None:
+                # Kept for the pixel check of near-duplicate lookups
+                key.image.convert("L").save(_pixels_path(path), format="PNG", compress_level=1)
+        except OSError as e:
+            logger.warning("result cache write failed: %s", e)
+            return
+        self._index().setdefault(key.digest, {})[key.content] = (key.phash, path)
+        self._evict_disk()
+
+    def _evict_disk(self):
+        files = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                st = entry.stat()
+                size = st.st_size
+                try:
+                    size += os.stat(_pixels_path(entry.path)).st_size
+                except OSError:
+                    pass
+                files.append((st.st_mtime, size, entry.path, entry.name))
+                total += size
+        if total <= self.max_disk_bytes:
+            return
+        files.sort()
+        for _, size, path, name in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            try:
+                os.unlink(_pixels_path(path))
+            except OSError:
+                pass
+            total -= size
+            parsed = _parse_name(name)
+            if parsed is not None:
+                self._index().get(parsed[0], {}).pop(parsed[1], None)
+
+
+def _pixels_path(path):
+    return path[:-5] + ".png"
+
+
+def _parse_name(name):
+    """(digest, content, phash) of a cache file name, or None (older perceptual-only entries are skipped)."""
+    if not name.endswith(".json"):
+        return None
+    parts = name[:-5].split("-")
+    if len(parts) != 3:
+        return None
+    try:
+        return parts[0], parts[1], int(parts[2], 16)
+    except ValueError:
+        return None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Process-wide ResultCache configured from the "result_cache" section of app_settings.json.
+
+    Returns None when caching is disabled.
+    """
+    global _cache
+    cfg = dict(DEFAULT_CACHE_SETTINGS)
+    cfg.update(get_section("result_cache"))
+    if not cfg["enabled"]:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            directory = cfg["directory"] or os.path.join(get_data_dir(), "results")
+            _cache = ResultCache(directory=directory,
+                                 max_entries=cfg["max_entries"],
+                                 max_memory_bytes=cfg["max_memory_bytes"],
+                                 max_disk_bytes=cfg["max_disk_bytes"],
+                                 near_duplicate_threshold=cfg["near_duplicate_threshold"],
+                                 hash_size=cfg["hash_size"],
+                                 near_duplicate_tolerance=cfg["near_duplicate_tolerance"])
+            if cfg["use_history"]:
+                from history import get_history
+                _cache.backing = get_history()
+        return _cache
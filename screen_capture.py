@@ -1,10 +1,13 @@
 import tkinter as tk
-from PIL import Image, ImageTk, ImageGrab
-import tempfile
-import os
+from PIL import ImageGrab
+import time
+
+def grab_region(bbox):
+    """Grab just `bbox` (left, top, right, bottom) of the screen, e.g. a remembered selection"""
+    return ImageGrab.grab(bbox=bbox)
 
 class ScreenSelector:
-    def __init__(self):
+    def __init__(self, exit_on_cancel=True, multi=False):
         self.start_x = None
         self.start_y = None
         self.end_x = None
@@ -12,11 +15,19 @@ class ScreenSelector:
         self.rect = None
         self.root = None
         self.canvas = None
+        self.capture_duration = 0.0  # seconds spent grabbing and cropping (not selecting)
+        self.bbox = None  # (left, top, right, bottom) of the last selection, in screen pixels
+        self.exit_on_cancel = exit_on_cancel  # False keeps a resident process (daemon.py) alive
+        self.multi = multi  # collect several rectangles from one snapshot (see capture_images)
+        self.bboxes = []  # every selection of a multi-region capture, in screen pixels
+        self.rects = []  # canvas items of the finished rectangles: (rectangle, number label)
         
-    def capture_area(self):
-        """Capture selected screen area and return image path"""
+    def capture_image(self):
+        """Capture selected screen area and return it as an in-memory PIL image"""
         # Take full screenshot first
+        grab_start = time.perf_counter()
         screenshot = ImageGrab.grab()
+        self.capture_duration = time.perf_counter() - grab_start
         
         # Get screen dimensions
         screen_width = screenshot.width
@@ -56,32 +67,57 @@ class ScreenSelector:
         self.canvas.focus_set()
         self.root.grab_set()
         
+        if self.multi:
+            self.root.bind('<Return>', lambda e: self.finish_selection())
+            self.root.bind('<KP_Enter>', lambda e: self.finish_selection())
+            self.root.bind('<BackSpace>', lambda e: self.undo_selection())
+        
         # Instructions
-        instruction = tk.Label(self.root, text="Click and drag to select area. Press ESC to cancel.", 
+        if self.multi:
+            text = ("Drag to add areas. Backspace removes the last one, Enter processes them all. "
+                    "Press ESC to cancel.")
+        else:
+            text = "Click and drag to select area. Press ESC to cancel."
+        instruction = tk.Label(self.root, text=text, 
                              fg='white', bg='black', font=('Arial', 12))
         instruction.pack(pady=10)
         
         self.root.mainloop()
         
+        if self.multi:
+            return self._crop_regions()
+        
         if self.start_x is not None and self.end_x is not None:
-            # Scale coordinates from canvas to screen
-            scale_x = self.screen_width / self.canvas_width
-            scale_y = self.screen_height / self.canvas_height
-            
-            left = int(min(self.start_x, self.end_x) * scale_x)
-            top = int(min(self.start_y, self.end_y) * scale_y)
-            right = int(max(self.start_x, self.end_x) * scale_x)
-            bottom = int(max(self.start_y, self.end_y) * scale_y)
-            
-            cropped = self.screenshot.crop((left, top, right, bottom))
-            
-            # Save to temp file
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-            cropped.save(temp_file.name)
-            return temp_file.name
+            self.bbox = self._screen_bbox(self.start_x, self.start_y, self.end_x, self.end_y)
+            crop_start = time.perf_counter()
+            cropped = self.screenshot.crop(self.bbox)
+            self.capture_duration += time.perf_counter() - crop_start
+            return cropped
         
         return None
     
+    def capture_images(self):
+        """Select several areas on one snapshot; returns their crops in selection order (None if cancelled)"""
+        self.multi = True
+        return self.capture_image()
+    
+    def _screen_bbox(self, x0, y0, x1, y1):
+        """Scale canvas coordinates to a (left, top, right, bottom) box in screen pixels"""
+        scale_x = self.screen_width / self.canvas_width
+        scale_y = self.screen_height / self.canvas_height
+        return (int(min(x0, x1) * scale_x), int(min(y0, y1) * scale_y),
+                int(max(x0, x1) * scale_x), int(max(y0, y1) * scale_y))
+    
+    def _crop_regions(self):
+        if not self.bboxes:
+            return None
+        crop_start = time.perf_counter()
+        # Every region comes from the same snapshot, so they show the screen at one instant
+        crops = [self.screenshot.crop(bbox) for bbox in self.bboxes]
+        self.capture_duration += time.perf_counter() - crop_start
+        self.bbox = self.bboxes[-1]
+        return crops
+    
     def on_click(self, event):
         self.start_x = event.x
         self.start_y = event.y
@@ -95,6 +131,9 @@ class ScreenSelector:
         )
         
     def on_release(self, event):
+        if self.multi:
+            self.add_selection(event)
+            return
         self.end_x = event.x
         self.end_y = event.y
         # Get canvas dimensions before destroying
@@ -105,6 +144,33 @@ class ScreenSelector:
         
 
     
+    def add_selection(self, event):
+        """Keep the dragged rectangle as one more region and wait for the next"""
+        if self.start_x is None or abs(event.x - self.start_x) < 5 or abs(event.y - self.start_y) < 5:
+            return  # a click, not a drag
+        self.canvas_width = self.canvas.winfo_width()
+        self.canvas_height = self.canvas.winfo_height()
+        self.bboxes.append(self._screen_bbox(self.start_x, self.start_y, event.x, event.y))
+        label = self.canvas.create_text(
+            min(self.start_x, event.x) + 6, min(self.start_y, event.y) + 6, anchor='nw',
+            text=str(len(self.bboxes)), fill='red', font=('Arial', 16, 'bold')
+        )
+        self.rects.append((self.rect, label))
+        self.rect = None
+        self.start_x = None
+    
+    def undo_selection(self):
+        if self.bboxes:
+            self.bboxes.pop()
+            for item in self.rects.pop():
+                self.canvas.delete(item)
+    
+    def finish_selection(self):
+        if not self.bboxes:
+            return  # nothing selected yet; ESC cancels
+        self.root.quit()
+        self.root.destroy()
+    
     def on_any_key(self, event):
         if event.keysym == 'Escape':
             self.cancel_selection()
@@ -112,8 +178,10 @@ class ScreenSelector:
     def cancel_selection(self):
         self.start_x = None
         self.end_x = None
+        self.bboxes = []
         self.root.quit()
         self.root.destroy()
-        # Exit the entire application
-        import sys
-        sys.exit()
\ No newline at end of file
+        if self.exit_on_cancel:
+            # Exit the entire application
+            import sys
+            sys.exit()
\ No newline at end of file
@@ -0,0 +1,37 @@
+import os
+import json
+
+
+def get_app_settings():
+    """Load or create app_settings.json controlling image resizing."""
+    path = os.path.join(os.path.dirname(__file__), "app_settings.json")
+    default = {"resize_large_images": True}
+    if os.path.exists(path):
+        try:
+            return json.load(open(path))
+        except:
+            pass
+    json.dump(default, open(path,"w"))
+    return default
+
+
+def get_section(name):
+    """Return one nested section of app_settings.json (empty dict if missing)."""
+    section = get_app_settings().get(name)
+    return section if isinstance(section, dict) else {}
+
+
+def default_workers():
+    """Requests to run at once: OLLAMA_NUM_PARALLEL if set, else 2."""
+    try:
+        return max(1, int(os.environ.get("OLLAMA_NUM_PARALLEL", "")))
+    except ValueError:
+        return 2
+
+
+def get_data_dir():
+    """Per-user directory for caches, logs and other runtime data."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    path = os.path.join(base, "visionexplorer")
+    os.makedirs(path, exist_ok=True)
+    return path
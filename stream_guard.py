@@ -0,0 +1,177 @@
+"""
+Guards against runaway generations.
+
+Small vision models sometimes fall into a loop during OCR and repeat the same
+line (or the same few words) until they hit the token limit, which can take
+tens of seconds. RepetitionGuard watches a reply as it streams in; once the
+tail of the text is the same unit repeated `min_repeats` times over at least
+`min_repeat_chars` characters, it reports the loop so the caller can close
+the stream, and trimmed() gives the reply with the repeats cut off.
+
+Screens do repeat themselves (log windows, tables of identical rows), so the
+defaults are conservative and a loop only counts once the reply has used
+`min_reply_fraction` of its num_predict cap: a genuine runaway gets there,
+a faithful transcription of a repetitive window rarely does.
+
+num_predict_for() caps the reply length by image size as a backstop: a
+screenshot can only hold so much text.
+"""
+
+import io
+import re
+import base64
+
+from PIL import Image
+
+from settings import get_section
+
+DEFAULT_GUARD_SETTINGS = {
+    "enabled": True,
+    "min_repeats": 12,            # a unit must repeat this many times back to back...
+    "min_repeat_chars": 800,      # ...and the repeats must span at least this many characters...
+    "min_reply_fraction": 0.5,    # ...once the reply has used this share of its num_predict cap
+    "max_period_tokens": 64,      # longest run of words checked for loops
+    "max_block_lines": 8,         # longest block of lines checked for loops
+    "num_predict_base": 512,      # reply token cap: base + per_megapixel * image megapixels
+    "num_predict_per_megapixel": 1536,
+    "num_predict_max": 4096,      # 0 disables the cap
+}
+
+# Words (once the whitespace after them has arrived) and line breaks
+_TOKEN = re.compile(r"\S+(?=\s)|\n")
+
+
+def get_guard_settings():
+    cfg = dict(DEFAULT_GUARD_SETTINGS)
+    cfg.update(get_section("stream_guard"))
+    return cfg
+
+
+def image_dimensions(b64):
+    """(width, height) of a base64-encoded image from its header, or None."""
+    # The header sits at the start of PNG and JPEG files; don't decode the whole payload.
+    # Pillow only opens a WebP file whole, so a large one needs the second attempt.
+    for data in (b64[:1 << 16], b64) if len(b64) > 1 << 16 else (b64,):
+        try:
+            with Image.open(io.BytesIO(base64.b64decode(data))) as img:
+                return img.size
+        except Exception:
+            continue
+    return None
+
+
+def num_predict_for(size, cfg=None):
+    """Reply token cap for an image of `size` (None for no cap)."""
+    cfg = cfg or get_guard_settings()
+    if not cfg["num_predict_max"]:
+        return None
+    if size is None:
+        return cfg["num_predict_max"]
+    megapixels = size[0] * size[1] / 1e6
+    cap = cfg["num_predict_base"] + cfg["num_predict_per_megapixel"] * megapixels
+    return int(min(cap, cfg["num_predict_max"]))
+
+
+class RepetitionGuard:
+    """Detects a reply stuck repeating itself.
+
+    feed(token) returns True once the text ends in a loop: a run of words
+    (`max_period_tokens` at most) or a block of lines (`max_block_lines` at
+    most) repeated `min_repeats` times. `event` then describes the loop and
+    trimmed() is the text up to the end of its first occurrence. With
+    `num_predict` (the reply's token cap) nothing counts as a loop before
+    `min_reply_fraction` of it has been generated (words approximate tokens).
+    """
+
+    def __init__(self, cfg=None, num_predict=None):
+        cfg = cfg or get_guard_settings()
+        self.min_repeats = cfg["min_repeats"]
+        self.min_chars = cfg["min_repeat_chars"]
+        self.max_period = cfg["max_period_tokens"]
+        self.max_block = cfg["max_block_lines"]
+        self.min_units = int(cfg["min_reply_fraction"] * num_predict) if num_predict else 0
+        self.event = None
+        self._cut = None
+        self._parts = []        # every token fed, joined only on demand
+        self._length = 0
+        self._tail = ""         # text after the last complete word, not scanned yet
+        self._tail_start = 0    # offset of _tail in the whole text
+        self._line_parts = []   # scanned text of the current line
+        self._tokens = []       # (token, start offset); "\n" for line breaks
+        self._lines = []        # (stripped line, start offset) of completed lines
+        self._line_start = 0
+
+    @property
+    def tripped(self):
+        return self.event is not None
+
+    @property
+    def text(self):
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def feed(self, token):
+        if self.event is not None:
+            return True
+        self._parts.append(token)
+        self._length += len(token)
+        tail = self._tail + token
+        pos = end = 0
+        tripped = False
+        for m in _TOKEN.finditer(tail):
+            end = m.end()
+            start = self._tail_start + m.start()
+            self._tokens.append((m.group(), start))
+            if m.group() == "\n":
+                self._line_parts.append(tail[pos:m.start()])
+                self._lines.append(("".join(self._line_parts).strip(), self._line_start))
+                self._line_parts = []
+                pos, self._line_start = end, self._tail_start + end
+                if self._check(self._lines, self.max_block, "lines"):
+                    tripped = True
+                    break
+            if self._check(self._tokens, self.max_period, "words"):
+                tripped = True
+                break
+        # Only the unscanned remainder is kept, so each token costs time for itself only
+        if end > pos:
+            self._line_parts.append(tail[pos:end])
+        self._tail, self._tail_start = tail[end:], self._tail_start + end
+        return tripped
+
+    def trimmed(self):
+        """The text with the repeated tail removed (all of it if no loop was found)."""
+        if self._cut is None:
+            return self.text
+        return self.text[:self._cut].rstrip()
+
+    def _check(self, units, max_period, kind):
+        """Look for a period p at which the tail of `units` repeats itself."""
+        n = len(units)
+        if len(self._tokens) < self.min_units:
+            return False
+        last = units[-1][0]
+        for p in range(1, min(max_period, n // self.min_repeats) + 1):
+            if units[n - 1 - p][0] != last:
+                continue
+            # Extend the periodic run backwards from the end
+            j = n - 1
+            while j - p >= 0 and units[j][0] == units[j - p][0]:
+                j -= 1
+            length = n - j + p - 1       # units in the periodic tail
+            repeats = length // p
+            if repeats < self.min_repeats:
+                continue
+            first = n - length
+            unit = [u[0] for u in units[first:first + p]]
+            if not any(u.strip() for u in unit):
+                continue  # blank lines or bare line breaks
+            span = self._length - units[first][1]
+            if span < self.min_chars:
+                continue
+            self._cut = units[first + p][1]
+            self.event = {"kind": kind, "period": p, "repeats": repeats,
+                          "trimmed_chars": self._length - self._cut}
+            return True
+        return False
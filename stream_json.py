@@ -0,0 +1,194 @@
+"""
+Incremental, tolerant parser for a JSON object arriving in stream chunks.
+
+Tracks the string values of selected top-level keys (by default "text" and
+"visual") while they are still being generated, so callers can show partial
+fields instead of waiting for the whole reply:
+
+    parser = StreamingJSONFields(on_field=lambda field, delta: print(field, delta))
+    for chunk in chunks:
+        parser.feed(chunk)
+    parser.values()   # {"text": "...", "visual": "..."}
+
+Anything before the first "{" (e.g. a ```json fence) is ignored, and a
+truncated reply still yields whatever was decoded so far.
+"""
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+# Parser states
+_BEFORE, _KEY_OR_END, _KEY, _COLON, _VALUE, _STRING, _SKIP, _AFTER_VALUE, _DONE = range(9)
+
+
+class StreamingJSONFields:
+    """Feed text chunks; get on_field(field, delta) calls as tracked strings grow."""
+
+    def __init__(self, fields=("text", "visual"), on_field=None):
+        self.fields = tuple(fields)
+        self.on_field = on_field
+        self._parts = {field: [] for field in self.fields}
+        self._seen = set()
+        self._raw = []
+        self._state = _BEFORE
+        self._key = []
+        self._field = None       # tracked field whose string is being read, or None
+        self._escape = None      # pending escape: "" after a backslash, hex digits for \u
+        self._high_surrogate = None
+        self._depth = 0          # nesting inside a skipped non-string value
+        self._skip_in_string = False
+        self._skip_escape = False
+
+    @property
+    def done(self):
+        """True once the top-level object has been closed."""
+        return self._state == _DONE
+
+    def text(self):
+        """Everything fed so far, unparsed."""
+        return "".join(self._raw)
+
+    def values(self):
+        """Decoded tracked fields so far (fields not seen yet are omitted)."""
+        return {field: "".join(self._parts[field]) for field in self.fields if field in self._seen}
+
+    def get(self, field, default=""):
+        parts = self._parts.get(field)
+        return "".join(parts) if parts else default
+
+    def feed(self, chunk):
+        if not chunk:
+            return
+        self._raw.append(chunk)
+        out = []     # decoded characters of the current tracked string in this chunk
+        for ch in chunk:
+            state = self._state
+            if state == _STRING:
+                if self._read_string_char(ch, out):
+                    continue
+                self._emit(out)
+                self._field = None
+                self._state = _AFTER_VALUE
+            elif state == _BEFORE:
+                if ch == "{":
+                    self._state = _KEY_OR_END
+            elif state == _KEY_OR_END:
+                if ch == '"':
+                    self._key = []
+                    self._state = _KEY
+                elif ch == "}":
+                    self._state = _DONE
+            elif state == _KEY:
+                if self._escape is not None:
+                    self._key.append(_ESCAPES.get(ch, ch))
+                    self._escape = None
+                elif ch == "\\":
+                    self._escape = ""
+                elif ch == '"':
+                    self._state = _COLON
+                else:
+                    self._key.append(ch)
+            elif state == _COLON:
+                if ch == ":":
+                    self._state = _VALUE
+            elif state == _VALUE:
+                if ch.isspace():
+                    continue
+                key = "".join(self._key)
+                if ch == '"':
+                    self._field = key if key in self._parts else None
+                    if self._field is not None:
+                        self._seen.add(self._field)
+                        self._parts[self._field] = []   # a repeated key replaces the old value
+                    self._escape = None
+                    self._high_surrogate = None
+                    self._state = _STRING
+                else:
+                    self._depth = 1 if ch in "{[" else 0
+                    self._skip_in_string = False
+                    self._skip_escape = False
+                    self._state = _SKIP
+                    if self._depth == 0 and ch in ",}":
+                        self._end_value(ch)
+            elif state == _SKIP:
+                self._skip_char(ch)
+            elif state == _AFTER_VALUE:
+                self._end_value(ch)
+        self._emit(out)
+
+    # ------------------------------------------------------------------ helpers
+
+    def _end_value(self, ch):
+        if ch == ",":
+            self._state = _KEY_OR_END
+        elif ch == "}":
+            self._state = _DONE
+
+    def _skip_char(self, ch):
+        """Skip a non-string value (number, literal, nested object/array)."""
+        if self._skip_in_string:
+            if self._skip_escape:
+                self._skip_escape = False
+            elif ch == "\\":
+                self._skip_escape = True
+            elif ch == '"':
+                self._skip_in_string = False
+        elif ch == '"':
+            self._skip_in_string = True
+        elif ch in "{[":
+            self._depth += 1
+        elif ch in "}]":
+            if self._depth == 0:
+                self._end_value(ch)
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._state = _AFTER_VALUE
+        elif ch == "," and self._depth == 0:
+            self._end_value(ch)
+
+    def _read_string_char(self, ch, out):
+        """Consume one character inside a string; False when the string ends."""
+        if self._escape is not None:
+            if self._escape == "" and ch != "u":
+                self._append(_ESCAPES.get(ch, ch), out)
+                self._escape = None
+            elif self._escape == "":
+                self._escape = "u"
+            else:
+                self._escape += ch
+                if len(self._escape) == 5:
+                    try:
+                        self._append_codepoint(int(self._escape[1:], 16), out)
+                    except ValueError:
+                        self._append("\\" + self._escape, out)   # malformed: keep it verbatim
+                    self._escape = None
+            return True
+        if ch == "\\":
+            self._escape = ""
+            return True
+        if ch == '"':
+            return False
+        self._append(ch, out)
+        return True
+
+    def _append_codepoint(self, code, out):
+        if 0xD800 <= code < 0xDC00:
+            self._high_surrogate = code
+            return
+        if 0xDC00 <= code < 0xE000 and self._high_surrogate is not None:
+            code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+        self._high_surrogate = None
+        self._append(chr(code), out)
+
+    def _append(self, text, out):
+        if self._field is not None:
+            out.append(text)
+
+    def _emit(self, out):
+        if not out or self._field is None:
+            return
+        delta = "".join(out)
+        out.clear()
+        self._parts[self._field].append(delta)
+        if self.on_field is not None:
+            self.on_field(self._field, delta)
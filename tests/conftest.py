@@ -0,0 +1,69 @@
+"""
+Shared fixtures: every test gets its own data directory (cache, history,
+metrics log) and a fresh host pool, and mock_server runs a local
+mock_ollama.MockOllamaServer that the pipeline is pointed at.
+"""
+
+import os
+import sys
+import time
+import logging
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hosts
+import history
+import metrics
+import result_cache
+from mock_ollama import MockOllamaServer
+
+
+def _reset_singletons():
+    hosts.reset_host_pool()
+    result_cache._cache = None
+    if history._history is not None:
+        history._history.close()
+        history._history = None
+    metrics._logger = None
+    for handler in logging.getLogger("visionexplorer.metrics").handlers[:]:
+        logging.getLogger("visionexplorer.metrics").removeHandler(handler)
+        handler.close()
+
+
+@pytest.fixture(autouse=True)
+def isolated(tmp_path, monkeypatch):
+    """Keep test runs out of the user's cache, history and metrics log."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.delenv("VISIONEXPLORER_OLLAMA_URL", raising=False)
+    _reset_singletons()
+    yield tmp_path
+    _reset_singletons()
+
+
+def use_servers(monkeypatch, *servers):
+    """Point the host pool at `servers`."""
+    monkeypatch.setenv("VISIONEXPLORER_OLLAMA_URL", ",".join(s.url for s in servers))
+    hosts.reset_host_pool()
+
+
+def wait_until(condition, timeout=3.0):
+    """Poll `condition` until it holds; the mock only notices a closed stream on its next writes."""
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+@pytest.fixture
+def mock_server(monkeypatch):
+    with MockOllamaServer(token_delay=0.001) as server:
+        use_servers(monkeypatch, server)
+        yield server
+
+
+@pytest.fixture
+def screenshot():
+    from benchmark import make_synthetic_image
+    return make_synthetic_image(640, 400)
@@ -0,0 +1,65 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from conftest import wait_until
+from async_ollama import AsyncOllamaSession, query_ollama_vision_twopass_async
+from mock_ollama import DEFAULT_REPLY
+from ollama_vision_twopass import CancelToken, GenerationCancelled
+
+
+async def _collect(session, prompt):
+    return [token async for token in session.ask_stream(prompt)]
+
+
+def test_ask_stream(mock_server):
+    session = AsyncOllamaSession()
+    tokens = asyncio.run(_collect(session, "hello"))
+    assert len(tokens) > 10
+    assert "".join(tokens) == DEFAULT_REPLY
+    assert session.last_stats["eval_count"] == len(tokens)
+    assert session.messages[-1] == {"role": "assistant", "content": DEFAULT_REPLY}
+
+
+def test_ask_reuses_connections(mock_server):
+    async def main():
+        session = AsyncOllamaSession()
+        return [await session.ask("hello") for _ in range(3)]
+    assert asyncio.run(main()) == [DEFAULT_REPLY] * 3
+
+
+def test_read_timeout(mock_server):
+    mock_server.token_delay = 0.5
+    session = AsyncOllamaSession(timeout=(5, 0.1))
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(_collect(session, "hello"))
+    assert wait_until(lambda: mock_server.aborted == 1)
+
+
+def test_cancelling_the_task_closes_the_stream(mock_server, screenshot):
+    mock_server.token_delay = 0.05
+
+    async def main():
+        task = asyncio.ensure_future(query_ollama_vision_twopass_async(screenshot, use_cache=False,
+                                                                       route=False))
+        await asyncio.sleep(0.5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert wait_until(lambda: mock_server.aborted == 1)
+
+
+def test_cancel_event(mock_server, screenshot):
+    mock_server.token_delay = 0.05
+    token = CancelToken()
+    threading.Timer(0.5, token.cancel).start()
+    start = time.time()
+    with pytest.raises(GenerationCancelled):
+        asyncio.run(query_ollama_vision_twopass_async(screenshot, use_cache=False, route=False,
+                                                      concurrent=True, cancel_event=token))
+    assert time.time() - start < 2
+    assert wait_until(lambda: mock_server.aborted == 2)
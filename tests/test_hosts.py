@@ -0,0 +1,65 @@
+import pytest
+import requests
+
+import hosts
+from conftest import use_servers
+from mock_ollama import MockOllamaServer
+from text_extractor import extract_text_from_image
+from ollama_vision_twopass import OllamaSession
+
+
+@pytest.fixture
+def two_servers(monkeypatch):
+    with MockOllamaServer(token_delay=0.001) as failing, MockOllamaServer(token_delay=0.001) as healthy:
+        failing.fail_status = 503
+        # No probes: the mock still answers /api/tags, which would re-admit the failing host
+        settings = dict(hosts.get_host_settings(), probe_interval=0)
+        monkeypatch.setattr(hosts, "get_host_settings", lambda: settings)
+        use_servers(monkeypatch, failing, healthy)
+        yield failing, healthy
+
+
+def test_select_prefers_least_outstanding():
+    a, b = hosts.Endpoint("http://a"), hosts.Endpoint("http://b")
+    pool = hosts.HostPool([a, b])
+    pool.begin(a)
+    assert pool.select() is b
+    pool.end(a)
+
+
+def test_failover_only_retries_host_failures():
+    a, b = hosts.Endpoint("http://a"), hosts.Endpoint("http://b")
+    pool = hosts.HostPool([a, b])
+    assert pool.failover(a, requests.ConnectionError("refused"), set()) is b
+    assert pool.failover(a, ValueError("bad reply"), set()) is None
+    # Every host tried: give up
+    assert pool.failover(b, requests.ConnectionError("refused"), {"http://a"}) is None
+
+
+def test_text_extractor_fails_over(two_servers, screenshot):
+    failing, healthy = two_servers
+    for _ in range(3):
+        text, visual = extract_text_from_image(screenshot, use_cache=False, single_pass=True)
+        assert text and visual
+    assert len(healthy.requests) == 3
+    # The 503 host is ejected after its first failure instead of being retried every time
+    assert len(failing.requests) == 1
+    assert hosts.get_host_pool().status()[0]["ejected"]
+
+
+def test_session_fails_over(two_servers):
+    failing, healthy = two_servers
+    for _ in range(3):
+        session = OllamaSession()
+        assert session.ask("hello")
+        assert session.url == healthy.url
+        session.close()
+    assert len(failing.requests) <= 1
+
+
+def test_client_errors_are_not_retried(two_servers, screenshot):
+    failing, healthy = two_servers
+    failing.fail_status = healthy.fail_status = 404
+    with pytest.raises(requests.HTTPError):
+        extract_text_from_image(screenshot, use_cache=False, single_pass=False)
+    assert len(failing.requests) + len(healthy.requests) == 1
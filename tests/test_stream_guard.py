@@ -0,0 +1,62 @@
+import time
+
+import stream_guard
+from conftest import use_servers
+from metrics import CaptureMetrics
+from mock_ollama import MockOllamaServer
+from stream_guard import RepetitionGuard, num_predict_for
+from text_extractor import extract_text_from_image, single_pass_request
+
+LOOP = "Traceback (most recent call last): retrying connection\n" * 3000
+
+
+def feed_words(guard, text):
+    for word in text.split(" "):
+        if guard.feed(word + " "):
+            return True
+    return False
+
+
+def test_loop_is_trimmed():
+    guard = RepetitionGuard(dict(stream_guard.DEFAULT_GUARD_SETTINGS, min_reply_fraction=0), 4096)
+    assert feed_words(guard, "header line\n" + LOOP)
+    assert guard.event["kind"] in ("lines", "words")
+    assert guard.trimmed().count("Traceback") == 1
+
+
+def test_repetitive_window_is_not_a_loop():
+    # A log window with a few hundred identical rows stays below half of a 1 MP cap
+    guard = RepetitionGuard(stream_guard.DEFAULT_GUARD_SETTINGS, num_predict_for((1280, 800)))
+    assert not feed_words(guard, "INFO request served in 3 ms\n" * 60)
+
+
+def test_single_pass_is_capped(mock_server, screenshot):
+    from image_pipeline import prepare_image
+    prepared = prepare_image(screenshot)
+    payload, _, guard = single_pass_request("m", prepared.b64)
+    assert payload["options"]["num_predict"] == num_predict_for(prepared.size)
+    assert guard is not None
+
+
+def _timed_extract(screenshot, metrics):
+    start = time.time()
+    text, _ = extract_text_from_image(screenshot, use_cache=False, metrics=metrics, single_pass=True)
+    return time.time() - start, text
+
+
+def test_guard_cuts_a_runaway_single_pass(monkeypatch, screenshot):
+    """Even waiting for half the cap, the guard saves about half of a capped runaway."""
+    with MockOllamaServer(token_delay=0.002, reply=LOOP) as server:
+        use_servers(monkeypatch, server)
+        metrics = CaptureMetrics()
+        guarded, text = _timed_extract(screenshot, metrics)
+        extract = metrics.to_dict()["passes"]["extract"]
+        assert extract["repetition"]["repeats"] >= 12
+        assert text.count("Traceback") == 1
+        assert not metrics.to_dict().get("fallback")
+
+        settings = dict(stream_guard.DEFAULT_GUARD_SETTINGS, enabled=False)
+        monkeypatch.setattr(stream_guard, "get_guard_settings", lambda: settings)
+        monkeypatch.setattr("text_extractor.get_guard_settings", lambda: settings)
+        unguarded, _ = _timed_extract(screenshot, CaptureMetrics())
+    assert guarded < 0.7 * unguarded
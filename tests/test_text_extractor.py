@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+import requests
+
+from metrics import CaptureMetrics
+from text_extractor import extract_text_from_image, parse_single_pass, single_pass_rejected
+from async_ollama import extract_text_from_image_async
+
+
+def test_parse_single_pass():
+    assert parse_single_pass('{"text": "a", "visual": "b"}') == {"text": "a", "visual": "b"}
+    assert parse_single_pass('{"text": "a"}') is None
+    assert parse_single_pass("not json") is None
+
+
+def test_single_pass_uses_one_request(mock_server, screenshot):
+    metrics = CaptureMetrics()
+    text, visual = extract_text_from_image(screenshot, use_cache=False, metrics=metrics, single_pass=True)
+    assert text.startswith("File Edit") and visual
+    assert len(mock_server.requests) == 1
+    assert not metrics.to_dict().get("fallback")
+
+
+def test_rejected_format_falls_back_to_two_step(mock_server, screenshot):
+    mock_server.format_status = 400
+    metrics = CaptureMetrics()
+    text, visual = extract_text_from_image(screenshot, use_cache=False, metrics=metrics, single_pass=True)
+    assert text.startswith("File Edit") and visual
+    assert metrics.to_dict()["fallback"] is True
+    # The rejected single pass, then the analysis and the reformat
+    assert len(mock_server.requests) == 3
+
+
+def test_rejected_format_falls_back_async(mock_server, screenshot):
+    mock_server.format_status = 400
+    metrics = CaptureMetrics()
+    text, visual = asyncio.run(extract_text_from_image_async(screenshot, use_cache=False, metrics=metrics))
+    assert text.startswith("File Edit") and visual
+    assert metrics.to_dict()["fallback"] is True
+
+
+def test_host_failures_are_not_rejections(mock_server, screenshot):
+    mock_server.fail_status = 503
+    with pytest.raises(requests.HTTPError):
+        extract_text_from_image(screenshot, use_cache=False, single_pass=True)
+    assert not single_pass_rejected(requests.ConnectionError("refused"))
@@ -0,0 +1,80 @@
+import time
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import history
+from conftest import wait_until
+from async_ollama import query_ollama_vision_twopass_async
+from ollama_vision_twopass import (plan_twopass, plan_passes, query_ollama_vision_twopass, CancelToken,
+                                   GenerationCancelled, VISUAL_PROMPT)
+
+
+def test_plan_without_metrics(screenshot):
+    plan = plan_twopass(screenshot, model="qwen2.5vl:3b", use_cache=False)
+    assert plan["mode"] in ("sequential", "concurrent", "tiled", "text_only", "visual_only", "empty")
+    assert plan["cached"] is None
+
+
+def _prepared(ocr_variant):
+    image, ocr = object(), object()
+    return SimpleNamespace(ocr=ocr if ocr_variant else None, ocr_input=ocr if ocr_variant else image,
+                           image=image)
+
+
+@pytest.mark.parametrize("session_mode, resend", [("chat", True), ("generate", False)])
+def test_sequential_second_turn_image(session_mode, resend):
+    prepared = _prepared(ocr_variant=True)
+    [[text, visual]] = plan_passes("sequential", prepared, session_mode)
+    assert text.image is prepared.ocr_input
+    assert visual.prompt == VISUAL_PROMPT
+    assert (visual.image is prepared) == resend
+    [[_, visual]] = plan_passes("sequential", _prepared(ocr_variant=False), "chat")
+    assert visual.image is None
+
+
+def test_pass_modes():
+    prepared = _prepared(ocr_variant=False)
+    assert [[s.field for s in c] for c in plan_passes("concurrent", prepared, "chat")] == [["text"], ["visual"]]
+    assert [[s.field for s in c] for c in plan_passes("text_only", prepared, "chat")] == [["text"]]
+    assert [[s.field for s in c] for c in plan_passes("visual_only", prepared, "chat")] == [["visual"]]
+    assert plan_passes("empty", prepared, "chat") == []
+    assert plan_passes("tiled", prepared, "chat") == []
+
+
+@pytest.mark.parametrize("options", [{}, {"concurrent": True}, {"tiled": True}])
+def test_sync_and_async_agree(mock_server, screenshot, options):
+    kwargs = dict(use_cache=False, route=False, **options)
+    streamed = {"sync": [], "async": []}
+    sync = query_ollama_vision_twopass(screenshot, stream_callback=lambda f, t: streamed["sync"].append(f),
+                                       **kwargs)
+    result = asyncio.run(query_ollama_vision_twopass_async(
+        screenshot, stream_callback=lambda f, t: streamed["async"].append(f), **kwargs))
+    assert sync["text"] and sync["visual"]
+    assert (result["text"], result["visual"]) == (sync["text"], sync["visual"])
+    assert result["metrics"]["mode"] == sync["metrics"]["mode"]
+    assert set(result["metrics"]["passes"]) == set(sync["metrics"]["passes"])
+    assert set(streamed["sync"]) == set(streamed["async"]) == {"text", "visual"}
+
+
+def test_cancel_event_closes_streams(mock_server, screenshot):
+    mock_server.token_delay = 0.05
+    token = CancelToken()
+    threading.Timer(0.3, token.cancel).start()
+    start = time.time()
+    with pytest.raises(GenerationCancelled):
+        query_ollama_vision_twopass(screenshot, use_cache=False, route=False, concurrent=True,
+                                    cancel_event=token)
+    assert time.time() - start < 2
+    assert wait_until(lambda: mock_server.aborted == 2)
+
+
+def test_record_false_skips_history_and_metrics(mock_server, screenshot, isolated):
+    query_ollama_vision_twopass(screenshot, use_cache=False, route=False, record=False)
+    assert history._history is None
+    assert not list(isolated.rglob("metrics.jsonl*"))
+    query_ollama_vision_twopass(screenshot, use_cache=False, route=False)
+    assert history._history is not None
+    assert list(isolated.rglob("metrics.jsonl*"))
@@ -1,11 +1,16 @@
-import base64
-import requests
 import json
-import os
 import re
 import ast
-from PIL import Image
-from ollama_vision import get_ollama_settings
+import time
+import requests
+from ollama_vision_twopass import get_ollama_settings, get_http_session
+from hosts import get_host_pool, is_host_failure
+from settings import get_section
+from result_cache import get_result_cache
+from image_pipeline import prepare_image
+from metrics import CaptureMetrics, response_stats, log_metrics
+from stream_json import StreamingJSONFields
+from stream_guard import RepetitionGuard, get_guard_settings, image_dimensions, num_predict_for
 
 # Optional backends (install via pip if you want extra leniency)
 try:
@@ -58,121 +63,284 @@ def extract_json_substring(text: str) -> str:
     raise ValueError("Unmatched JSON braces/brackets")
 
 
-def get_app_settings():
-    """Load or create app_settings.json controlling image resizing."""
-    path = os.path.join(os.path.dirname(__file__), "app_settings.json")
-    default = {"resize_large_images": True}
-    if os.path.exists(path):
+STRUCTURED_PROMPT = (
+    "EXTRACT ALL TEXT from this screenshot. Read every single word, "
+    "filename, label, and code blocks verbatim. Do not miss anything. "
+    "Then describe the visual layout."
+)
+
+REFORMAT_PROMPT = (
+    "Extract ALL text content from this analysis and put it in JSON format. "
+    "Format as:\n"
+    '{"text": "...", "visual": "..."}\n\n'
+    "Keep any markdown code fences (```…```) intact in the text field. "
+    "Also provide a concise visual description in the \"visual\" field.\n\n"
+)
+
+SINGLE_PASS_PROMPT = (
+    "EXTRACT ALL TEXT from this screenshot. Read every single word, "
+    "filename, label, and code blocks verbatim. Do not miss anything. "
+    "Put the text in the \"text\" field, keeping any markdown code fences (```…```) intact, "
+    "and a concise description of the visual layout in the \"visual\" field."
+)
+
+# Sent as Ollama's `format` so the reply is constrained to exactly this object
+EXTRACTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "text": {"type": "string"},
+        "visual": {"type": "string"},
+    },
+    "required": ["text", "visual"],
+}
+
+DEFAULT_TEXT_EXTRACTOR_SETTINGS = {
+    "single_pass": True,   # one schema-constrained generation; the two-step path is the fallback
+}
+
+
+def get_text_extractor_settings():
+    cfg = dict(DEFAULT_TEXT_EXTRACTOR_SETTINGS)
+    cfg.update(get_section("text_extractor"))
+    return cfg
+
+
+def _stream_chat(payload, on_content, metrics=None, pass_name=None, guard=None):
+    """POST a streaming /api/chat request and hand each content piece to `on_content`.
+
+    With a stream_guard.RepetitionGuard the request is closed as soon as the
+    reply falls into a loop, and the event is recorded with the pass metrics.
+    An unreachable host is retried on another one (see HostPool.failover) as
+    long as no content has been handed on yet.
+    """
+    pool = get_host_pool()
+    model = payload.get("model")
+    host, tried, received = pool.select(model), set(), False
+    start = time.time()
+    while True:
+        error, stats, resp = None, None, None
+        pool.begin(host)
         try:
-            return json.load(open(path))
-        except:
-            pass
-    json.dump(default, open(path,"w"))
-    return default
-
-
-def resize_image_if_needed(image_path: str) -> str:
-    """Resize image to max 1200px side if enabled in settings."""
-    settings = get_app_settings()
-    if not settings.get("resize_large_images", True):
-        return image_path
-    with Image.open(image_path) as img:
-        w,h = img.size
-        if w<=1200 and h<=1200:
-            return image_path
-        if w>h:
-            nw,nh = 1200, int(h*1200/w)
-        else:
-            nh,nw = 1200, int(w*1200/h)
-        resized = img.resize((nw,nh), Image.Resampling.LANCZOS)
-        import tempfile
-        tf = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
-        resized.save(tf.name); tf.close()
-        return tf.name
-
-
-def get_structured_analysis(image_path: str) -> str:
+            resp = get_http_session(host.url).post(f"{host.url}/api/chat", json=payload,
+                                                   headers={"Content-Type":"application/json"},
+                                                   timeout=(60,600), stream=True)
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if not line: continue
+                try:
+                    chunk = json.loads(line.decode())
+                except json.JSONDecodeError:
+                    continue
+                if "message" in chunk and "content" in chunk["message"]:
+                    received = received or bool(chunk["message"]["content"])
+                    on_content(chunk["message"]["content"])
+                    print(".", end="", flush=True)
+                    if guard is not None and guard.feed(chunk["message"]["content"]):
+                        print(f"\n[DEBUG] Generation stuck in a loop, stopped early: {guard.event}")
+                        stats = {"repetition": guard.event}
+                        break
+                if chunk.get("done"):
+                    stats = response_stats(chunk)
+            break
+        except Exception as e:
+            error = e
+        finally:
+            if resp is not None:
+                resp.close()
+            pool.end(host, error)
+        host = None if received else pool.failover(host, error, tried, model)
+        if host is None:
+            raise error
+    if metrics is not None and stats is not None:
+        metrics.add_pass(pass_name, dict(stats, host=host.url), time.time() - start)
+
+
+def _encoded(image, model, metrics=None):
+    prepared = prepare_image(image, model=model)
+    if metrics is None:
+        return prepared.b64
+    with metrics.stage("encode"):
+        return prepared.b64
+
+
+def get_structured_analysis(image, metrics=None, on_token=None) -> str:
     """Step 1: Send image, receive streaming text analysis."""
-    url, model = get_ollama_settings()
-    proc = resize_image_if_needed(image_path)
-    raw = open(proc,"rb").read()
-    img_b64 = base64.b64encode(raw).decode()
+    _, model, _ = get_ollama_settings()
+    image_b64 = _encoded(image, model, metrics)
     payload = {
         "model": model,
         "messages": [{
             "role":"user",
-            "content":(
-                "EXTRACT ALL TEXT from this screenshot. Read every single word, "
-                "filename, label, and code blocks verbatim. Do not miss anything. "
-                "Then describe the visual layout."
-            ),
-            "images":[img_b64]
+            "content":STRUCTURED_PROMPT,
+            "images":[image_b64]
         }],
         "stream":True, "keep_alive":"15m"
     }
-    resp = requests.post(f"{url}/api/chat", json=payload,
-                         headers={"Content-Type":"application/json"},
-                         timeout=(60,600), stream=True)
-    resp.raise_for_status()
-    full = ""
-    for line in resp.iter_lines():
-        if not line: continue
-        try:
-            chunk = json.loads(line.decode())
-            if "message" in chunk and "content" in chunk["message"]:
-                full += chunk["message"]["content"]
-                print(".", end="", flush=True)
-        except json.JSONDecodeError:
-            continue
-    if proc!=image_path:
-        try: os.unlink(proc)
-        except: pass
+    guard_cfg = get_guard_settings()
+    num_predict = num_predict_for(image_dimensions(image_b64), guard_cfg)
+    if num_predict:
+        payload["options"] = {"num_predict": num_predict}
+    guard = RepetitionGuard(guard_cfg, num_predict) if guard_cfg["enabled"] else None
+    parts = []
+
+    def on_content(token):
+        parts.append(token)
+        if on_token is not None:
+            on_token(token)
+
+    _stream_chat(payload, on_content, metrics, "analysis", guard)
     print("\n[DEBUG] Structured analysis complete")
-    return full
-
-
-def reformat_to_json(structured: str) -> str:
-    """Step 2: Instruct model to produce JSON with text+visual fields."""
-    url, model = get_ollama_settings()
-    prompt = (
-        "Extract ALL text content from this analysis and put it in JSON format. "
-        "Format as:\n"
-        '{"text": "...", "visual": "..."}\n\n'
-        "Keep any markdown code fences (```…```) intact in the text field. "
-        "Also provide a concise visual description in the \"visual\" field.\n\n"
-        + structured
-    )
+    if guard is not None and guard.tripped:
+        return guard.trimmed()
+    return "".join(parts)
+
+
+def single_pass_payload(model, img_b64, stream=True, num_predict=None):
+    """/api/chat payload for one generation constrained to EXTRACTION_SCHEMA."""
+    options = {"temperature": 0}
+    if num_predict:
+        options["num_predict"] = num_predict
+    return {
+        "model": model,
+        "messages": [{"role": "user", "content": SINGLE_PASS_PROMPT, "images": [img_b64]}],
+        "format": EXTRACTION_SCHEMA,
+        "stream": stream, "keep_alive": "15m",
+        "options": options,
+    }
+
+
+class SinglePassGuard:
+    """RepetitionGuard for a schema-constrained reply.
+
+    The raw reply is JSON with its line breaks escaped, so the guard reads the
+    decoded "text" value instead. Pass on_field as the StreamingJSONFields
+    callback; feed(token), called with each raw token like a RepetitionGuard,
+    checks what was decoded since.
+    """
+
+    def __init__(self, cfg, num_predict, on_field=None):
+        self.guard = RepetitionGuard(cfg, num_predict)
+        self._on_field = on_field
+        self._pending = []
+
+    @property
+    def event(self):
+        return self.guard.event
+
+    @property
+    def tripped(self):
+        return self.guard.tripped
+
+    def on_field(self, field, delta):
+        if field == "text":
+            self._pending.append(delta)
+        if self._on_field is not None:
+            self._on_field(field, delta)
+
+    def feed(self, token):
+        delta, self._pending = "".join(self._pending), []
+        return self.guard.feed(delta) if delta else self.guard.tripped
+
+
+def single_pass_request(model, img_b64, on_field=None):
+    """(payload, parser, guard) for one single-pass extraction (shared with the async extractor).
+
+    The reply is capped by image size and watched by a SinglePassGuard (None
+    when the guard is disabled), as in get_structured_analysis.
+    """
+    guard_cfg = get_guard_settings()
+    num_predict = num_predict_for(image_dimensions(img_b64), guard_cfg)
+    guard = SinglePassGuard(guard_cfg, num_predict, on_field) if guard_cfg["enabled"] else None
+    parser = StreamingJSONFields(on_field=guard.on_field if guard is not None else on_field)
+    return single_pass_payload(model, img_b64, num_predict=num_predict), parser, guard
+
+
+def single_pass_result(parser, guard):
+    """{"text", "visual"} from a finished single pass, or None if the reply is unusable."""
+    if guard is not None and guard.tripped:
+        # The reply was cut off mid-object: keep the fields without the repeated tail
+        return {"text": guard.guard.trimmed(), "visual": parser.get("visual")}
+    result = parse_single_pass(parser.text())
+    if result is None and parser.get("text"):
+        # Cut off by the num_predict cap: the two-step path would only run into the cap twice more
+        print("[DEBUG] single-pass reply ended early, keeping its fields")
+        result = {"text": parser.get("text"), "visual": parser.get("visual")}
+    return result
+
+
+def parse_single_pass(raw):
+    """{"text", "visual"} from a schema-constrained reply, or None if it doesn't match."""
+    try:
+        result = json.loads(raw)
+    except ValueError as e:
+        print(f"[DEBUG] single-pass reply is not JSON: {e}")
+        return None
+    if not isinstance(result, dict) or not isinstance(result.get("text"), str) \
+            or not isinstance(result.get("visual"), str):
+        print("[DEBUG] single-pass reply does not match the schema")
+        return None
+    return {"text": result["text"], "visual": result["visual"]}
+
+
+def single_pass_rejected(error):
+    """True if the server refused the schema-constrained request with an HTTP error.
+
+    That is how a server without structured-output support answers a `format`
+    field. Host failures (see hosts.is_host_failure) are not rejections:
+    failover has already tried the other hosts.
+    """
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) or getattr(error, "status", None)
+    return isinstance(status, int) and not is_host_failure(error)
+
+
+def get_single_pass_extraction(image, metrics=None, on_field=None):
+    """One generation constrained to EXTRACTION_SCHEMA.
+
+    on_field(field, delta) receives the "text"/"visual" values as they stream.
+    Returns {"text", "visual"}, or None if the reply is not a valid object
+    or the server rejects the request (e.g. no structured-output support).
+    """
+    _, model, _ = get_ollama_settings()
+    payload, parser, guard = single_pass_request(model, _encoded(image, model, metrics), on_field)
+    try:
+        _stream_chat(payload, parser.feed, metrics, "extract", guard)
+    except requests.RequestException as e:
+        if not single_pass_rejected(e):
+            raise
+        print(f"\n[DEBUG] single-pass request rejected: {e}")
+        return None
+    return single_pass_result(parser, guard)
+
+
+def reformat_to_json(structured: str, metrics=None, on_field=None) -> str:
+    """Step 2: Instruct model to produce JSON with text+visual fields.
+
+    on_field(field, delta) receives the "text"/"visual" values as they stream.
+    """
+    _, model, _ = get_ollama_settings()
+    prompt = REFORMAT_PROMPT + structured
     payload = {"model":model, "messages":[{"role":"user","content":prompt}],
                "stream":True,"keep_alive":"15m"}
-    resp = requests.post(f"{url}/api/chat", json=payload,
-                         headers={"Content-Type":"application/json"},
-                         timeout=(60,600), stream=True)
-    resp.raise_for_status()
-    js=""
-    for line in resp.iter_lines():
-        if not line: continue
-        try:
-            chunk = json.loads(line.decode())
-            if "message" in chunk and "content" in chunk["message"]:
-                js += chunk["message"]["content"]
-                print(".", end="", flush=True)
-        except json.JSONDecodeError:
-            continue
+    parser = StreamingJSONFields(on_field=on_field)
+    _stream_chat(payload, parser.feed, metrics, "reformat")
     print("\n[DEBUG] JSON reformat complete")
-    return js
+    return parser.text()
 
 
-def extract_text_from_image(image_path: str):
+def extract_text_two_step(image, metrics=None, stream_callback=None):
     """
-    Full pipeline: analysis → JSON → parse → extract.
+    Legacy path: free-form analysis, a second generation that reformats it as
+    JSON, then lenient parsing with regex and filename fallbacks.
+    stream_callback(field, delta) receives the reformatted fields as they stream.
     Returns (text, visual).
     """
     print("=== STEP 1 ===")
-    structured = get_structured_analysis(image_path)
+    structured = get_structured_analysis(image, metrics)
     print(f"\nRAW STRUCTURED:\n{structured}\n")
 
     print("=== STEP 2 ===")
-    raw_json = reformat_to_json(structured)
+    raw_json = reformat_to_json(structured, metrics, on_field=stream_callback)
     print(f"\nRAW JSON:\n{raw_json}\n")
 
     # Parse JSON blob
@@ -200,6 +368,77 @@ def extract_text_from_image(image_path: str):
             visual = "Screenshot shows files: " + ", ".join(files[:8]) \
                      + (f", and {len(files)-8} more." if len(files)>8 else ".")
             print(f"[DEBUG] Built fallback visual from {len(files)} entries")
+    return text, visual
 
-    print("[DEBUG] Extraction complete")
+
+def prepare_extraction(image, model, use_cache, single_pass, metrics):
+    """Preprocess and look up the cache (shared by the sync and async extractors).
+
+    Returns (prepared, cache, cache_key, cached).
+    """
+    with metrics.stage("preprocess"):
+        prepared = prepare_image(image, model=model)
+    metrics.set("model", model)
+    metrics.set("mode", "text_extractor")
+    cache = get_result_cache() if use_cache else None
+    if not cache:
+        return prepared, None, None, None
+    if single_pass:
+        prompts = (SINGLE_PASS_PROMPT, json.dumps(EXTRACTION_SCHEMA, sort_keys=True))
+    else:
+        prompts = (STRUCTURED_PROMPT, REFORMAT_PROMPT)
+    cache_key = cache.key_for(prepared.image, model, *prompts)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        print("[DEBUG] Result cache hit")
+        metrics.set("cache_hit", True)
+    return prepared, cache, cache_key, cached
+
+
+def finish_extraction(text, visual, cache, cache_key, metrics, start_time, record=True):
+    """Store a fresh result in the cache, log the metrics (with `record`) and return (text, visual)."""
+    if cache:
+        cache.put(cache_key, {"text": text, "visual": visual})
+    metrics.add_stage("total", time.time() - start_time)
+    if record:
+        log_metrics(metrics.to_dict())
     return text, visual
+
+
+def extract_text_from_image(image, use_cache=True, metrics=None, single_pass=None,
+                            stream_callback=None, record=True):
+    """
+    Full pipeline: one schema-constrained generation (`single_pass`, default
+    from the "text_extractor" settings), falling back to
+    analysis → JSON → parse → extract if the server rejects that request
+    (e.g. no structured-output support) or its reply is unusable.
+    `image` may be a path, a PIL image or a PreparedImage.
+    stream_callback(field, delta) receives partial "text"/"visual" values while
+    they are generated, as in query_ollama_vision_twopass.
+    Timings are recorded in `metrics` (a CaptureMetrics) and, with `record`,
+    the metrics log.
+    Returns (text, visual).
+    """
+    start_time = time.time()
+    metrics = metrics if metrics is not None else CaptureMetrics()
+    if single_pass is None:
+        single_pass = get_text_extractor_settings()["single_pass"]
+    _, model, _ = get_ollama_settings()
+    image, cache, cache_key, cached = prepare_extraction(image, model, use_cache, single_pass, metrics)
+    if cached is not None:
+        return finish_extraction(cached["text"], cached["visual"], None, None, metrics, start_time,
+                                 record)
+
+    result = None
+    if single_pass:
+        result = get_single_pass_extraction(image, metrics, on_field=stream_callback)
+        if result is None:
+            print("[DEBUG] Falling back to two-step extraction")
+            metrics.set("fallback", True)
+    if result is not None:
+        text, visual = result["text"], result["visual"]
+    else:
+        text, visual = extract_text_two_step(image, metrics, stream_callback)
+
+    print("[DEBUG] Extraction complete")
+    return finish_extraction(text, visual, cache, cache_key, metrics, start_time, record)
@@ -0,0 +1,390 @@
+"""
+Read-only text pane for long OCR output.
+
+A TextInput lays out and renders its whole text on every change. TextViewer
+keeps the text as a list of lines, wraps it into fixed-height rows and shows
+them through a RecycleView: only the rows on screen exist as widgets.
+append() only re-wraps the last line and the new text instead of the whole
+result. A small toolbar searches the text (Enter for the next match) and
+copies the selected rows, or everything, to the clipboard.
+
+    python text_viewer.py --bench 5000   # time both widgets on this machine
+"""
+
+import time
+import argparse
+
+from kivy.clock import Clock
+from kivy.core.clipboard import Clipboard
+from kivy.core.text import Label as CoreLabel
+from kivy.core.window import Window
+from kivy.graphics import Color, Rectangle
+from kivy.properties import BooleanProperty, ListProperty, NumericProperty, StringProperty
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.button import Button
+from kivy.uix.label import Label
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.textinput import TextInput
+from kivy.utils import escape_markup
+
+MATCH_MARKUP = "[color=1a1a1a][b]{}[/b][/color]"
+
+
+def wrap_line(line, cols):
+    """Split one line into row-sized pieces, breaking after a space where one is close enough."""
+    if len(line) <= cols:
+        return [line]
+    pieces = []
+    start = 0
+    while len(line) - start > cols:
+        end = start + cols
+        space = line.rfind(" ", start + cols // 2, end)
+        if space != -1:
+            end = space + 1
+        pieces.append(line[start:end])
+        start = end
+    pieces.append(line[start:])
+    return pieces
+
+
+class _Row(RecycleDataViewBehavior, Label):
+    selected = BooleanProperty(False)
+    current = BooleanProperty(False)
+
+    def __init__(self, **kwargs):
+        super().__init__(markup=True, halign="left", valign="middle", **kwargs)
+        self.index = 0
+        self.viewer = None
+        self.bind(size=self.setter("text_size"))
+        with self.canvas.before:
+            self._bg_color = Color(0, 0, 0, 0)
+            self._bg = Rectangle()
+        self.bind(pos=self._update_bg, size=self._update_bg, selected=self._update_bg,
+                  current=self._update_bg)
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.index = index
+        self.viewer = rv.viewer
+        self.font_name = rv.viewer.font_name
+        self.font_size = rv.viewer.font_size
+        self.color = rv.viewer.foreground_color
+        return super().refresh_view_attrs(rv, index, data)
+
+    def _update_bg(self, *_):
+        self._bg.pos, self._bg.size = self.pos, self.size
+        if self.current:
+            self._bg_color.rgba = (1, 0.85, 0.4, 0.35)
+        elif self.selected:
+            self._bg_color.rgba = (0.3, 0.45, 0.7, 0.5)
+        else:
+            self._bg_color.rgba = (0, 0, 0, 0)
+
+    def on_touch_down(self, touch):
+        if self.collide_point(*touch.pos) and self.viewer is not None and not touch.is_mouse_scrolling:
+            self.viewer.select_row(self.index, extend="shift" in Window.modifiers)
+        return super().on_touch_down(touch)
+
+
+class TextViewer(BoxLayout):
+    """Virtualized, read-only replacement for a TextInput showing long text.
+
+    Set `text` to replace the content and call append() for streamed chunks.
+    Setting `text` to the current text plus a suffix is treated as an append.
+    """
+
+    font_name = StringProperty("RobotoMono-Regular")
+    font_size = NumericProperty("14sp")
+    foreground_color = ListProperty([0.9, 0.9, 0.9, 1])
+    background_color = ListProperty([0.2, 0.2, 0.2, 1])
+
+    def __init__(self, text="", toolbar=True, **kwargs):
+        super().__init__(orientation="vertical", spacing=2, **kwargs)
+        self._lines = [""]
+        self._rows = []          # (line index, start offset) of every row
+        self._line_rows = [0]    # first row of every line
+        self._cols = 80
+        self._row_height = 20
+        self._selection = None   # (first row, last row)
+        self._anchor = None
+        self._matches = []       # (row, start, end) of every match of the search query
+        self._match_index = -1
+        self._query = ""
+        self._follow = False     # keep the end in view while text streams in
+
+        if toolbar:
+            bar = BoxLayout(orientation="horizontal", size_hint_y=None, height=30, spacing=4)
+            self.search_input = TextInput(hint_text="Find", multiline=False, font_size="13sp")
+            self.search_input.bind(on_text_validate=lambda *_: self.find(self.search_input.text))
+            self.match_label = Label(text="", size_hint_x=None, width=70, font_size="12sp",
+                                     color=(0.6, 0.6, 0.6, 1))
+            copy_btn = Button(text="Copy", size_hint_x=None, width=60, font_size="13sp",
+                              background_color=(0.3, 0.3, 0.3, 1))
+            copy_btn.bind(on_press=lambda *_: self.copy())
+            bar.add_widget(self.search_input)
+            bar.add_widget(self.match_label)
+            bar.add_widget(copy_btn)
+            self.add_widget(bar)
+
+        self.rv = RecycleView(viewclass=_Row, bar_width=8, scroll_type=["bars", "content"])
+        self.rv.viewer = self
+        self.rows_layout = RecycleBoxLayout(orientation="vertical", default_size=(None, self._row_height),
+                                            default_size_hint=(1, None), size_hint_y=None)
+        self.rows_layout.bind(minimum_height=self.rows_layout.setter("height"))
+        self.rows_layout.bind(height=self._on_content_height)
+        self.rv.add_widget(self.rows_layout)
+        self.rv.bind(scroll_y=self._on_scroll)
+        with self.rv.canvas.before:
+            self._bg_color = Color(*self.background_color)
+            self._bg = Rectangle()
+        self.rv.bind(pos=self._update_bg, size=self._update_bg)
+        self.add_widget(self.rv)
+
+        self._rewrap_trigger = Clock.create_trigger(lambda dt: self._rewrap_all(), 0.1)
+        self.rv.bind(width=lambda *_: self._rewrap_trigger())
+        self.bind(font_name=self._on_font, font_size=self._on_font)
+        self._measure_font()
+        self.text = text
+
+    # ---------------------------------------------------------------- content
+
+    @property
+    def text(self):
+        return "\n".join(self._lines)
+
+    @text.setter
+    def text(self, value):
+        current = self.text
+        if current and value.startswith(current):
+            self.append(value[len(current):])  # e.g. the final reply after its streamed tokens
+            return
+        self._lines = value.split("\n")
+        self._selection = self._anchor = None
+        self._rewrap_all()
+        self.rv.scroll_y = 1
+
+    def append(self, chunk):
+        """Add text at the end; only the last line and the new ones are re-wrapped."""
+        if not chunk:
+            return
+        parts = chunk.split("\n")
+        last = len(self._lines) - 1
+        self._lines[last] += parts[0]
+        self._lines.extend(parts[1:])
+        self._rewrap_from(last)
+
+    def _rewrap_all(self):
+        self._cols = max(10, int((self.rv.width - self.rv.bar_width - 4) / self._char_width))
+        self._rows = []
+        self._line_rows = []
+        self.rv.data = []
+        self._rewrap_from(0)
+
+    def _rewrap_from(self, line):
+        """Rebuild the rows of lines[line:] and update the RecycleView data from there on."""
+        first = self._line_rows[line] if line < len(self._line_rows) else len(self._rows)
+        if self._selection is not None and self._selection[1] >= first:
+            self._selection = self._anchor = None
+        del self._rows[first:]
+        del self._line_rows[line:]
+        data = []
+        for i in range(line, len(self._lines)):
+            self._line_rows.append(len(self._rows))
+            start = 0
+            for piece in wrap_line(self._lines[i], self._cols):
+                self._rows.append((i, start))
+                data.append({"text": escape_markup(piece), "selected": False, "current": False})
+                start += len(piece)
+        rv_data = self.rv.data
+        if first < len(rv_data):
+            del rv_data[first:]
+        rv_data.extend(data)
+        if self._query:
+            self._find_matches(first)
+
+    def _row_text(self, row):
+        line, start = self._rows[row]
+        end = self._rows[row + 1][1] if row + 1 < len(self._rows) and self._rows[row + 1][0] == line else None
+        return self._lines[line][start:end]
+
+    def _rows_text(self, first, last):
+        """Text of rows first..last, with newlines only where the original lines end."""
+        parts = []
+        for row in range(first, last + 1):
+            if parts and self._rows[row][1] == 0:
+                parts.append("\n")
+            parts.append(self._row_text(row))
+        return "".join(parts)
+
+    # ---------------------------------------------------------------- selection and copy
+
+    def select_row(self, row, extend=False):
+        if extend and self._anchor is not None:
+            first, last = sorted((self._anchor, row))
+        else:
+            self._anchor = row
+            first = last = row
+        self._set_selection((first, last))
+
+    def _set_selection(self, selection):
+        data = self.rv.data
+        if self._selection is not None:
+            for row in range(self._selection[0], self._selection[1] + 1):
+                data[row]["selected"] = False
+        self._selection = selection
+        if selection is not None:
+            for row in range(selection[0], selection[1] + 1):
+                data[row]["selected"] = True
+        self.rv.refresh_from_data()
+
+    def selected_text(self):
+        if self._selection is None:
+            return ""
+        return self._rows_text(*self._selection)
+
+    def copy(self):
+        """Copy the selected rows, or the whole text when nothing is selected."""
+        Clipboard.copy(self.selected_text() or self.text)
+
+    # ---------------------------------------------------------------- search
+
+    def find(self, query):
+        """Jump to the next match of `query` (case-insensitive); returns the number of matches."""
+        if query != self._query:
+            self._query = query
+            self._match_index = -1
+            self._find_matches()
+        if not self._matches:
+            self._show_match(None)
+            return 0
+        self._show_match((self._match_index + 1) % len(self._matches))
+        return len(self._matches)
+
+    def _find_matches(self, first=0):
+        """Recompute the matches in rows first.. (the earlier rows did not change)."""
+        self._matches = [m for m in self._matches if m[0] < first] if first else []
+        query = self._query.lower()
+        if query:
+            for row in range(first, len(self._rows)):
+                text = self._row_text(row).lower()
+                pos = text.find(query)
+                while pos != -1:
+                    self._matches.append((row, pos, pos + len(query)))
+                    pos = text.find(query, pos + len(query))
+        self._match_index = min(self._match_index, len(self._matches) - 1)
+        if hasattr(self, "match_label"):
+            shown = self._match_index + 1 if self._matches else 0
+            self.match_label.text = f"{shown}/{len(self._matches)}" if query else ""
+
+    def _show_match(self, index):
+        data = self.rv.data
+        if 0 <= self._match_index < len(self._matches):
+            row = self._matches[self._match_index][0]
+            data[row]["text"] = escape_markup(self._row_text(row))
+            data[row]["current"] = False
+        self._match_index = -1 if index is None else index
+        if index is not None:
+            row, start, end = self._matches[index]
+            text = self._row_text(row)
+            data[row]["text"] = (escape_markup(text[:start]) + MATCH_MARKUP.format(escape_markup(text[start:end]))
+                                 + escape_markup(text[end:]))
+            data[row]["current"] = True
+            self.scroll_to_row(row)
+        self.rv.refresh_from_data()
+        if hasattr(self, "match_label"):
+            self.match_label.text = f"{self._match_index + 1}/{len(self._matches)}" if self._query else ""
+
+    def scroll_to_row(self, row):
+        self._follow = False
+        total = len(self._rows) * self._row_height
+        view = self.rv.height
+        if total <= view:
+            return
+        top = row * self._row_height - (view - self._row_height) / 2
+        self.rv.scroll_y = 1 - min(max(top / (total - view), 0), 1)
+
+    # ---------------------------------------------------------------- layout
+
+    def _measure_font(self):
+        label = CoreLabel(text="M" * 20, font_name=self.font_name, font_size=self.font_size)
+        label.refresh()
+        self._char_width = max(label.texture.size[0] / 20.0, 1)
+        self._row_height = label.texture.size[1] + 2
+        self.rows_layout.default_size = (None, self._row_height)
+
+    def _on_font(self, *_):
+        self._measure_font()
+        self._rewrap_trigger()
+
+    def _on_scroll(self, instance, scroll_y):
+        # Scrolling back to the end resumes following the stream
+        self._follow = scroll_y <= 0.001
+
+    def _on_content_height(self, *_):
+        if self._follow:
+            self.rv.scroll_y = 0
+
+    def _update_bg(self, *_):
+        self._bg_color.rgba = self.background_color
+        self._bg.pos, self._bg.size = self.rv.pos, self.rv.size
+
+
+def _sample_text(lines):
+    words = ("def", "query_ollama_vision_twopass", "image", "return", "None", "self", "text", "visual",
+             "metrics", "=", "(", ")", "for", "in", "range", "if", "else:")
+    return "\n".join(" ".join(words[(i * 7 + j) % len(words)] for j in range(6 + i % 12))
+                     for i in range(lines))
+
+
+def bench(lines=5000, chunk_chars=200, appends=50):
+    """Time setting and streaming a large result into a TextInput and a TextViewer."""
+    from kivy.base import EventLoop
+
+    EventLoop.ensure_window()
+    text = _sample_text(lines)
+    chunks = [text[i:i + chunk_chars] for i in range(0, chunk_chars * appends, chunk_chars)]
+    results = {}
+    for name, make in (("TextInput", lambda: TextInput(readonly=True, font_name="RobotoMono-Regular")),
+                       ("TextViewer", lambda: TextViewer())):
+        widget = make()
+        widget.size = (600, 800)
+        Window.add_widget(widget)
+        EventLoop.idle()
+
+        start = time.perf_counter()
+        widget.text = text
+        EventLoop.idle()
+        set_time = time.perf_counter() - start
+
+        widget.text = text
+        EventLoop.idle()
+        append_times = []
+        for chunk in chunks:
+            start = time.perf_counter()
+            if isinstance(widget, TextViewer):
+                widget.append(chunk)
+            else:
+                widget.text += chunk
+            EventLoop.idle()
+            append_times.append(time.perf_counter() - start)
+        Window.remove_widget(widget)
+        append_times.sort()
+        results[name] = {"set_ms": set_time * 1000,
+                         "append_p50_ms": append_times[len(append_times) // 2] * 1000,
+                         "append_max_ms": append_times[-1] * 1000}
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark TextViewer against TextInput.")
+    parser.add_argument("--bench", type=int, default=5000, metavar="LINES", help="lines of sample text")
+    parser.add_argument("--chunk", type=int, default=200, help="characters per streamed chunk")
+    args = parser.parse_args(argv)
+    for name, r in bench(args.bench, args.chunk).items():
+        print(f"{name:<11} set {r['set_ms']:8.1f} ms   append p50 {r['append_p50_ms']:6.1f} ms"
+              f"   max {r['append_max_ms']:6.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
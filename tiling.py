@@ -0,0 +1,205 @@
+"""
+Tiled OCR for large or dense captures.
+
+Instead of downscaling a 4K editor capture until its text is unreadable, the
+text pass splits the full-resolution image into overlapping tiles, OCRs them
+concurrently and stitches the results back together in reading order,
+dropping lines repeated in the overlap bands.
+"""
+
+import math
+import time
+import threading
+from difflib import SequenceMatcher
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+from settings import get_section
+from image_pipeline import PreparedImage, make_ocr_variant, snap_to_patches, get_preprocess_settings
+from ollama_vision_twopass import (OllamaSession, GenerationCancelled, linked_cancel_token,
+                                   TEXT_PROMPT, VISUAL_PROMPT_STANDALONE)
+
+DEFAULT_TILING = {
+    "enabled": True,
+    "min_side": 1800,        # only tile captures whose longest side exceeds this
+    "tile_height": 1008,
+    "max_tile_width": 1568,  # wider captures are also split into columns
+    "overlap": 112,
+    "max_workers": 4,
+}
+
+
+def get_tiling_settings():
+    cfg = dict(DEFAULT_TILING)
+    cfg.update(get_section("tiling"))
+    return cfg
+
+
+def should_tile(size, cfg=None):
+    cfg = cfg or get_tiling_settings()
+    return bool(cfg["enabled"]) and max(size) > cfg["min_side"]
+
+
+def _spans(length, tile, overlap):
+    """Start/end offsets covering `length` with tiles of at most `tile` overlapping by `overlap`.
+
+    Tiles are shrunk evenly so neighbours overlap by exactly `overlap` pixels.
+    """
+    if length <= tile:
+        return [(0, length)]
+    count = math.ceil((length - overlap) / float(tile - overlap))
+    size = math.ceil((length + (count - 1) * overlap) / float(count))
+    step = size - overlap
+    spans = [(i * step, i * step + size) for i in range(count)]
+    spans[-1] = (length - size, length)
+    return spans
+
+
+def split_into_tiles(img, tile_height, max_tile_width, overlap):
+    """Overlapping tiles in reading order: a list of (row, col, box, tile_image)."""
+    rows = _spans(img.height, tile_height, overlap)
+    cols = _spans(img.width, max_tile_width, overlap)
+    tiles = []
+    for r, (top, bottom) in enumerate(rows):
+        for c, (left, right) in enumerate(cols):
+            box = (left, top, right, bottom)
+            tiles.append((r, c, box, img.crop(box)))
+    return tiles
+
+
+def _normalize(line):
+    return " ".join(line.split()).lower()
+
+
+def _similar(a, b):
+    a, b = _normalize(a), _normalize(b)
+    if not a or not b:
+        return a == b
+    # A line cut by the tile edge may come back partially in one of the tiles
+    if len(a) >= 8 and len(b) >= 8 and (a in b or b in a):
+        return True
+    return SequenceMatcher(None, a, b).ratio() >= 0.85
+
+
+def dedupe_overlap(prev_text, next_text, max_lines):
+    """`next_text` without its leading lines that repeat the tail of `prev_text`."""
+    prev_lines = [l for l in prev_text.splitlines() if l.strip()][-max_lines:]
+    next_lines = next_text.splitlines()
+    content = [i for i, l in enumerate(next_lines) if l.strip()][:max_lines]
+    for k in range(min(len(prev_lines), len(content)), 0, -1):
+        tail = prev_lines[-k:]
+        head = [next_lines[i] for i in content[:k]]
+        if all(_similar(a, b) for a, b in zip(tail, head)):
+            return "\n".join(next_lines[content[k - 1] + 1:]).lstrip("\n")
+    return next_text
+
+
+def merge_tile_texts(texts, overlap):
+    """Stitch {(row, col): text} into one text in reading order.
+
+    Tiles are deduplicated against the tile above them in the same column,
+    then emitted row by row, left to right.
+    """
+    max_lines = max(2, overlap // 10 + 2)   # generous upper bound on lines in an overlap band
+    rows = sorted({r for r, _ in texts})
+    cols = sorted({c for _, c in texts})
+    cleaned = {}
+    for c in cols:
+        prev = None
+        for r in rows:
+            text = (texts.get((r, c)) or "").strip()
+            if prev is not None and text:
+                text = dedupe_overlap(prev, text, max_lines)
+            cleaned[(r, c)] = text
+            prev = texts.get((r, c)) or prev
+    parts = [cleaned[(r, c)] for r in rows for c in cols if cleaned.get((r, c))]
+    return "\n".join(parts)
+
+
+def prepare_tiles(prepared, model, cfg):
+    """PreparedImage tiles cut from the full-resolution capture: (row, col, box, tile)."""
+    pre = get_preprocess_settings(model)
+    tiles = []
+    for r, c, box, tile in split_into_tiles(prepared.source, cfg["tile_height"],
+                                            cfg["max_tile_width"], cfg["overlap"]):
+        if pre["patch_size"]:
+            tile = snap_to_patches(tile, pre["patch_size"])
+        if prepared.ocr_variant:
+            tile = make_ocr_variant(tile, prepared.ocr_variant)
+        tiles.append((r, c, box, PreparedImage(tile, content_class="text")))
+    return tiles
+
+
+def run_tiled_passes(prepared, model, stream_callback=None, progress_callback=None, cfg=None,
+                     metrics=None, cancel_event=None, visual=True):
+    """Tiled OCR plus a visual pass on the downscaled image, all in flight together.
+
+    Returns (text, visual); visual is "" when `visual` is False. If any request fails, the others are cancelled and
+    the first real error is re-raised; so are all of them when `cancel_event`
+    (a CancelToken) is cancelled.
+    """
+    cfg = cfg or get_tiling_settings()
+    if progress_callback:
+        progress_callback("Reading tiles...")
+    tiles = prepare_tiles(prepared, model, cfg)
+    cancel_event = linked_cancel_token(cancel_event)
+    sessions = []
+    sessions_lock = threading.Lock()
+    done_count = [0]
+
+    def ask(name, prompt, image, callback=None):
+        session = OllamaSession(model=model)
+        with sessions_lock:
+            sessions.append(session)
+        try:
+            if metrics is not None:
+                with metrics.stage("encode"):
+                    image_b64 = image.b64
+            else:
+                image_b64 = image.b64
+            start = time.time()
+            reply = session.ask(prompt, images=[image_b64], callback=callback,
+                                cancel_event=cancel_event)
+            if metrics is not None:
+                metrics.add_pass(name, session.last_stats, time.time() - start)
+            return reply
+        except Exception:
+            cancel_event.set()
+            with sessions_lock:
+                for other in sessions:
+                    if other is not session:
+                        other.abort()
+            raise
+        finally:
+            session.close()
+
+    def read_tile(name, tile):
+        text = ask(name, TEXT_PROMPT, tile)
+        with sessions_lock:
+            done_count[0] += 1
+            n = done_count[0]
+        if progress_callback:
+            progress_callback(f"Read tile {n}/{len(tiles)}")
+        return text
+
+    visual_callback = None
+    if stream_callback is not None:
+        visual_callback = lambda token: stream_callback("visual", token)
+
+    with ThreadPoolExecutor(max_workers=max(1, cfg["max_workers"]) + 1) as pool:
+        visual_future = None
+        if visual:
+            visual_future = pool.submit(ask, "visual", VISUAL_PROMPT_STANDALONE, prepared, visual_callback)
+        tile_futures = {(r, c): pool.submit(read_tile, f"tile_{r}_{c}", tile) for r, c, _, tile in tiles}
+        futures = [f for f in [visual_future] if f is not None] + list(tile_futures.values())
+        wait(futures, return_when=FIRST_EXCEPTION)
+        wait(futures)
+
+    errors = [f.exception() for f in futures if f.exception() is not None]
+    if errors:
+        real_errors = [e for e in errors if not isinstance(e, GenerationCancelled)]
+        raise (real_errors or errors)[0]
+
+    text = merge_tile_texts({key: f.result() for key, f in tile_futures.items()}, cfg["overlap"])
+    if stream_callback is not None:
+        stream_callback("text", text)
+    return text, visual_future.result() if visual_future is not None else ""
@@ -0,0 +1,135 @@
+"""
+Tiny client for the resident daemon (daemon.py).
+
+Only standard-library modules are imported, so it starts in milliseconds and
+can be bound to a hotkey:
+
+    python vx.py capture                 # select a region in the running daemon
+    python vx.py capture --wait          # ...and print the text once it is read
+    python vx.py capture --multi         # select several regions and read them as a batch
+    python vx.py extract shot.png --json
+    python vx.py ping | status | show | quit
+
+The socket is $VISIONEXPLORER_SOCKET, else visionexplorer.sock in
+$XDG_RUNTIME_DIR (or ~/.cache/visionexplorer).
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+
+SOCKET_NAME = "visionexplorer.sock"
+
+
+def socket_path():
+    path = os.environ.get("VISIONEXPLORER_SOCKET")
+    if path:
+        return path
+    base = os.environ.get("XDG_RUNTIME_DIR") or os.path.join(os.path.expanduser("~"), ".cache",
+                                                             "visionexplorer")
+    return os.path.join(base, SOCKET_NAME)
+
+
+def send_command(request, path=None, timeout=None):
+    """Send one JSON request to the daemon and return its JSON reply.
+
+    Raises OSError (e.g. FileNotFoundError, ConnectionRefusedError) if no
+    daemon is listening.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path or socket_path())
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    if not data:
+        raise ConnectionError("daemon closed the connection without replying")
+    return json.loads(data)
+
+
+def is_running(path=None):
+    try:
+        return send_command({"cmd": "ping"}, path, timeout=2).get("ok", False)
+    except (OSError, ValueError):
+        return False
+
+
+def spawn_daemon(args=(), path=None, wait=30.0):
+    """Start daemon.py in the background and wait until it answers."""
+    import subprocess
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "daemon.py")
+    subprocess.Popen([sys.executable, script, *args], start_new_session=True,
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + wait
+    while time.time() < deadline:
+        if is_running(path):
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def print_reply(reply, as_json=False):
+    if as_json:
+        print(json.dumps(reply, ensure_ascii=False, indent=2))
+        return
+    if "text" in reply:
+        print(reply["text"])
+        if reply.get("visual"):
+            print()
+            print(reply["visual"])
+    elif reply.get("message"):
+        print(reply["message"])
+    else:
+        print(json.dumps({k: v for k, v in reply.items() if k != "ok"}, ensure_ascii=False, indent=2))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send a command to the VisionExplorer daemon.")
+    parser.add_argument("command", choices=("capture", "extract", "ping", "status", "show", "quit"))
+    parser.add_argument("image", nargs="?", help="image file for `extract`")
+    parser.add_argument("--wait", action="store_true", help="capture: wait for and print the result")
+    parser.add_argument("--multi", action="store_true",
+                        help="capture: select several regions (Enter to finish) and read them as a batch")
+    parser.add_argument("--single", action="store_true",
+                        help="extract: use the single-pass text extractor instead of the two-pass pipeline")
+    parser.add_argument("--no-cache", action="store_true", help="bypass the result cache")
+    parser.add_argument("--json", action="store_true", help="print the raw JSON reply")
+    parser.add_argument("--spawn", action="store_true", help="start the daemon if it is not running")
+    parser.add_argument("--headless", action="store_true", help="with --spawn: start it without the window")
+    args = parser.parse_args(argv)
+
+    request = {"cmd": args.command}
+    if args.command == "extract":
+        if not args.image:
+            parser.error("extract needs an image path")
+        request.update(path=os.path.abspath(args.image), single=args.single, use_cache=not args.no_cache)
+    elif args.command == "capture":
+        request.update(wait=args.wait, use_cache=not args.no_cache, multi=args.multi)
+
+    if args.spawn and not is_running():
+        if not spawn_daemon(["--headless"] if args.headless else []):
+            print("Daemon did not start; run `python daemon.py` to see why", file=sys.stderr)
+            return 2
+    try:
+        reply = send_command(request, timeout=5 if args.command in ("ping", "status") else None)
+    except OSError as e:
+        print(f"Daemon not reachable at {socket_path()} ({e}); start it with `python daemon.py`"
+              " or pass --spawn", file=sys.stderr)
+        return 2
+    if not reply.get("ok"):
+        print(f"Error: {reply.get('error', 'unknown error')}", file=sys.stderr)
+        return 1
+    print_reply(reply, args.json)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+Watch mode: re-capture a fixed screen region on an interval and re-query the
+model only when its pixels change.
+
+Each tick grabs just the remembered rectangle and compares it with the last
+frame the model saw: an identical hash skips the frame outright, and a
+thresholded pixel diff gives the bounding box of what changed. The region is
+OCR'd in overlapping bands (see tiling.py); only bands that intersect the
+changed box are sent again, and the text is re-stitched from the cached
+bands. The visual description is refreshed only when a large enough share of
+the region changed.
+"""
+
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import ImageChops
+
+from settings import get_section
+from image_pipeline import PreparedImage, prepare_image, get_preprocess_settings
+from tiling import prepare_tiles, merge_tile_texts
+from ollama_vision_twopass import (OllamaSession, GenerationCancelled, TEXT_PROMPT,
+                                   VISUAL_PROMPT_STANDALONE, get_ollama_settings)
+
+DEFAULT_WATCH = {
+    "interval": 2.0,                 # seconds between grabs
+    "pixel_threshold": 24,           # per-channel difference below this counts as noise
+    "margin": 8,                     # pixels added around the changed box
+    "band_height": 336,              # OCR band height; only bands touching a change are re-read
+    "band_overlap": 28,
+    "max_band_width": 1568,
+    "visual_refresh_fraction": 0.25, # re-describe when at least this share of the area changed
+    "max_workers": 4,
+    "stop_loops": False,             # apply stream_guard's loop cut-off; log windows repeat legitimately
+}
+
+
+def get_watch_settings():
+    cfg = dict(DEFAULT_WATCH)
+    cfg.update(get_section("watch"))
+    return cfg
+
+
+def frame_digest(img):
+    """Cheap exact-match hash of a frame's pixels."""
+    return hashlib.blake2b(img.tobytes(), digest_size=16).hexdigest()
+
+
+def changed_region(prev, cur, threshold=24, margin=8):
+    """Bounding box of the pixels that differ by more than `threshold`, or None."""
+    if prev is None or prev.size != cur.size:
+        return (0, 0, cur.width, cur.height)
+    diff = ImageChops.difference(prev.convert("RGB"), cur.convert("RGB")).convert("L")
+    bbox = diff.point(lambda v: 255 if v > threshold else 0).getbbox()
+    if bbox is None:
+        return None
+    left, top, right, bottom = bbox
+    return (max(0, left - margin), max(0, top - margin),
+            min(cur.width, right + margin), min(cur.height, bottom + margin))
+
+
+def _intersects(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _area(box):
+    return (box[2] - box[0]) * (box[3] - box[1])
+
+
+class RegionWatcher:
+    """Poll a screen rectangle and call on_result(result) whenever its content changes.
+
+    result is {"text", "visual", "changed_box", "bands_read", "bands_total"};
+    on_status(message) reports skipped frames and errors. `grab` defaults to
+    screen_capture.grab_region.
+    """
+
+    def __init__(self, bbox, on_result, on_status=None, model=None, interval=None, grab=None):
+        self.bbox = tuple(bbox)
+        self.on_result = on_result
+        self.on_status = on_status
+        self.cfg = get_watch_settings()
+        if interval is not None:
+            self.cfg["interval"] = interval
+        if grab is None:
+            from screen_capture import grab_region
+            grab = grab_region
+        self.grab = grab
+        self.model = model or get_ollama_settings()[1]
+        self._frame = None
+        self._digest = None
+        self._band_texts = {}
+        self._visual = ""
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    def _status(self, message):
+        if self.on_status:
+            self.on_status(message)
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.time()
+            try:
+                result = self.tick()
+                if result is not None:
+                    self.on_result(result)
+            except GenerationCancelled:
+                break
+            except Exception as e:
+                print(f"[DEBUG] watch tick failed: {e}")
+                self._status(f"Watch error: {e}")
+            self._stop.wait(max(0.0, self.cfg["interval"] - (time.time() - started)))
+
+    def tick(self):
+        """Grab once; returns a result if the region changed, else None."""
+        frame = self.grab(self.bbox)
+        digest = frame_digest(frame)
+        if digest == self._digest:
+            self._status(f"No change ({time.strftime('%H:%M:%S')})")
+            return None
+        changed = changed_region(self._frame, frame, self.cfg["pixel_threshold"], self.cfg["margin"])
+        if changed is None:
+            # Below the noise threshold; keep comparing against the frame the model saw
+            self._status(f"No change ({time.strftime('%H:%M:%S')})")
+            return None
+
+        first = self._frame is None
+        band_cfg = {"tile_height": self.cfg["band_height"], "max_tile_width": self.cfg["max_band_width"],
+                    "overlap": self.cfg["band_overlap"]}
+        variant = get_preprocess_settings(self.model)["ocr_variant"]
+        bands = prepare_tiles(PreparedImage(frame, ocr_variant=variant), self.model, band_cfg)
+        dirty = [(r, c, tile) for r, c, box, tile in bands if first or _intersects(box, changed)]
+        refresh_visual = first or _area(changed) >= self.cfg["visual_refresh_fraction"] * _area(
+            (0, 0, frame.width, frame.height))
+
+        jobs = {(r, c): (TEXT_PROMPT, tile) for r, c, tile in dirty}
+        if refresh_visual:
+            jobs["visual"] = (VISUAL_PROMPT_STANDALONE, prepare_image(frame, model=self.model))
+        self._status(f"Change detected, reading {len(dirty)}/{len(bands)} bands...")
+        with ThreadPoolExecutor(max_workers=max(1, self.cfg["max_workers"])) as pool:
+            futures = {key: pool.submit(self._ask, prompt, image) for key, (prompt, image) in jobs.items()}
+            replies = {key: f.result() for key, f in futures.items()}
+
+        if refresh_visual:
+            self._visual = replies.pop("visual")
+        keys = {(r, c) for r, c, _, _ in bands}
+        self._band_texts = {k: v for k, v in self._band_texts.items() if k in keys}
+        self._band_texts.update(replies)
+        self._frame, self._digest = frame, digest
+        return {
+            "text": merge_tile_texts(self._band_texts, self.cfg["band_overlap"]),
+            "visual": self._visual,
+            "changed_box": changed,
+            "bands_read": len(dirty),
+            "bands_total": len(bands),
+        }
+
+    def _ask(self, prompt, image):
+        session = OllamaSession(model=self.model)
+        if not self.cfg["stop_loops"]:
+            session.guard_cfg = dict(session.guard_cfg, enabled=False)
+        try:
+            return session.ask(prompt, images=[image.b64], cancel_event=self._stop)
+        finally:
+            session.close()